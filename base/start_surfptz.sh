@@ -6,4 +6,5 @@ rfcomm bind rfcomm0 00:0C:BF:16:58:31
 export PYTHONPATH=/home/aaron/surfptz/base/surfptz_base/
 export FLASK_APP=/home/aaron/surfptz/base/surfptz_base/server.py
 #python -m robot_cameraman --gimbal Bescor --detectionEngine Dummy --identifyToPanasonicCameraAs surfptz
-python -m flask run --host=0.0.0.0
\ No newline at end of file
+#python -m flask run --host=0.0.0.0
+python -m uvicorn asgi_server:app --host 0.0.0.0 --port 5000
@@ -0,0 +1,400 @@
+"""
+Production server with the same API as server.py, on ASGI (Starlette):
+
+    uvicorn asgi_server:app --host 0.0.0.0 --port 5000
+
+or python asgi_server.py. Needs starlette and uvicorn, which the Flask
+development server doesn't.
+
+Nothing happens at import, the BaseStation is created in the lifespan hook.
+The event loop never blocks on hardware: gimbal, tracking, camera and
+waiting calls each run on their own executor, so a 40 s gimbal initialize or
+a slow camera can't hold up a 10 Hz stream of tag positions. /api/stop has
+an executor of its own too, so it never waits behind a gimbal move.
+"""
+import asyncio
+import contextlib
+import functools
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import (FileResponse, JSONResponse, PlainTextResponse,
+                                 Response, StreamingResponse)
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+import params
+from gimbal import MotionAborted, OriginNotSet
+from params import ParamError, parse_params
+from station import BaseStation
+from wire import Fix, decode_fixes
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# The relays take one exclusive action (initialize) at a time, and tracker
+# updates must stay in order, so those get a single worker each. Aiming only
+# posts to the MotionController mailbox and runs on 'tracking', so it never
+# waits behind initialize.
+EXECUTOR_WORKERS = {
+    'gimbal': 1,
+    # Emergency stop, which must not queue behind initialize on 'gimbal'
+    'stop': 1,
+    'tracking': 1,
+    'camera': 4,
+    # Long polls, live view viewers and clip exports
+    'wait': 32,
+}
+
+
+async def run(request, executor: str, fn, *args, **kwargs):
+    """
+    Call the blocking fn on one of the app's executors.
+    """
+    executors = request.app.state.executors
+    return await asyncio.get_running_loop().run_in_executor(
+        executors[executor], functools.partial(fn, *args, **kwargs))
+
+
+def _station(request) -> BaseStation:
+    return request.app.state.station
+
+
+async def initialize(request: Request):
+    station = _station(request)
+    await run(request, 'gimbal', station.motion.run_exclusive,
+              station.gimbal.initialize)
+    return Response(status_code=204)
+
+
+async def angle(request: Request):
+    args = parse_params(request.query_params, params.ANGLE)
+    body = await run(request, 'tracking', _station(request).start_motion,
+                     yaw_angle=args['pan'], pitch_angle=args['tilt'])
+    return JSONResponse(body, 202)
+
+
+async def motion_status(request: Request):
+    motion_id = request.path_params['motion_id']
+    status = _station(request).motion.status(motion_id)
+    if status is None:
+        return PlainTextResponse(f"Unknown motion id {motion_id}", 404)
+    return JSONResponse({'motion_id': motion_id, 'status': status})
+
+
+async def stop(request: Request):
+    await run(request, 'stop', _station(request).motion.halt)
+    return Response(status_code=204)
+
+
+def _zoom(command: str):
+    async def zoom(request: Request):
+        station = _station(request)
+        # Manual zoom takes over from auto zoom
+        station.auto_zoom.set_enabled(False)
+        station.camera_commands.submit(command)
+        return Response(status_code=202)
+    return zoom
+
+
+async def set_auto_zoom(request: Request):
+    auto_zoom = _station(request).auto_zoom
+    enabled = parse_params(request.query_params, params.ENABLED)['enabled']
+    if enabled is None:
+        return JSONResponse({'enabled': auto_zoom.enabled,
+                             'zoom_ratio': auto_zoom.zoom_ratio,
+                             'distance': auto_zoom.distance})
+    auto_zoom.set_enabled(enabled)
+    return Response(status_code=204)
+
+
+def _recording(command: str):
+    async def recording(request: Request):
+        station = _station(request)
+        # Manual recording takes over from auto recording
+        station.ride_detector.set_enabled(False)
+        return JSONResponse(await run(request, 'camera',
+                                      station.camera_mgr.broadcast, command))
+    return recording
+
+
+async def set_auto_record(request: Request):
+    ride_detector = _station(request).ride_detector
+    enabled = parse_params(request.query_params, params.ENABLED)['enabled']
+    if enabled is None:
+        return JSONResponse(ride_detector.status())
+    ride_detector.set_enabled(enabled)
+    return Response(status_code=204)
+
+
+async def rides(request: Request):
+    since = parse_params(request.query_params, params.RIDES)['since']
+    return JSONResponse(await run(
+        request, 'wait', _station(request).ride_detector.index.read, since))
+
+
+async def camera_connection(request: Request):
+    return JSONResponse(_station(request).camera_mgr.states())
+
+
+async def camera_stats(request: Request):
+    return JSONResponse(_station(request).camera_mgr.stats.to_dict())
+
+
+async def live_view_stats(request: Request):
+    return JSONResponse(_station(request).live_view_pipeline.stats())
+
+
+async def clip(request: Request):
+    args = parse_params(request.query_params, params.CLIP)
+    end = args['end'] if args['end'] is not None else time.time()
+    start = args['start'] if args['start'] is not None \
+        else end - args['seconds']
+    path = await run(request, 'wait', _station(request).export_clip,
+                     start, end)
+    if path is None:
+        return PlainTextResponse('No buffered frames in that window', 404)
+    return FileResponse(path, media_type='video/x-msvideo',
+                        filename=os.path.basename(path))
+
+
+async def clip_buffer(request: Request):
+    return JSONResponse(_station(request).frame_ring.stats())
+
+
+async def _frames(request, hub):
+    """
+    Frames of hub as they arrive, waiting on the wait executor.
+    """
+    last_seq = -1
+    while True:
+        frame = await run(request, 'wait', hub.wait_newer, last_seq, 1.)
+        if frame is not None:
+            last_seq = frame.seq
+            yield frame
+
+
+async def live(request: Request):
+    """
+    MJPEG stream of the live view of camera (default the primary one),
+    passed through without re-encoding.
+    """
+    station = _station(request)
+    camera = parse_params(request.query_params, params.LIVE)['camera']
+    hub = station.frame_hub_for(camera)
+    if hub is None:
+        return PlainTextResponse(f"Unknown camera {camera}", 404)
+
+    async def stream():
+        async for frame in _frames(request, hub):
+            yield (b'--frame\r\nContent-Type: image/jpeg\r\n'
+                   b'Content-Length: ' + str(len(frame.jpeg)).encode() +
+                   b'\r\n\r\n' + frame.jpeg + b'\r\n')
+
+    return StreamingResponse(
+        stream(), media_type='multipart/x-mixed-replace; boundary=frame')
+
+
+async def live_ws(websocket: WebSocket):
+    """
+    Live view of camera (default the primary one) as one binary WebSocket
+    message per JPEG frame.
+    """
+    camera = parse_params(websocket.query_params, params.LIVE)['camera']
+    hub = _station(websocket).frame_hub_for(camera)
+    if hub is None:
+        await websocket.close(code=1008, reason=f"Unknown camera {camera}")
+        return
+    await websocket.accept()
+    try:
+        async for frame in _frames(websocket, hub):
+            await websocket.send_bytes(frame.jpeg)
+    except WebSocketDisconnect:
+        pass
+
+
+async def position_stats(request: Request):
+    return JSONResponse(_station(request).position_receiver.stats())
+
+
+async def camera_state(request: Request):
+    """
+    Camera state from the live view. With since=<version> the request waits
+    up to 'timeout' seconds (default 10) for a newer version.
+    """
+    telemetry = _station(request).camera_telemetry
+    args = parse_params(request.query_params, params.CAMERA_STATE)
+    if args['since'] is None:
+        return JSONResponse(telemetry.state())
+    return JSONResponse(await run(request, 'wait', telemetry.wait_for_change,
+                                  args['since'], args['timeout']))
+
+
+async def set_declination(request: Request):
+    return PlainTextResponse('Not implemented', 501)
+
+
+async def get_angles(request: Request):
+    angles = await run(request, 'tracking',
+                       _station(request).gimbal.get_angles)
+    return PlainTextResponse(f"{angles}")
+
+
+async def relative_coordinates(request: Request):
+    """
+    Point the gimbal at coordinates specified in meters.
+    """
+    station = _station(request)
+    args = parse_params(request.query_params, params.RELCOORDS)
+
+    def aim():
+        yaw_angle, pitch_angle = station.gimbal.rel_coords_to_angles(
+            northing=args['n'], easting=args['e'], elevation=args['el'])
+        return station.start_motion(yaw_angle=yaw_angle,
+                                    pitch_angle=pitch_angle)
+
+    return JSONResponse(await run(request, 'tracking', aim), 202)
+
+
+async def set_origin(request: Request):
+    args = parse_params(request.query_params, params.ORIGIN)
+    await run(request, 'tracking', _station(request).gimbal.set_origin,
+              lat=args['lat'], lon=args['lon'])
+    return Response(status_code=204)
+
+
+def _ingest_and_aim(station: BaseStation, tag_id: str,
+                    fixes) -> Tuple[int, dict]:
+    """
+    Feed fixes to the station and point the gimbal at the scheduled tag.
+    Returns the number of accepted fixes and the aim_at_target body.
+    """
+    now = station.gimbal.clock.monotonic()
+    accepted = station.ingest_fixes(tag_id, fixes, now)
+    logger.debug(f'tag={tag_id} {accepted}/{len(fixes)} fixes')
+    return accepted, station.aim_at_target(now)
+
+
+async def absolute_coordinates(request: Request):
+    args = parse_params(request.query_params, params.ABSCOORDS)
+    fix = Fix(time.time(), args['lat'], args['lon'])
+    _, body = await run(request, 'tracking', _ingest_and_aim,
+                        _station(request), args['tag'], [fix])
+    return JSONResponse(body, 202)
+
+
+async def track(request: Request):
+    """
+    Batch of timestamped fixes from the tag app in the wire.py format. All
+    fixes update the tracker, the gimbal is pointed once for the batch.
+    """
+    try:
+        tag_id, fixes = decode_fixes(await request.body())
+    except ValueError as e:
+        return PlainTextResponse(f"Invalid fix batch: {e}", 400)
+    if not fixes:
+        return JSONResponse({'accepted': 0})
+    accepted, body = await run(request, 'tracking', _ingest_and_aim,
+                               _station(request), tag_id, fixes)
+    return JSONResponse({'accepted': accepted, **body}, 202)
+
+
+async def tags(request: Request):
+    return JSONResponse(_station(request).tags())
+
+
+async def follow(request: Request):
+    """
+    Always follow the tag given by the 'tag' query parameter, or go back to
+    automatic scheduling without it.
+    """
+    tag_id = parse_params(request.query_params, params.FOLLOW)['tag']
+    _station(request).scheduler.pin(tag_id or None)
+    return Response(status_code=204)
+
+
+async def param_error(request: Request, e: ParamError):
+    return PlainTextResponse(str(e), 400)
+
+
+async def motion_aborted(request: Request, e: MotionAborted):
+    return PlainTextResponse(f"Stopped: {e}", 409)
+
+
+async def origin_not_set(request: Request, e: OriginNotSet):
+    return PlainTextResponse(str(e), 409)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: Starlette):
+    app.state.executors = {
+        name: ThreadPoolExecutor(max_workers=workers,
+                                 thread_name_prefix=name)
+        for name, workers in EXECUTOR_WORKERS.items()}
+    loop = asyncio.get_running_loop()
+    station = await loop.run_in_executor(app.state.executors['gimbal'],
+                                         BaseStation)
+    station.start()
+    app.state.station = station
+    try:
+        yield
+    finally:
+        await loop.run_in_executor(app.state.executors['gimbal'],
+                                   station.stop)
+        for executor in app.state.executors.values():
+            executor.shutdown(wait=False)
+
+
+BOTH = ['GET', 'POST']
+
+routes = [
+    Route('/api/initialize', initialize, methods=BOTH),
+    Route('/api/angle', angle, methods=BOTH),
+    Route('/api/motion/{motion_id:int}', motion_status, methods=['GET']),
+    Route('/api/stop', stop, methods=BOTH),
+    Route('/api/zoom_in', _zoom('zoom_in_slow'), methods=BOTH),
+    Route('/api/zoom_out', _zoom('zoom_out_slow'), methods=BOTH),
+    Route('/api/zoom_stop', _zoom('zoom_stop'), methods=BOTH),
+    Route('/api/auto_zoom', set_auto_zoom, methods=BOTH),
+    Route('/api/start_recording', _recording('video_recstart'), methods=BOTH),
+    Route('/api/stop_recording', _recording('video_recstop'), methods=BOTH),
+    Route('/api/auto_record', set_auto_record, methods=BOTH),
+    Route('/api/rides', rides, methods=['GET']),
+    Route('/api/camera_connection', camera_connection, methods=['GET']),
+    Route('/api/camera_stats', camera_stats, methods=['GET']),
+    Route('/api/live_view_stats', live_view_stats, methods=['GET']),
+    Route('/api/clip', clip, methods=BOTH),
+    Route('/api/clip_buffer', clip_buffer, methods=['GET']),
+    Route('/api/live', live, methods=['GET']),
+    WebSocketRoute('/api/live/ws', live_ws),
+    Route('/api/position_stats', position_stats, methods=['GET']),
+    Route('/api/camera_state', camera_state, methods=['GET']),
+    Route('/api/set_declination', set_declination, methods=BOTH),
+    Route('/api/get_angles', get_angles, methods=BOTH),
+    Route('/api/relcoords', relative_coordinates, methods=BOTH),
+    Route('/api/set_origin', set_origin, methods=BOTH),
+    Route('/api/abscoords', absolute_coordinates, methods=BOTH),
+    Route('/api/track', track, methods=['POST']),
+    Route('/api/tags', tags, methods=['GET']),
+    Route('/api/follow', follow, methods=BOTH),
+]
+
+app = Starlette(routes=routes, lifespan=lifespan,
+                exception_handlers={ParamError: param_error,
+                                    MotionAborted: motion_aborted,
+                                    OriginNotSet: origin_not_set})
+
+
+def _main():
+    import uvicorn
+    logging.basicConfig(level=logging.INFO)
+    uvicorn.run(app, host=os.environ.get('SURFPTZ_HOST', '0.0.0.0'),
+                port=int(os.environ.get('SURFPTZ_PORT', 5000)))
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,44 @@
+import json
+import logging
+import os
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+DEFAULT_CALIBRATION_PATH = os.path.expanduser('~/.surfptz/calibration.json')
+
+
+@dataclass
+class Calibration:
+    """
+    Result of BescorGimbal.initialize: IMU readings at the mechanical limits
+    of each axis and the measured full-speed slew rates in degrees per
+    second.
+    """
+    imu_yaw_at_max_cw: float
+    imu_yaw_at_max_ccw: float
+    imu_pitch_at_min: float
+    imu_pitch_at_max: float
+    yaw_slew_rate: float
+    pitch_slew_rate: float
+
+    def save(self, path: str = DEFAULT_CALIBRATION_PATH) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(asdict(self), f, indent=2)
+        os.replace(tmp_path, path)
+        logger.info(f'Saved calibration to {path}')
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_CALIBRATION_PATH
+             ) -> Optional['Calibration']:
+        try:
+            with open(path) as f:
+                return cls(**json.load(f))
+        except FileNotFoundError:
+            return None
+        except (ValueError, TypeError) as e:
+            logger.warning(f'Ignoring unreadable calibration {path}: {e}')
+            return None
@@ -0,0 +1,37 @@
+import threading
+import time
+
+
+class Clock:
+    """
+    Wall clock used by the gimbal control code. Swapped for a ScaledClock to
+    run against a simulated gimbal faster than real time.
+    """
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+    def wait(self, event: threading.Event, timeout: float) -> bool:
+        return event.wait(timeout)
+
+
+class ScaledClock(Clock):
+    """
+    Clock running speedup times faster than real time.
+    """
+
+    def __init__(self, speedup: float = 1.) -> None:
+        self.speedup = speedup
+        self._start = time.monotonic()
+
+    def monotonic(self) -> float:
+        return (time.monotonic() - self._start) * self.speedup
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds / self.speedup)
+
+    def wait(self, event: threading.Event, timeout: float) -> bool:
+        return event.wait(timeout / self.speedup)
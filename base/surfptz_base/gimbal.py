@@ -1,18 +1,56 @@
 import logging
-from time import sleep
 import math
-from typing import Tuple
+import threading
+from typing import Tuple, Optional, List
 
+import numpy as np
 from pyproj import Transformer
 
+from calibration import Calibration, DEFAULT_CALIBRATION_PATH
+from clock import Clock
+from imu import ImuIngest, ImuRingBuffer, WitmotionSource
+from planner import YawPlan, plan_yaw
+from pwm import RelayPulser, pulse_duration
+
 logger: logging.Logger = logging.getLogger(__name__)
 
+CONTROL_MODES = ('bangbang', 'pulse')
+
+
+class MotionAborted(Exception):
+    """
+    Raised by a blocking move (initialize, goto) when abort is set.
+    """
+
+
+class OriginNotSet(Exception):
+    """
+    Raised when GPS positions are converted before set_origin was called.
+    """
+
 def to_0_360(angle):
     if angle < 0:
         return angle + 360
     else:
         return angle
 
+def _unwrap_degrees(angles: np.ndarray) -> np.ndarray:
+    return np.degrees(np.unwrap(np.radians(angles)))
+
+
+def local_transformer(lat: float, lon: float) -> Transformer:
+    """
+    Transformer from WGS84 (lon, lat) to a transverse mercator (easting,
+    northing) in meters centered on lat, lon.
+    """
+    return Transformer.from_crs(
+        4326,
+        f"+proj=tmerc +ellps=WGS84 "
+        f"+lat_0={lat} "
+        f"+lon_0={lon}",
+        always_xy=True)
+
+
 class BescorGimbal:
     """
     This gimbal class is for use with this combination of products:
@@ -20,17 +58,56 @@ class BescorGimbal:
      - Witmotion BWT901CL intertial motion unit
      - Relay 4 Zero 3V 4 Channel Relay Shield for Raspberry Pi
     """
-    def __init__(self):
-        from gpiozero import LED
-        from witmotion import IMU
+    def __init__(
+            self,
+            imu: Optional[ImuIngest] = None,
+            yaw_relays: Optional[List] = None,
+            pitch_relays: Optional[List] = None,
+            clock: Optional[Clock] = None,
+    ):
+        """
+        By default this talks to the relay shield and the IMU on
+        /dev/rfcomm0. Pass imu, yaw_relays, pitch_relays and clock to run
+        against other hardware or a simulation (see simulation.py).
+        """
+        self.clock = clock or Clock()
         self.deadband: float = 2
+        if yaw_relays is None:
+            from gpiozero import LED
+            yaw_relays = [LED("BOARD31"), LED("BOARD33")]
+        if pitch_relays is None:
+            from gpiozero import LED
+            pitch_relays = [LED("BOARD35"), LED("BOARD37")]
         # CCW 345->0aka360->355 , CW 355->360aka0->345
-        self.yaw_relays = [LED("BOARD31"), LED("BOARD33")]
+        self.yaw_relays = yaw_relays
         # down, up
-        self.pitch_relays = [LED("BOARD35"), LED("BOARD37")]
-        # TODO intelligently find IMU device path
-        self.imu = IMU(path='/dev/rfcomm0', baudrate=115200)
+        self.pitch_relays = pitch_relays
+        if imu is None:
+            # TODO intelligently find IMU device path
+            imu = ImuIngest(WitmotionSource(path='/dev/rfcomm0',
+                                            baudrate=115200))
+        self.imu = imu
+        # Stop the relays if the newest IMU sample is older than this
+        self.imu_max_age: float = 0.5
         self.update_interval: float = 0.5
+        # 'bangbang' holds a relay on until the error is inside deadband.
+        # 'pulse' switches relays on for a duration computed from the error
+        # and the slew rate, and can settle inside a tighter deadband. The
+        # station sets it from SURFPTZ_CONTROL_MODE.
+        self.control_mode: str = 'bangbang'
+        self.pulse_deadband: float = 0.5
+        # Full-speed slew rates in degrees per second, see notes.md
+        self.yaw_slew_rate: float = 360 / 46
+        self.pitch_slew_rate: float = 25.8 / 14
+        # Seconds the head keeps moving (as seen by the IMU) after a relay
+        # switches off
+        self.coast_time: float = 0.1
+        self.pulser = RelayPulser(clock=self.clock.monotonic,
+                                  sleep=self.clock.sleep)
+        self.pulser.start()
+        # Set by an emergency stop to end initialize or goto between relay
+        # updates, without waiting for whoever holds the relays
+        self.abort = threading.Event()
         self.yaw_target_reached: bool = True
         self.pitch_target_reached: bool = True
         self._declination = 11.46 # San Clemente 2022 magnetic declination
@@ -41,10 +118,14 @@ class BescorGimbal:
         # hard-coded to san clemente for now
         self._declination = 11.36
         self._origin_latlon = None
+        # Cached by set_origin, since building a Transformer is expensive
+        self._origin_transformer = None
+        self._origin_m = None
 
     def __del__(self):
         logger.info('Stopping gimbal motion')
         self.stop()
+        self.pulser.close()
         logger.info('Freeing gimbal GPIOs')
         [yr.close() for yr in self.yaw_relays + self.pitch_relays]
         logger.info('Disconnecting from IMU')
@@ -52,11 +133,44 @@ class BescorGimbal:
 
     def get_bearing(self):
         return to_0_360(self.imu.last_yaw) + self._declination
+
+    def plan_yaw(self, yaw_angle: float) -> Optional[YawPlan]:
+        """
+        Plan the move from the current yaw to bearing yaw_angle along the
+        side that doesn't cross the deadzone. None before the IMU has
+        reported a yaw.
+        """
+        if self.imu.last_yaw is None:
+            return None
+        return plan_yaw(current=to_0_360(self.imu.last_yaw),
+                        target=(yaw_angle - self._declination) % 360,
+                        max_cw=self._imu_yaw_at_max_cw,
+                        max_ccw=self._imu_yaw_at_max_ccw,
+                        slew_rate=self.yaw_slew_rate)
+
+    def clamp_pitch(self, pitch_angle: float) -> float:
+        if self._imu_pitch_at_min is None or self._imu_pitch_at_max is None:
+            return pitch_angle
+        return min(max(pitch_angle, self._imu_pitch_at_min),
+                   self._imu_pitch_at_max)
+
+    def time_to_target(self, yaw_angle: float,
+                       pitch_angle: float) -> Optional[float]:
+        """
+        Estimated seconds for both axes to reach yaw_angle and pitch_angle at
+        full speed. None while the IMU data is missing or stale, since the
+        current position isn't known.
+        """
+        if self.imu.is_stale(self.imu_max_age):
+            return None
+        pitch_error = self.imu.last_pitch - self.clamp_pitch(pitch_angle)
+        return max(self.plan_yaw(yaw_angle).eta,
+                   abs(pitch_error) / self.pitch_slew_rate)
     
     def log_gimbal_and_sleep(self, total_time_s, interval_s=0.5):
         for ind in range(0, math.ceil(total_time_s / interval_s)):
             logger.info(f'yaw: {to_0_360(self.imu.last_yaw)}, pitch: {self.imu.last_pitch}')
-            sleep(interval_s)
+            self.clock.sleep(interval_s)
 
     def is_in_yaw_deadzone(self, angle) -> bool:
         """
@@ -72,29 +186,89 @@ class BescorGimbal:
             return (self._imu_yaw_at_max_cw < angle) or\
                    (angle < self._imu_yaw_at_max_ccw)
 
-    def initialize(self):
+    def _sweep(
+            self,
+            relay,
+            column: int,
+            max_time: float,
+            plateau_time: float = 1.0,
+            tolerance: float = 0.5,
+    ) -> Tuple[float, Optional[float]]:
+        """
+        Hold relay on until the IMU angle in column of the sample buffer has
+        stayed within tolerance degrees for plateau_time seconds (the axis
+        hit its stop), or until max_time. Returns the final angle and the
+        slew rate seen on the way, if the axis moved. Raises MotionAborted
+        once abort is set, and RuntimeError without fresh IMU data.
+        """
+        if self.imu.is_stale(self.imu_max_age):
+            raise RuntimeError(f'Cannot sweep, no IMU data for '
+                               f'{self.imu.age():.1f}s')
+        start = self.clock.monotonic()
+        relay.on()
+        try:
+            while True:
+                self.clock.sleep(0.1)
+                if self.abort.is_set():
+                    raise MotionAborted('sweep aborted')
+                now = self.clock.monotonic()
+                if now - start > max_time:
+                    logger.warning(f'No plateau after {max_time}s of sweep')
+                    break
+                if now - start < plateau_time:
+                    continue
+                recent = self.imu.buffer.since(now - plateau_time)
+                if len(recent) < 2:
+                    continue
+                angles = _unwrap_degrees(recent[:, column])
+                logger.info(f'sweep angle: {angles[-1]}')
+                if np.ptp(angles) < tolerance:
+                    break
+        finally:
+            relay.off()
+        samples = self.imu.buffer.since(start)
+        if not len(samples) or self.imu.is_stale(self.imu_max_age):
+            raise RuntimeError(f'IMU stopped reporting during the sweep, '
+                               f'no data for {self.imu.age():.1f}s')
+        angles = _unwrap_degrees(samples[:, column])
+        final = float(samples[-1, column])
+        moving = np.abs(angles - angles[-1]) > tolerance
+        if not moving.any():
+            return final, None
+        duration = samples[moving][-1, ImuRingBuffer.T] - \
+            samples[0, ImuRingBuffer.T]
+        if duration <= 0:
+            return final, None
+        return final, abs(angles[-1] - angles[0]) / duration
 
+    def initialize(self, path: str = DEFAULT_CALIBRATION_PATH) -> Calibration:
+        """
+        Find the range of each axis by driving it against its stops, stopping
+        as soon as the IMU reading settles, and save the result to path.
+        An abort leaves the previous calibration in place.
+        """
         # PITCH
         logger.info('Finding pitch range')
-        self.pitch_relays[0].on()
-        self.log_gimbal_and_sleep(20)
-        self.pitch_relays[0].off()
-        self._imu_pitch_at_min = self.imu.last_pitch
-        self.pitch_relays[1].on()
-        self.log_gimbal_and_sleep(20)
-        self.pitch_relays[1].off()
-        self._imu_pitch_at_max = self.imu.last_pitch
+        imu_pitch_at_min, _ = self._sweep(
+            self.pitch_relays[0], ImuRingBuffer.PITCH, max_time=20)
+        imu_pitch_at_max, pitch_slew_rate = self._sweep(
+            self.pitch_relays[1], ImuRingBuffer.PITCH, max_time=20)
 
         # YAW
         logger.info('Finding yaw range')
-        self.yaw_relays[1].on()
-        self.log_gimbal_and_sleep(50)
-        self.yaw_relays[1].off()
-        self._imu_yaw_at_max_cw = to_0_360(self.imu.last_yaw)
-        self.yaw_relays[0].on()
-        self.log_gimbal_and_sleep(50)
-        self.yaw_relays[0].off()
-        self._imu_yaw_at_max_ccw = to_0_360(self.imu.last_yaw)
+        imu_yaw_at_max_cw, _ = self._sweep(
+            self.yaw_relays[1], ImuRingBuffer.YAW, max_time=50)
+        imu_yaw_at_max_ccw, yaw_slew_rate = self._sweep(
+            self.yaw_relays[0], ImuRingBuffer.YAW, max_time=50)
+
+        self._imu_pitch_at_min = imu_pitch_at_min
+        self._imu_pitch_at_max = imu_pitch_at_max
+        self._imu_yaw_at_max_cw = to_0_360(imu_yaw_at_max_cw)
+        self._imu_yaw_at_max_ccw = to_0_360(imu_yaw_at_max_ccw)
+
+        # Keep the previous estimates if an axis was already at its stop
+        self.pitch_slew_rate = pitch_slew_rate or self.pitch_slew_rate
+        self.yaw_slew_rate = yaw_slew_rate or self.yaw_slew_rate
 
         logger.info(f'Pitch range found to be'
                     f'{self._imu_pitch_at_min} '
@@ -102,29 +276,79 @@ class BescorGimbal:
         logger.info(f'Yaw max found to be: '
                     f'{self._imu_yaw_at_max_cw} clockwise, and '
                     f'to {self._imu_yaw_at_max_ccw} counterclockwise.')
+        logger.info(f'Slew rates found to be {self.yaw_slew_rate} yaw, '
+                    f'{self.pitch_slew_rate} pitch')
+        calibration = self.get_calibration()
+        calibration.save(path)
+        return calibration
+
+    def get_calibration(self) -> Calibration:
+        return Calibration(
+            imu_yaw_at_max_cw=self._imu_yaw_at_max_cw,
+            imu_yaw_at_max_ccw=self._imu_yaw_at_max_ccw,
+            imu_pitch_at_min=self._imu_pitch_at_min,
+            imu_pitch_at_max=self._imu_pitch_at_max,
+            yaw_slew_rate=self.yaw_slew_rate,
+            pitch_slew_rate=self.pitch_slew_rate)
+
+    def load_calibration(self, path: str = DEFAULT_CALIBRATION_PATH) -> bool:
+        """
+        Apply a calibration saved by initialize. Returns False if there is
+        none, in which case initialize has to be run.
+        """
+        calibration = Calibration.load(path)
+        if calibration is None:
+            return False
+        self._imu_yaw_at_max_cw = calibration.imu_yaw_at_max_cw
+        self._imu_yaw_at_max_ccw = calibration.imu_yaw_at_max_ccw
+        self._imu_pitch_at_min = calibration.imu_pitch_at_min
+        self._imu_pitch_at_max = calibration.imu_pitch_at_max
+        self.yaw_slew_rate = calibration.yaw_slew_rate
+        self.pitch_slew_rate = calibration.pitch_slew_rate
+        logger.info(f'Loaded calibration from {path}: {calibration}')
+        return True
 
     def set_origin(self, lon, lat):
-        self._origin_latlon = (lon, lat)
+        if self._origin_latlon == (lat, lon):
+            return
+        self._origin_latlon = (lat, lon)
+        self._origin_transformer = local_transformer(lat=lat, lon=lon)
+        # Convert origin to transverse mercator centered on origin
+        self._origin_m = self._origin_transformer.transform(lon, lat)
+        logger.info(f'origin: {self._origin_m}')
 
     def goto(
             self,
             yaw_angle: float,
             pitch_angle: float,
     ) -> None:
+        """
+        Block until the gimbal reaches yaw_angle and pitch_angle. Raises
+        MotionAborted once abort is set.
+        """
+        while not self.step(yaw_angle=yaw_angle, pitch_angle=pitch_angle):
+            if self.clock.wait(self.abort, self.update_interval):
+                self.stop()
+                raise MotionAborted('goto aborted')
+
+    def step(
+            self,
+            yaw_angle: float,
+            pitch_angle: float,
+    ) -> bool:
+        """
+        Run a single control update towards yaw_angle and pitch_angle.
+        Returns True once both axes are within the deadband.
+        """
         self.yaw_target_reached = False
         self.pitch_target_reached = False
-        while not (self.yaw_target_reached and self.pitch_target_reached):
-            # Check that there is IMU data when we command any movement
-            if self.imu.last_a:
-                # Check if the gimbal can get to this yaw
-                if self.is_in_yaw_deadzone(yaw_angle):
-                    self.control(yaw_angle=yaw_angle, pitch_angle=pitch_angle)
-                else:
-                    logger.info(f"desired yaw is in deadzone")
-            else:
-                logger.info(f"no imu data")
-                self.stop()
-            sleep(self.update_interval)
+        # Check that there is fresh IMU data when we command any movement
+        if not self.imu.is_stale(self.imu_max_age):
+            self.control(yaw_angle=yaw_angle, pitch_angle=pitch_angle)
+        else:
+            logger.info(f"no imu data for {self.imu.age():.1f}s")
+            self.stop()
+        return self.yaw_target_reached and self.pitch_target_reached
 
     # Only supports angle mode
     def control(
@@ -138,41 +362,60 @@ class BescorGimbal:
         """
         logger.info(f'Going to yaw:{yaw_angle} pitch:{pitch_angle}')
 
-        # Rename variables for clarity
-        desired_yaw = yaw_angle
-        desired_pitch = pitch_angle
+        yaw_plan = self.plan_yaw(yaw_angle)
+        if not yaw_plan.reachable:
+            logger.info(f'desired yaw is in deadzone, going to the nearest '
+                        f'limit at IMU yaw {yaw_plan.target}')
+        z_err = yaw_plan.error
+        self.yaw_target_reached = self._control_axis(
+            self.yaw_relays, z_err, self.yaw_slew_rate, 'z', 'yaw')
 
-        z_angle = self.get_bearing()
-        z_err = z_angle - desired_yaw
-        if abs(z_err) > self.deadband:
-            if z_err > 0:
-                self.yaw_relays[0].on()
-                logger.info(f'z error {z_err}, moving yaw0')
-            else:
-                self.yaw_relays[1].on()
-                logger.info(f'z error {z_err}, moving yaw1')
-        else:
-            for relay in self.yaw_relays:
-                relay.off()
-            logger.info(f'z error {z_err}, within deadband')
-            self.yaw_target_reached = True
-
-        y_angle = self.imu.last_pitch
-        y_err = y_angle - desired_pitch
-        if abs(y_err) > self.deadband:
-            if y_err > 0:
-                self.pitch_relays[0].on()
-                logger.info(f'y error {y_err}, moving pitch0')
+        y_err = self.imu.last_pitch - self.clamp_pitch(pitch_angle)
+        self.pitch_target_reached = self._control_axis(
+            self.pitch_relays, y_err, self.pitch_slew_rate, 'y', 'pitch')
+
+    def _control_axis(
+            self,
+            relays,
+            err: float,
+            slew_rate: float,
+            err_name: str,
+            relay_name: str,
+    ) -> bool:
+        """
+        Drive one axis towards zero error. Returns True if it is within the
+        deadband of the current control mode.
+        """
+        deadband = (self.pulse_deadband if self.control_mode == 'pulse'
+                    else self.deadband)
+        if abs(err) <= deadband:
+            if self.control_mode == 'pulse':
+                self.pulser.cancel(relays)
             else:
-                self.pitch_relays[1].on()
-                logger.info(f'y error {y_err}, moving pitch1')
+                for relay in relays:
+                    relay.off()
+            logger.info(f'{err_name} error {err}, within deadband')
+            return True
+        index = 0 if err > 0 else 1
+        if self.control_mode == 'pulse':
+            duration = pulse_duration(
+                err, slew_rate,
+                coast=self.coast_time,
+                min_duration=self.pulser.tick,
+                # Keep moving between updates when far away
+                max_duration=self.update_interval + self.pulser.tick)
+            self.pulser.pulse(relays, index, duration)
+            logger.info(f'{err_name} error {err}, '
+                        f'pulsing {relay_name}{index} for {duration:.2f}s')
         else:
-            for relay in self.pitch_relays:
-                relay.off()
-            logger.info(f'y error {y_err}, within deadband')
-            self.pitch_target_reached = True
+            relays[1 - index].off()
+            relays[index].on()
+            logger.info(f'{err_name} error {err}, moving {relay_name}{index}')
+        return False
 
     def stop(self) -> None:
+        self.pulser.cancel(self.yaw_relays)
+        self.pulser.cancel(self.pitch_relays)
         for relay in self.yaw_relays + self.pitch_relays:
             relay.off()
 
@@ -193,28 +436,46 @@ class BescorGimbal:
             az += 360
         return az
     
+    def _check_origin(self) -> None:
+        if self._origin_transformer is None:
+            raise OriginNotSet('No origin, call /api/set_origin first')
+
     def calculate_relcoords(self, lat: float, lon: float) -> Tuple[float, float]:
         """
         Determine the N, E offset in meters from origin_latlon to latest_latlon
         """
-
-        # Todo cache this Transformer instead of creating every time
-        xfrmr = Transformer.from_crs(4326,f"+proj=tmerc "
-                                          f"+lat_0={self._origin_latlon[0]} "
-                                          f"+lon_0={self._origin_latlon[1]}")
-
-        # Convert origin to transverse mercator centered on origin
-        origin_m = xfrmr.transform(self._origin_latlon[1],
-                                   self._origin_latlon[0])
-        logger.info(f'origin: origin_m')
-
-        # Convert latest_latlon to same
-        new_m = xfrmr.transform(lon, lat)
+        self._check_origin()
+        # Convert latest_latlon to transverse mercator centered on origin
+        easting, northing = self._origin_transformer.transform(lon, lat)
 
         # Subtract them
-        return (new_m[1]- origin_m[1], new_m[0] - origin_m[0])
+        return (northing - self._origin_m[1], easting - self._origin_m[0])
 
-    def point_at_rel_coords(self, northing: float, easting: float, elevation=None) -> None:
+    def calculate_relcoords_batch(
+            self,
+            lats: np.ndarray,
+            lons: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Vectorized calculate_relcoords for arrays of positions, e.g. a
+        recorded track or the latest fix of several tags. Returns arrays of
+        N and E offsets in meters.
+        """
+        self._check_origin()
+        eastings, northings = self._origin_transformer.transform(
+            np.asarray(lons, dtype=float), np.asarray(lats, dtype=float))
+        return northings - self._origin_m[1], eastings - self._origin_m[0]
+
+    def rel_coords_to_angles(
+            self,
+            northing: float,
+            easting: float,
+            elevation=None
+    ) -> Tuple[float, float]:
+        """
+        Determine the yaw and pitch needed to point at coordinates given in
+        meters relative to the gimbal.
+        """
         yaw_angle = self._xy_to_az(x=easting, y=northing)
         yaw_angle -= self._declination
         if yaw_angle < 0:
@@ -228,12 +489,21 @@ class BescorGimbal:
         logger.info(f'Given rel coords '
                     f'N: {northing} E: {easting} El:{elevation}, '
                     f'going to point at yaw: {yaw_angle} pitch: {pitch_angle}')
-        self.goto(yaw_angle=yaw_angle, pitch_angle=pitch_angle)
+        return yaw_angle, pitch_angle
 
-    def point_at_abs_coords(self, lat: float, lon: float) -> None:
-        e, n = self.calculate_relcoords(lat=lat, lon=lon)
+    def abs_coords_to_angles(self, lat: float, lon: float) -> Tuple[float, float]:
+        n, e = self.calculate_relcoords(lat=lat, lon=lon)
         logger.info(f'Calculated northing {n}, easting {e} from'
                     f' rel lat {lat} lon {lon}')
         #TODO declination
         #TODO elevation
-        self.point_at_rel_coords(northing=n, easting=e, elevation=0)
\ No newline at end of file
+        return self.rel_coords_to_angles(northing=n, easting=e, elevation=0)
+
+    def point_at_rel_coords(self, northing: float, easting: float, elevation=None) -> None:
+        yaw_angle, pitch_angle = self.rel_coords_to_angles(
+            northing=northing, easting=easting, elevation=elevation)
+        self.goto(yaw_angle=yaw_angle, pitch_angle=pitch_angle)
+
+    def point_at_abs_coords(self, lat: float, lon: float) -> None:
+        yaw_angle, pitch_angle = self.abs_coords_to_angles(lat=lat, lon=lon)
+        self.goto(yaw_angle=yaw_angle, pitch_angle=pitch_angle)
@@ -0,0 +1,203 @@
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Optional, Tuple, Iterable
+
+import numpy as np
+
+from clock import Clock
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Called with roll, pitch, yaw in degrees
+SampleCallback = Callable[[float, float, float], None]
+
+
+class ImuRingBuffer:
+    """
+    Fixed-size buffer of the most recent IMU samples. Each row holds a
+    monotonic timestamp followed by roll, pitch and yaw in degrees.
+    """
+    T, ROLL, PITCH, YAW = range(4)
+
+    def __init__(self, capacity: int = 1024) -> None:
+        self._data = np.zeros((capacity, 4))
+        self._capacity = capacity
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, t: float, roll: float, pitch: float, yaw: float) -> None:
+        with self._lock:
+            row = self._data[self._next]
+            row[0] = t
+            row[1] = roll
+            row[2] = pitch
+            row[3] = yaw
+            self._next = (self._next + 1) % self._capacity
+            self._count = min(self._count + 1, self._capacity)
+
+    def latest(self) -> Optional[np.ndarray]:
+        with self._lock:
+            if not self._count:
+                return None
+            return self._data[self._next - 1].copy()
+
+    def since(self, t: float) -> np.ndarray:
+        """
+        Copy of all buffered samples taken at or after t, oldest first.
+        """
+        with self._lock:
+            if self._count < self._capacity:
+                ordered = self._data[:self._count]
+            else:
+                ordered = np.roll(self._data, -self._next, axis=0)
+            return ordered[ordered[:, self.T] >= t].copy()
+
+
+class ImuSource(ABC):
+    """
+    Something that pushes IMU angle samples to a callback. Samples are
+    timestamped with clock.
+    """
+    clock: Clock = Clock()
+
+    @abstractmethod
+    def start(self, callback: SampleCallback) -> None:
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        pass
+
+
+class WitmotionSource(ImuSource):
+    """
+    Witmotion IMU connected over a serial port, e.g. a Bluetooth rfcomm link.
+    """
+
+    def __init__(self, path: str = '/dev/rfcomm0', baudrate: int = 115200):
+        self.path = path
+        self.baudrate = baudrate
+        self._imu = None
+
+    def start(self, callback: SampleCallback) -> None:
+        from witmotion import IMU
+        from witmotion.protocol import AngleMessage
+        self._imu = IMU(path=self.path, baudrate=self.baudrate)
+        self._imu.subscribe(
+            lambda msg: callback(msg.roll, msg.pitch, msg.yaw),
+            cls=AngleMessage)
+
+    def close(self) -> None:
+        if self._imu:
+            self._imu.close()
+
+
+class FakeSerialSource(ImuSource):
+    """
+    Stands in for the serial link to the IMU. Samples come from
+    angles(), called every interval seconds on a background thread.
+    connected can be cleared to simulate the link dropping out.
+    """
+
+    def __init__(self,
+                 angles: Callable[[], Tuple[float, float, float]],
+                 interval: float = 0.1,
+                 clock: Optional[Clock] = None) -> None:
+        self.angles = angles
+        self.interval = interval
+        self.clock = clock or Clock()
+        self.connected = threading.Event()
+        self.connected.set()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_samples(cls,
+                     samples: Iterable[Tuple[float, float, float]],
+                     interval: float = 0.1,
+                     clock: Optional[Clock] = None) -> 'FakeSerialSource':
+        """
+        Replay fixed samples, repeating the last one once they run out.
+        """
+        iterator = iter(samples)
+        last = [(0., 0., 0.)]
+
+        def angles():
+            last[0] = next(iterator, last[0])
+            return last[0]
+
+        return cls(angles, interval=interval, clock=clock)
+
+    def start(self, callback: SampleCallback) -> None:
+        def run():
+            while not self.clock.wait(self._stop_event, self.interval):
+                if self.connected.is_set():
+                    callback(*self.angles())
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+
+class ImuIngest:
+    """
+    Records every sample from an ImuSource into an ImuRingBuffer, and offers
+    the last_* attributes of witmotion.IMU plus the age of the last sample.
+    Samples are timestamped with the source's clock unless clock is given.
+    """
+
+    def __init__(self,
+                 source: ImuSource,
+                 capacity: int = 1024,
+                 clock: Optional[Callable[[], float]] = None) -> None:
+        self.source = source
+        self.buffer = ImuRingBuffer(capacity)
+        self._clock = clock or source.clock.monotonic
+        self.source.start(self._on_sample)
+
+    def _on_sample(self, roll: float, pitch: float, yaw: float) -> None:
+        self.buffer.append(self._clock(), roll, pitch, yaw)
+
+    def _latest(self, column: int) -> Optional[float]:
+        sample = self.buffer.latest()
+        return None if sample is None else float(sample[column])
+
+    @property
+    def last_roll(self) -> Optional[float]:
+        return self._latest(ImuRingBuffer.ROLL)
+
+    @property
+    def last_pitch(self) -> Optional[float]:
+        return self._latest(ImuRingBuffer.PITCH)
+
+    @property
+    def last_yaw(self) -> Optional[float]:
+        return self._latest(ImuRingBuffer.YAW)
+
+    def get_angle(self) -> Optional[Tuple[float, float, float]]:
+        sample = self.buffer.latest()
+        if sample is None:
+            return None
+        return float(sample[1]), float(sample[2]), float(sample[3])
+
+    def age(self) -> float:
+        """
+        Seconds since the last sample, or infinity if there never was one.
+        """
+        t = self._latest(ImuRingBuffer.T)
+        return float('inf') if t is None else self._clock() - t
+
+    def is_stale(self, max_age: float) -> bool:
+        return self.age() > max_age
+
+    def close(self) -> None:
+        self.source.close()
@@ -0,0 +1,179 @@
+import itertools
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Callable, Any, Tuple, List
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class MotionTarget:
+    motion_id: int
+    yaw_angle: float
+    pitch_angle: float
+
+
+class MotionController(threading.Thread):
+    """
+    Background thread that owns the gimbal relays.
+
+    Targets are handed over through a single-slot mailbox: a new target
+    replaces whatever is waiting or in progress, so stale GPS fixes are
+    dropped instead of queued behind each other.
+    """
+    # How many motion ids to remember for status lookups
+    history_size = 64
+
+    def __init__(self, gimbal) -> None:
+        super().__init__(daemon=True)
+        self.gimbal = gimbal
+        self.relay_lock = threading.RLock()
+        self._mailbox_lock = threading.Lock()
+        self._mailbox: Optional[MotionTarget] = None
+        self._halt_requested = False
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._motion_ids = itertools.count(1)
+        self._statuses: 'OrderedDict[int, str]' = OrderedDict()
+        self._settle_listeners: List[Callable[[float], None]] = []
+
+    def add_settle_listener(self, callback: Callable[[float], None]) -> None:
+        """
+        callback is called with the time in seconds from a target being
+        picked up until the gimbal reached it.
+        """
+        self._settle_listeners.append(callback)
+
+    def set_target(self, yaw_angle: float, pitch_angle: float) -> int:
+        """
+        Ask the gimbal to move to yaw_angle and pitch_angle and return
+        immediately with an id that can be passed to status().
+        """
+        with self._mailbox_lock:
+            motion_id = next(self._motion_ids)
+            if self._mailbox is not None:
+                self._set_status(self._mailbox.motion_id, 'superseded')
+            self._mailbox = MotionTarget(motion_id=motion_id,
+                                         yaw_angle=yaw_angle,
+                                         pitch_angle=pitch_angle)
+            self._set_status(motion_id, 'pending')
+        self._wakeup.set()
+        return motion_id
+
+    def nudge(self, yaw_delta: float, pitch_delta: float) -> Optional[int]:
+        """
+        Small correction relative to where the gimbal points now, e.g. from
+        the vision tracker. Replaces any pending target like set_target().
+        Skipped, returning None, while the IMU data is missing or stale.
+        """
+        imu = self.gimbal.imu
+        if imu.is_stale(self.gimbal.imu_max_age):
+            logger.info(f'no imu data for {imu.age():.1f}s, skipping nudge')
+            return None
+        return self.set_target(
+            yaw_angle=(self.gimbal.get_bearing() + yaw_delta) % 360,
+            pitch_angle=self.gimbal.imu.last_pitch + pitch_delta)
+
+    def status(self, motion_id: int) -> Optional[str]:
+        with self._mailbox_lock:
+            return self._statuses.get(motion_id)
+
+    def halt(self) -> None:
+        """
+        Emergency stop: drop any pending or active target, abort a
+        run_exclusive action and switch the relays off. Doesn't wait for
+        relay_lock, so it never queues behind a long move.
+        """
+        self._drop_target()
+        self.gimbal.abort.set()
+        self.gimbal.stop()
+
+    def run_exclusive(self, action: Callable[[], Any]) -> Any:
+        """
+        Halt background motion and run action (e.g. gimbal.initialize) while
+        holding the relays. A halt() meanwhile makes action raise
+        gimbal.MotionAborted.
+        """
+        self.gimbal.abort.clear()
+        self._drop_target()
+        with self.relay_lock:
+            self.gimbal.stop()
+            return action()
+
+    def cancel(self) -> None:
+        self._stop_event.set()
+        self._wakeup.set()
+
+    def _drop_target(self) -> None:
+        with self._mailbox_lock:
+            if self._mailbox is not None:
+                self._set_status(self._mailbox.motion_id, 'superseded')
+            self._mailbox = None
+            self._halt_requested = True
+        self._wakeup.set()
+
+    def _set_status(self, motion_id: int, status: str) -> None:
+        # Caller must hold _mailbox_lock
+        self._statuses[motion_id] = status
+        self._statuses.move_to_end(motion_id)
+        while len(self._statuses) > self.history_size:
+            self._statuses.popitem(last=False)
+
+    def _take_target(self) -> Tuple[Optional[MotionTarget], bool]:
+        with self._mailbox_lock:
+            target, self._mailbox = self._mailbox, None
+            halted, self._halt_requested = self._halt_requested, False
+            self._wakeup.clear()
+            if target is not None:
+                self._set_status(target.motion_id, 'moving')
+            return target, halted
+
+    def _finish(self, target: MotionTarget, status: str) -> None:
+        with self._mailbox_lock:
+            if self._statuses.get(target.motion_id) == 'moving':
+                self._set_status(target.motion_id, status)
+
+    def run(self) -> None:
+        target: Optional[MotionTarget] = None
+        while not self._stop_event.is_set():
+            newer, halted = self._take_target()
+            if halted and target is not None:
+                with self.relay_lock:
+                    self.gimbal.stop()
+                self._finish(target, 'halted')
+                target = None
+            if newer is not None:
+                if target is not None:
+                    self._finish(target, 'superseded')
+                target = newer
+                started = self.gimbal.clock.monotonic()
+            if target is None:
+                self._wakeup.wait()
+                continue
+            try:
+                with self.relay_lock:
+                    reached = self.gimbal.step(
+                        yaw_angle=target.yaw_angle,
+                        pitch_angle=target.pitch_angle)
+            except Exception:
+                logger.exception(f'Motion {target.motion_id} failed')
+                with self.relay_lock:
+                    self.gimbal.stop()
+                self._finish(target, 'failed')
+                target = None
+                continue
+            if reached:
+                logger.info(f'Motion {target.motion_id} reached target')
+                self._finish(target, 'reached')
+                settle_time = self.gimbal.clock.monotonic() - started
+                for listener in self._settle_listeners:
+                    listener(settle_time)
+                target = None
+                continue
+            # Sleep until the next control update, or wake early on a new
+            # target
+            self.gimbal.clock.wait(self._wakeup, self.gimbal.update_interval)
+        with self.relay_lock:
+            self.gimbal.stop()
@@ -0,0 +1,49 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Sequence, List
+
+from panasonic_camera.camera import PanasonicCamera
+
+
+class AsyncPanasonicCamera:
+    """
+    asyncio wrapper around PanasonicCamera. Every method of the wrapped
+    camera is available as a coroutine, e.g. await camera.zoom_stop(). Calls
+    run one at a time on a dedicated thread that owns the camera's keep-alive
+    session, so the event loop never blocks on the camera.
+    """
+
+    def __init__(self,
+                 camera: PanasonicCamera,
+                 executor: Optional[ThreadPoolExecutor] = None) -> None:
+        self.camera = camera
+        self._executor = executor or ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='camera')
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.camera, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(attr, *args, **kwargs))
+
+        return call
+
+    async def pipeline(self, commands: Sequence[str]) -> List:
+        """
+        Run several camera methods back to back in one executor job, reusing
+        the same connection, e.g. ['recmode', 'start_stream'].
+        """
+        def run():
+            return [getattr(self.camera, command)() for command in commands]
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, run)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        self.camera.close()
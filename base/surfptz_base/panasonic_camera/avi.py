@@ -0,0 +1,97 @@
+"""
+Minimal AVI (RIFF) writer for MJPEG, so live view JPEGs can be saved as a
+playable video without decoding or re-encoding them.
+"""
+import struct
+from typing import BinaryIO, List, Optional, Tuple
+
+_AVIF_HASINDEX = 0x10
+_AVIIF_KEYFRAME = 0x10
+# Start of frame markers, which carry the image size. C4, C8 and CC are
+# other segments in the same range.
+_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def jpeg_size(jpeg: bytes) -> Optional[Tuple[int, int]]:
+    """
+    (width, height) from a JPEG's start of frame segment, None if there is
+    none.
+    """
+    i = 2
+    while i + 4 <= len(jpeg):
+        if jpeg[i] != 0xFF:
+            return None
+        marker = jpeg[i + 1]
+        if marker == 0xFF:
+            # Fill byte
+            i += 1
+            continue
+        length, = struct.unpack_from('>H', jpeg, i + 2)
+        if marker in _SOF_MARKERS:
+            if i + 9 > len(jpeg):
+                return None
+            height, width = struct.unpack_from('>HH', jpeg, i + 5)
+            return width, height
+        if marker == 0xDA:
+            # Start of scan, only entropy coded data follows
+            return None
+        i += 2 + length
+    return None
+
+
+def _chunk(fourcc: bytes, data: bytes) -> bytes:
+    padding = b'\0' if len(data) % 2 else b''
+    return fourcc + struct.pack('<I', len(data)) + data + padding
+
+
+def _list(list_type: bytes, data: bytes) -> bytes:
+    return b'LIST' + struct.pack('<I', len(data) + 4) + list_type + data
+
+
+def write_mjpeg_avi(f: BinaryIO, jpegs: List[bytes], fps: float) -> None:
+    """
+    Write jpegs as the frames of an MJPEG AVI played at fps. The frame size
+    is taken from the first frame.
+    """
+    if not jpegs:
+        raise ValueError('No frames to write')
+    size = jpeg_size(jpegs[0])
+    if size is None:
+        raise ValueError('First frame is not a JPEG with a frame header')
+    width, height = size
+    max_frame = max(len(jpeg) for jpeg in jpegs)
+    # Frame rate as dwRate / dwScale
+    scale = 1000
+    rate = max(int(round(fps * scale)), 1)
+
+    avih = struct.pack(
+        '<IIIIIIIIII16x',
+        int(round(1e6 / fps)), int(max_frame * fps), 0, _AVIF_HASINDEX,
+        len(jpegs), 0, 1, max_frame, width, height)
+    strh = struct.pack(
+        '<4s4sIHHIIIIIIIIhhhh',
+        b'vids', b'MJPG', 0, 0, 0, 0, scale, rate, 0, len(jpegs), max_frame,
+        0xFFFFFFFF, 0, 0, 0, width, height)
+    strf = struct.pack(
+        '<IiiHH4sIiiII',
+        40, width, height, 1, 24, b'MJPG', width * height * 3, 0, 0, 0, 0)
+    hdrl = _list(b'hdrl', _chunk(b'avih', avih) + _list(
+        b'strl', _chunk(b'strh', strh) + _chunk(b'strf', strf)))
+
+    index = []
+    # idx1 offsets count from the 'movi' list type
+    offset = 4
+    for jpeg in jpegs:
+        index.append(struct.pack('<4sIII', b'00dc', _AVIIF_KEYFRAME, offset,
+                                 len(jpeg)))
+        offset += 8 + len(jpeg) + len(jpeg) % 2
+    movi_size = offset
+    idx1 = _chunk(b'idx1', b''.join(index))
+
+    riff_size = 4 + len(hdrl) + 8 + movi_size + len(idx1)
+    f.write(b'RIFF' + struct.pack('<I', riff_size) + b'AVI ')
+    f.write(hdrl)
+    f.write(b'LIST' + struct.pack('<I', movi_size) + b'movi')
+    for jpeg in jpegs:
+        f.write(_chunk(b'00dc', jpeg))
+    f.write(idx1)
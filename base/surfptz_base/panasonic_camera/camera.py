@@ -1,3 +1,4 @@
+import time
 import xml.etree.ElementTree as ET
 from dataclasses import dataclass
 from typing import List, Dict, Iterator, Optional
@@ -6,6 +7,7 @@ from urllib.parse import urlparse
 import requests
 
 from panasonic_camera.discover import discover_panasonic_camera_devices
+from panasonic_camera.stats import CommandStats
 
 
 class RejectError(Exception):
@@ -84,8 +86,29 @@ def find_elements(element: ET.Element, path: str) -> Iterator[ET.Element]:
 
 class PanasonicCamera:
 
-    def __init__(self, hostname: str) -> None:
+    def __init__(self,
+                 hostname: str,
+                 stats: Optional[CommandStats] = None) -> None:
+        self.hostname = hostname
         self.cam_cgi_url = 'http://{}/cam.cgi'.format(hostname)
+        # Reuse one keep-alive connection instead of opening a new one for
+        # every command
+        self.session = requests.Session()
+        self.stats = stats or CommandStats()
+
+    def _get(self, *args, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', 2)
+        params = kwargs.get('params', {})
+        command = ':'.join(str(params[key]) for key in ('mode', 'value', 'type')
+                           if key in params)
+        start = time.perf_counter()
+        try:
+            return self.session.get(self.cam_cgi_url, *args, **kwargs)
+        finally:
+            self.stats.add(command, (time.perf_counter() - start) * 1000)
+
+    def close(self) -> None:
+        self.session.close()
 
     @staticmethod
     def _validate_camrply(camrply: ET.Element) -> None:
@@ -102,15 +125,13 @@ class PanasonicCamera:
         assert result == 'ok', 'unknown result "{}"'.format(result)
 
     def _request_xml(self, *args, **kwargs) -> ET.Element:
-        kwargs.setdefault('timeout', 2)
-        response = requests.get(self.cam_cgi_url, *args, **kwargs)
+        response = self._get(*args, **kwargs)
         camrply: ET.Element = ET.fromstring(response.text)
         self._validate_camrply(camrply)
         return camrply
 
     def _request_csv(self, *args, **kwargs) -> List[str]:
-        kwargs.setdefault('timeout', 2)
-        response = requests.get(self.cam_cgi_url, *args, **kwargs)
+        response = self._get(*args, **kwargs)
         camrply: List[str] = response.text.split(',')
         return camrply
 
@@ -125,6 +146,12 @@ class PanasonicCamera:
             sd_access=find_text(state, 'sd_access'),
             version=find_text(state, 'version'))
 
+    def probe(self, timeout: float = 0.5) -> None:
+        """
+        Cheap check that the camera answers, with a short timeout.
+        """
+        self._request_xml(params={'mode': 'getstate'}, timeout=timeout)
+
     def _camcmd(self, value: str) -> None:
         self._request_xml(params={'mode': 'camcmd', 'value': value})
 
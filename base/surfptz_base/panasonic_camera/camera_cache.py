@@ -0,0 +1,60 @@
+import json
+import logging
+import os
+from dataclasses import dataclass, asdict
+from logging import Logger
+from typing import Optional
+
+from panasonic_camera.camera import Capability, ProductInfo, Setting
+
+logger: Logger = logging.getLogger(__name__)
+
+DEFAULT_CAMERA_CACHE_PATH = os.path.expanduser('~/.surfptz/camera.json')
+
+
+def capability_from_dict(data: dict) -> Capability:
+    return Capability(
+        comm_proto_ver=data['comm_proto_ver'],
+        product_info=ProductInfo(**data['product_info']),
+        commands=data['commands'],
+        controls=data['controls'],
+        settings={name: Setting(**setting)
+                  for name, setting in data['settings'].items()},
+        states=data['states'],
+        specifications=data['specifications'])
+
+
+@dataclass
+class CachedCamera:
+    """
+    The last camera we were connected to, so a reconnect can go straight to
+    its hostname instead of waiting for an SSDP scan.
+    """
+    hostname: str
+    friendly_name: str = ''
+    capability: Optional[Capability] = None
+
+    def save(self, path: str = DEFAULT_CAMERA_CACHE_PATH) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(asdict(self), f, indent=2)
+        os.replace(tmp_path, path)
+        logger.debug(f'Saved camera {self.hostname} to {path}')
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_CAMERA_CACHE_PATH
+             ) -> Optional['CachedCamera']:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            capability = data.pop('capability', None)
+            cached = cls(**data)
+            if capability is not None:
+                cached.capability = capability_from_dict(capability)
+            return cached
+        except FileNotFoundError:
+            return None
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f'Ignoring unreadable camera cache {path}: {e}')
+            return None
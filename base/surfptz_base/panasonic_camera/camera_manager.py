@@ -1,90 +1,266 @@
 import argparse
 import logging
 import signal
+import threading
 from logging import Logger
-from typing import Optional
+from typing import Callable, List, Optional
 from urllib.parse import urlparse
 
 import requests
 import time
 import urllib3
 
-from panasonic_camera.camera import PanasonicCamera, BusyError, CriticalError
+from panasonic_camera.camera import PanasonicCamera, BusyError, \
+    CriticalError, RejectError, UnsuitableApp, Capability
+from panasonic_camera.camera_cache import CachedCamera, \
+    DEFAULT_CAMERA_CACHE_PATH
 from panasonic_camera.discover import discover_panasonic_camera_devices
 from panasonic_camera.interval import signal_handler, IntervalThread, \
-    ProgramKilled
+    ProgramKilled, Backoff
+from panasonic_camera.stats import CommandStats
 
 logger: Logger = logging.getLogger(__name__)
 
 
+DISCOVERING = 'discovering'
+REGISTERING = 'registering'
+STREAMING = 'streaming'
+# Connected, but the live view stream stopped
+DEGRADED = 'degraded'
+# The camera stopped answering
+LOST = 'lost'
+
+_CONNECTION_ERRORS = (requests.exceptions.RequestException,
+                      urllib3.exceptions.HTTPError)
+
+
 class PanasonicCameraManager(IntervalThread):
+    """
+    Keeps a connection to a camera and its live view stream, as a state
+    machine:
+
+    discovering -> registering -> streaming <-> degraded -> lost -> ...
+
+    Reconnects go straight to the last camera's cached hostname first and
+    only fall back to an SSDP scan if it doesn't answer. Failed attempts
+    are retried with exponential backoff.
+
+    While streaming, received live view packets reported through
+    heartbeat() are the liveness check, so a stalled stream is noticed
+    within heartbeat_timeout without any HTTP traffic. Until the first
+    heartbeat arrives, e.g. without a live view receiver, the camera is
+    polled every interval seconds instead.
+    """
     camera: Optional[PanasonicCamera]
     _identify_as: Optional[str]
 
     def __init__(self, interval=10, *_args, **_kwargs) -> None:
-        super().__init__(interval, self._ensure_connection, *_args, **_kwargs)
+        super().__init__(interval, self._step, *_args, **_kwargs)
         self.camera = None
+        self.capability: Optional[Capability] = None
         self._identify_as = _kwargs.get('identify_as')
-        self.is_stream_started = False
+        self._cache_path = _kwargs.get('cache_path',
+                                       DEFAULT_CAMERA_CACHE_PATH)
+        self.heartbeat_timeout = _kwargs.get('heartbeat_timeout', 1.)
+        self.stream_port = _kwargs.get('stream_port', 49199)
+        # A manager pinned to a hostname (see MultiCameraManager) never runs
+        # its own discovery
+        self.hostname: Optional[str] = _kwargs.get('hostname')
+        self._backoff = Backoff(initial=0.5, maximum=interval)
+        self._state = DISCOVERING
+        self._state_lock = threading.Lock()
+        self._transition_listeners: List[Callable[[str, str], None]] = []
+        self._last_heartbeat: Optional[float] = None
+        self._streaming_since = 0.
+        self._last_poll = 0.
+        # Kept across reconnects so latency history survives a new camera
+        self.stats = CommandStats()
 
-    def _ensure_connection(self):
-        if self.camera:
+    @property
+    def state(self) -> str:
+        with self._state_lock:
+            return self._state
+
+    @property
+    def is_stream_started(self) -> bool:
+        return self.state == STREAMING
+
+    def add_transition_listener(self,
+                                callback: Callable[[str, str], None]) -> None:
+        """
+        callback(old_state, new_state) is called on every state change, from
+        the manager thread.
+        """
+        self._transition_listeners.append(callback)
+
+    def heartbeat(self) -> None:
+        """
+        Call for every received live view packet. Cheap enough for that.
+        """
+        self._last_heartbeat = time.monotonic()
+
+    def _set_state(self, state: str) -> None:
+        with self._state_lock:
+            old_state, self._state = self._state, state
+        if old_state == state:
+            return
+        logger.info(f'camera connection {old_state} -> {state}')
+        if state == STREAMING:
+            self._streaming_since = time.monotonic()
+        for listener in self._transition_listeners:
+            try:
+                listener(old_state, state)
+            except Exception:
+                logger.exception('camera transition listener failed')
+
+    def _step(self) -> float:
+        """
+        Advance the state machine and return the seconds until the next
+        step.
+        """
+        state = self.state
+        if state in (DISCOVERING, REGISTERING, LOST):
+            if not self._connect():
+                return self._backoff.next()
+            return self._start_camera_stream()
+        if state == STREAMING:
+            return self._check_stream()
+        # DEGRADED: still there, or gone?
+        try:
+            self.camera.probe()
+        except _CONNECTION_ERRORS:
+            logger.debug('Lost connection to camera')
+            self._set_state(LOST)
+            return 0
+        except (RejectError, BusyError, CriticalError, UnsuitableApp) as e:
+            logger.debug(f'Camera did not accept probe: {e}')
+        return self._start_camera_stream()
+
+    def _check_stream(self) -> float:
+        now = time.monotonic()
+        if self._last_heartbeat is None:
+            if now - self._last_poll < self.interval:
+                return self.interval - (now - self._last_poll)
+            self._last_poll = now
             try:
                 logger.debug(self.camera.get_state().__dict__)
-                if not self.is_stream_started:
-                    self._start_camera_stream()
-            except (requests.exceptions.RequestException,
-                    urllib3.exceptions.HTTPError):
+            except _CONNECTION_ERRORS:
                 logger.debug('Lost connection to camera')
-                self.is_stream_started = False
-                self._connect()
-        else:
-            self._connect()
-
-    def _connect(self):
-        logger.debug('Try to connect')
-        devices = discover_panasonic_camera_devices()
-        if devices:
-            device = devices[0]
-            hostname = urlparse(device.location).hostname
-            logger.debug(
-                'Connect to {}: {}'.format(device.friendly_name, hostname))
-            self.camera = PanasonicCamera(hostname)
-            # If we have a _identify_as property, assume this is a camera like
-            # Panasonic DC-FZ80 which requires registering the remote control
-            # device (in this case, us) with the camera first.
-            if self._identify_as:
-                logger.debug(f'Attempting to identify as {self._identify_as}')
-                self.camera.register_with_camera(identify_as=self._identify_as)
-            # Some cameras like the Panasonic HC-V380 require to get info
-            # capability before starting the camera stream
-            self.camera.get_info_capability()
-            self._ensure_connection()
-        else:
-            self.camera = None
-            logger.debug('No camera found')
-
-    def _start_camera_stream(self):
+                self._set_state(LOST)
+                return 0
+            return self.interval
+        stream_came_up = self._last_heartbeat > self._streaming_since
+        if stream_came_up:
+            self._backoff.reset()
+        last_sign_of_life = max(self._last_heartbeat, self._streaming_since)
+        silence = now - last_sign_of_life
+        if silence > self.heartbeat_timeout:
+            logger.debug(f'No live view for {silence:.1f}s')
+            self._set_state(DEGRADED)
+            # Act at once on a stall, but don't hammer a camera whose
+            # stream doesn't come up after restarting it
+            return 0 if stream_came_up else self._backoff.next()
+        return min(self.heartbeat_timeout / 4,
+                   self.heartbeat_timeout - silence)
+
+    def _connect(self) -> bool:
+        self._set_state(DISCOVERING)
+        cached = CachedCamera.load(self._cache_path)
+        if cached is not None and self.hostname not in (None, cached.hostname):
+            cached = None
+        if cached is not None:
+            logger.debug(f'Try cached camera {cached.hostname}')
+            if self._connect_to(cached.hostname, cached.friendly_name,
+                                cached.capability):
+                return True
+        elif self.hostname is not None:
+            if self._connect_to(self.hostname):
+                return True
+        if self.hostname is None:
+            logger.debug('Try to discover camera')
+            devices = discover_panasonic_camera_devices()
+            if devices:
+                device = devices[0]
+                hostname = urlparse(device.location).hostname
+                logger.debug(
+                    'Connect to {}: {}'.format(device.friendly_name, hostname))
+                if self._connect_to(hostname, device.friendly_name):
+                    return True
+            else:
+                logger.debug('No camera found')
+        if self.camera:
+            self.camera.close()
+        self.camera = None
+        return False
+
+    def _connect_to(self,
+                    hostname: str,
+                    friendly_name: str = '',
+                    capability: Optional[Capability] = None) -> bool:
+        camera = PanasonicCamera(hostname, stats=self.stats)
+        self._set_state(REGISTERING)
         try:
-            self.camera.recmode()
-            self.camera.start_stream()
-            self.is_stream_started = True
-            logger.debug('camera stream is started')
+            if capability is None:
+                # If we have a _identify_as property, assume this is a camera
+                # like Panasonic DC-FZ80 which requires registering the
+                # remote control device (in this case, us) with the camera
+                # first.
+                if self._identify_as:
+                    logger.debug(
+                        f'Attempting to identify as {self._identify_as}')
+                    camera.register_with_camera(
+                        identify_as=self._identify_as)
+                # Some cameras like the Panasonic HC-V380 require to get info
+                # capability before starting the camera stream
+                capability = camera.get_info_capability()
+            else:
+                try:
+                    camera.probe()
+                except UnsuitableApp:
+                    if not self._identify_as:
+                        raise
+                    # The camera forgot us, e.g. after being switched off
+                    camera.register_with_camera(identify_as=self._identify_as)
         except (requests.exceptions.RequestException,
                 urllib3.exceptions.HTTPError,
-                BusyError) as e:
+                RejectError, BusyError, CriticalError, UnsuitableApp) as e:
+            logger.debug(f'Could not connect to {hostname}: {e}')
+            camera.close()
+            self._set_state(DISCOVERING)
+            return False
+        if self.camera:
+            self.camera.close()
+        self.camera = camera
+        self.capability = capability
+        try:
+            CachedCamera(hostname=hostname, friendly_name=friendly_name,
+                         capability=capability).save(self._cache_path)
+        except OSError as e:
+            logger.warning(f'Could not cache camera: {e}')
+        return True
+
+    def _start_camera_stream(self) -> float:
+        try:
+            self.camera.recmode()
+            self.camera.start_stream(port=self.stream_port)
+        except _CONNECTION_ERRORS + (BusyError,) as e:
             logger.error('Could not start camera stream: %s', e)
+            self._set_state(DEGRADED)
+            return self._backoff.next()
+        logger.debug('camera stream is started')
+        self._set_state(STREAMING)
+        return 0
 
     def run(self):
-        self._ensure_connection()
-        super().run()
+        while not self.stopEvent.is_set():
+            self.stopEvent.wait(self._step())
 
     def cancel(self):
         if self.camera:
             logger.debug('stop camera stream')
             try:
                 self.camera.stop_stream()
-            except CriticalError as e:
+            except (CriticalError,) + _CONNECTION_ERRORS as e:
                 logger.warning('Could not stop camera stream: %s', e)
         super().cancel()
 
@@ -0,0 +1,116 @@
+import logging
+import threading
+import time
+from collections import deque
+from logging import Logger
+from typing import Callable, Deque, Optional, Tuple
+
+import requests
+import urllib3
+
+from panasonic_camera.camera import PanasonicCamera, RejectError, BusyError, \
+    CriticalError
+
+logger: Logger = logging.getLogger(__name__)
+
+ZOOM_START_COMMANDS = frozenset(
+    ('zoom_in_slow', 'zoom_in_fast', 'zoom_out_slow', 'zoom_out_fast'))
+ZOOM_STOP_COMMAND = 'zoom_stop'
+
+
+class CameraCommandQueue(threading.Thread):
+    """
+    Sends PanasonicCamera commands (given by method name, e.g. 'zoom_in_slow')
+    from a background thread so that callers never wait on the camera.
+
+    Zoom commands are coalesced: a new zoom command replaces any zoom
+    command that hasn't been sent yet, and zoom starts are held back for
+    coalesce_window seconds. A zoom start the camera is already doing, or
+    that is already waiting, is dropped. A zoom_stop is always sent, since
+    the camera may be zooming even if its last command failed as far as we
+    know.
+
+    Commands are sent at least min_interval seconds apart, so automatic
+    controllers can't flood the camera.
+    """
+
+    def __init__(self,
+                 get_camera: Callable[[], Optional[PanasonicCamera]],
+                 coalesce_window: float = 0.05,
+                 min_interval: float = 0.) -> None:
+        super().__init__(daemon=True)
+        self.get_camera = get_camera
+        self.coalesce_window = coalesce_window
+        self.min_interval = min_interval
+        self._last_sent = -float('inf')
+        self._pending: Deque[Tuple[str, float]] = deque()
+        self._condition = threading.Condition()
+        # Last zoom command the camera accepted
+        self._zoom_command: Optional[str] = None
+        self._stopped = False
+
+    @staticmethod
+    def _is_zoom(command: str) -> bool:
+        return command in ZOOM_START_COMMANDS or command == ZOOM_STOP_COMMAND
+
+    def submit(self, command: str) -> None:
+        with self._condition:
+            if self._is_zoom(command):
+                pending_zoom = [p for p in self._pending
+                                if self._is_zoom(p[0])]
+                if pending_zoom and pending_zoom[-1][0] == command:
+                    return
+                if (command in ZOOM_START_COMMANDS and not pending_zoom
+                        and command == self._zoom_command):
+                    logger.debug(f'Dropping {command}, camera is zooming')
+                    return
+                self._pending = deque(
+                    p for p in self._pending if not self._is_zoom(p[0]))
+            elif self._pending and self._pending[-1][0] == command:
+                return
+            self._pending.append((command, time.monotonic()))
+            self._condition.notify()
+
+    def _next_command(self) -> Optional[str]:
+        with self._condition:
+            while not self._stopped:
+                if not self._pending:
+                    self._condition.wait()
+                    continue
+                command, submitted = self._pending[0]
+                ready = self._last_sent + self.min_interval
+                if command in ZOOM_START_COMMANDS:
+                    ready = max(ready, submitted + self.coalesce_window)
+                wait = ready - time.monotonic()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                self._pending.popleft()
+                self._last_sent = time.monotonic()
+                return command
+            return None
+
+    def run(self) -> None:
+        while True:
+            command = self._next_command()
+            if command is None:
+                return
+            camera = self.get_camera()
+            if camera is None:
+                logger.warning(f'No camera connected, dropping {command}')
+                continue
+            try:
+                getattr(camera, command)()
+            except (requests.exceptions.RequestException,
+                    urllib3.exceptions.HTTPError,
+                    RejectError, BusyError, CriticalError) as e:
+                logger.error(f'Camera command {command} failed: {e}')
+                continue
+            if self._is_zoom(command):
+                with self._condition:
+                    self._zoom_command = command
+
+    def cancel(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
@@ -0,0 +1,60 @@
+import threading
+from typing import Optional
+
+from panasonic_camera.live_view_pipeline import Frame
+
+
+class FrameHub:
+    """
+    Single latest-frame slot shared by any number of viewers. The producer
+    overwrites the slot and never waits; each viewer waits for a frame newer
+    than the last one it sent, so a slow viewer skips frames instead of
+    holding up the producer or the other viewers.
+    """
+
+    def __init__(self) -> None:
+        self._frame: Optional[Frame] = None
+        self._condition = threading.Condition()
+        self.viewers = 0
+
+    def publish(self, frame: Frame) -> None:
+        with self._condition:
+            self._frame = frame
+            self._condition.notify_all()
+
+    def latest(self) -> Optional[Frame]:
+        return self._frame
+
+    def wait_newer(self,
+                   last_seq: int,
+                   timeout: Optional[float] = None) -> Optional[Frame]:
+        """
+        The latest frame if its seq is newer than last_seq, waiting up to
+        timeout seconds for one to arrive. None on timeout.
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._frame is not None and self._frame.seq > last_seq,
+                timeout)
+            frame = self._frame
+        if frame is None or frame.seq <= last_seq:
+            return None
+        return frame
+
+    def frames(self, timeout: float = 1.0):
+        """
+        Generator of frames for one viewer, yielding None when no frame
+        arrived within timeout so the caller can check the connection.
+        """
+        with self._condition:
+            self.viewers += 1
+        try:
+            last_seq = -1
+            while True:
+                frame = self.wait_newer(last_seq, timeout)
+                if frame is not None:
+                    last_seq = frame.seq
+                yield frame
+        finally:
+            with self._condition:
+                self.viewers -= 1
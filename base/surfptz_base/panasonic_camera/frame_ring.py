@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import BinaryIO, Deque, List, Optional
+
+from panasonic_camera.avi import write_mjpeg_avi
+from panasonic_camera.live_view_pipeline import Frame
+
+
+# Frame rate of a clip whose frame times are too few or too bunched up to
+# tell, and the range the measured rate is clamped to. Live view runs at
+# about 30 fps.
+NOMINAL_FPS = 30.
+MIN_CLIP_FPS = 1.
+MAX_CLIP_FPS = 60.
+
+
+@dataclass(frozen=True)
+class _Entry:
+    offset: int
+    length: int
+    # Wall clock receive time
+    t: float
+    pts: Optional[int]
+
+
+@dataclass(frozen=True)
+class BufferedFrame:
+    t: float
+    pts: Optional[int]
+    jpeg: bytes
+
+
+class FrameRing:
+    """
+    The last live view JPEGs in a buffer of capacity bytes allocated up
+    front, so memory stays fixed however long it runs. New frames overwrite
+    the oldest ones; how many seconds that holds depends on the JPEG sizes,
+    about a minute at 64 MiB for typical live view frames. Frames keep
+    their wall clock receive time, the same clock as the ride index.
+    """
+
+    def __init__(self,
+                 capacity: int = 64 * 1024 * 1024,
+                 max_frames: int = 8192) -> None:
+        self.capacity = capacity
+        self.max_frames = max_frames
+        self._buffer = bytearray(capacity)
+        self._entries: Deque[_Entry] = deque()
+        self._head = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def push(self, frame: Frame) -> None:
+        """
+        LiveViewPipeline consumer callback for raw frames.
+        """
+        n = len(frame.jpeg)
+        if n > self.capacity:
+            self.dropped += 1
+            return
+        # Frame times are monotonic, the index and clip requests use wall
+        # clock time
+        t = time.time() - (time.monotonic() - frame.received_at)
+        entries = self._entries
+        with self._lock:
+            start = self._head
+            if start + n > self.capacity:
+                # Too little room left before the end. The frames stored
+                # there are the oldest ones, drop them and wrap around.
+                while entries and entries[0].offset >= start:
+                    entries.popleft()
+                start = 0
+            end = start + n
+            while entries and (start <= entries[0].offset < end or
+                               len(entries) >= self.max_frames):
+                entries.popleft()
+            self._buffer[start:end] = frame.jpeg
+            entries.append(_Entry(offset=start, length=n, t=t, pts=frame.pts))
+            self._head = end
+
+    def window(self, start: float, end: float) -> List[BufferedFrame]:
+        """
+        Copies of the buffered frames received from start to end, wall
+        clock times.
+        """
+        with self._lock:
+            view = memoryview(self._buffer)
+            try:
+                return [BufferedFrame(
+                            t=entry.t, pts=entry.pts,
+                            jpeg=bytes(view[entry.offset:
+                                            entry.offset + entry.length]))
+                        for entry in self._entries
+                        if start <= entry.t <= end]
+            finally:
+                view.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = list(self._entries)
+        used = sum(entry.length for entry in entries)
+        return {
+            'capacity': self.capacity,
+            'used': used,
+            'frames': len(entries),
+            'dropped': self.dropped,
+            'oldest': entries[0].t if entries else None,
+            'newest': entries[-1].t if entries else None,
+            'seconds': entries[-1].t - entries[0].t if entries else 0.,
+        }
+
+
+def write_clip(f: BinaryIO, frames: List[BufferedFrame]) -> float:
+    """
+    Write frames as an MJPEG AVI at their average frame rate, clamped to
+    MIN_CLIP_FPS to MAX_CLIP_FPS, and return that rate. Frames that arrived
+    in a burst would otherwise give thousands of fps.
+    """
+    duration = frames[-1].t - frames[0].t if frames else 0.
+    if len(frames) > 1 and duration > 0:
+        fps = min(max((len(frames) - 1) / duration, MIN_CLIP_FPS),
+                  MAX_CLIP_FPS)
+    else:
+        fps = NOMINAL_FPS
+    write_mjpeg_avi(f, [frame.jpeg for frame in frames], fps)
+    return fps
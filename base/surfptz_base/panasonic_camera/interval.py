@@ -36,6 +36,27 @@ class IntervalThread(threading.Thread):
         self.stopEvent.set()
 
 
+class Backoff:
+    """
+    Exponentially growing retry delays: initial, initial * factor, ... up to
+    maximum, back to initial after reset().
+    """
+
+    def __init__(self, initial=0.5, maximum=10., factor=2.):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self._delay = initial
+
+    def next(self):
+        delay = self._delay
+        self._delay = min(self._delay * self.factor, self.maximum)
+        return delay
+
+    def reset(self):
+        self._delay = self.initial
+
+
 def __main():
     # Handle SIGINT and SIGTERM with the help of the callback function
     signal.signal(signal.SIGTERM, signal_handler)
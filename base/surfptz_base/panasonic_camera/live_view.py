@@ -5,15 +5,31 @@ import socket
 import struct
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
+from functools import lru_cache
 from logging import Logger
 from typing import Union, List, Tuple, Iterator, Any, Optional
 
 logger: Logger = logging.getLogger(__name__)
 
+# Largest UDP payload, a live view packet always fits
+MAX_PACKET_SIZE = 65536
+BASIC_HEADER_SIZE = 32
+
+
+@lru_cache(maxsize=None)
+def _compiled_struct(format: Union[bytes, str]) -> struct.Struct:
+    return struct.Struct(format)
+
+
+BASIC_HEADER_FORMAT = '>HHib6sbbbi8sH'
+_BASIC_HEADER = _compiled_struct(BASIC_HEADER_FORMAT)
+# Indices of the BasicHeader fields needed for every packet
+_TOTAL_SIZE, _PTS, _EX_HEADER_SIZE = 0, 8, 10
+
 
 @dataclass()
 class BytesReader:
-    data: bytes
+    data: Union[bytes, memoryview]
     i: int = 0
 
     def read(self, length):
@@ -25,7 +41,7 @@ class BytesReader:
         return self.data[start:end]
 
     def unpack(self, format: Union[bytes, str]):
-        s = struct.Struct(format)
+        s = _compiled_struct(format)
         return s.unpack(self.read(s.size))
 
 
@@ -45,7 +61,7 @@ class BasicHeader:
 
     @classmethod
     def unpack(cls, reader: BytesReader):
-        return cls(*reader.unpack('>HHib6sbbbi8sH'))
+        return cls(*reader.unpack(BASIC_HEADER_FORMAT))
 
 
 @dataclass
@@ -214,11 +230,25 @@ class ExHeader11(ExHeader2):
 
 
 class LiveView:
-    def __init__(self, ip: str, port: int) -> None:
+    def __init__(self,
+                 ip: str,
+                 port: int,
+                 decode_ex_headers: Optional[bool] = None) -> None:
+        """
+        :param decode_ex_headers: Decode the ex header of each packet. The
+            default None decodes only while ex header listeners are
+            registered, False and True never and always decode.
+        """
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.bind((ip, port))
         self.sock.settimeout(0.5)
         self._header_listeners = []
+        self.decode_ex_headers = decode_ex_headers
+        # Every packet is received into the same buffer
+        self._buffer = bytearray(MAX_PACKET_SIZE)
+        self._view = memoryview(self._buffer)
+        self.last_pts: Optional[int] = None
+        self.last_ex_header: Optional[ExHeader] = None
 
     def add_ex_header_listener(self, callback):
         self._header_listeners.append(callback)
@@ -227,6 +257,63 @@ class LiveView:
         for listener in self._header_listeners:
             listener(ex_header)
 
+    def _should_decode_ex_header(self) -> bool:
+        if self.decode_ex_headers is None:
+            return bool(self._header_listeners)
+        return self.decode_ex_headers
+
+    @staticmethod
+    def _decode_ex_header(reader: BytesReader) -> Optional[ExHeader]:
+        ex_header_type, = reader.unpack('>H')
+        ex_header: Optional[ExHeader] = None
+        if ex_header_type == 3:
+            ex_header = ExHeader3.unpack(reader)
+        elif ex_header_type == 8:
+            ex_header = ExHeader8.unpack(reader)
+        elif ex_header_type == 11:
+            ex_header = ExHeader11.unpack(reader)
+            reader.read(8)  # probably reserved data
+        else:
+            logger.warning('unhandled ex header type %d', ex_header_type)
+        return ex_header
+
+    def parse(self, packet: memoryview) -> memoryview:
+        """
+        Parse one live view packet and return its image data as a slice of
+        packet, without copying.
+        """
+        # TODO check pts is parsed correctly
+        basic_header = _BASIC_HEADER.unpack_from(packet)
+        self.last_pts = basic_header[_PTS]
+        ehs = basic_header[_EX_HEADER_SIZE]
+        offset = BASIC_HEADER_SIZE + ehs
+        if ehs > 0 and self._should_decode_ex_header():
+            reader = BytesReader(packet, BASIC_HEADER_SIZE)
+            ex_header = self._decode_ex_header(reader)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'ex header: {ex_header}')
+            self.last_ex_header = ex_header
+            self._notify_ex_header_listeners(ex_header)
+            if offset != reader.i:
+                logger.warning('offsets differ: %d != %d', offset, reader.i)
+        length = basic_header[_TOTAL_SIZE] - offset
+        image_data = packet[offset:]
+        if len(image_data) != length:
+            logger.warning('lengths differ: %d != %d', len(image_data), length)
+        return image_data
+
+    def image_view(self) -> memoryview:
+        """
+        Read image data from socket into the reusable receive buffer.
+
+        The returned view is only valid until the next call of image_view or
+        image, copy it (e.g. bytes(view)) to keep it.
+
+        :return: Image data
+        """
+        nbytes = self.sock.recv_into(self._buffer)
+        return self.parse(self._view[:nbytes])
+
     def image(self) -> bytes:
         """
         Read image data from socket.
@@ -236,49 +323,18 @@ class LiveView:
 
         :return: Image data
         """
-        bufsize = 65536
-        data, addr = self.sock.recvfrom(bufsize)
-        reader = BytesReader(data)
-        bhs = 32  # basic header size
-        # TODO check pts is parsed correctly
-        basic_header = BasicHeader.unpack(reader)
-        ehs = basic_header.exHeaderSize
-        if ehs > 0:
-            ex_header_type, = reader.unpack('>H')
-            ex_header: Optional[ExHeader] = None
-            if ex_header_type == 3:
-                ex_header = ExHeader3.unpack(reader)
-            elif ex_header_type == 8:
-                ex_header = ExHeader8.unpack(reader)
-            elif ex_header_type == 11:
-                ex_header = ExHeader11.unpack(reader)
-                reader.read(8)  # probably reserved data
-            else:
-                logger.warning('unhandled ex header type %d', ex_header_type)
-            logger.debug(f'ex header: {ex_header}')
-            self._notify_ex_header_listeners(ex_header)
-        offset = bhs + ehs
-        if offset != reader.i:
-            logger.warning('offsets differ: %d != %d', offset, reader.i)
-        length = basic_header.totalSize - offset
-        image_data = data[offset:]
-        if len(image_data) != length:
-            logger.warning('lengths differ: %d != %d', len(image_data), length)
-        else:
-            logger.debug(f'image data length: {len(image_data)}')
-        return image_data
+        return bytes(self.image_view())
 
 
 def _main():
     from panasonic_camera.camera_manager import PanasonicCameraManager
+    from panasonic_camera.live_view_pipeline import LiveViewPipeline, \
+        DROP_OLDEST, KEEP_LATEST
     import argparse
     import threading
     import signal
-    import PIL.Image
-    import io
     import os
     import cv2
-    import numpy
     import logging
     import time
     logging.basicConfig(level=logging.DEBUG)
@@ -290,6 +346,12 @@ def _main():
     parser.add_argument('--port', type=int,
                         default=49199,
                         help="UDP Socket port.")
+    parser.add_argument('--decoders', type=int,
+                        default=2,
+                        help="Number of JPEG decoder threads.")
+    parser.add_argument('--drop-policy', choices=(DROP_OLDEST, KEEP_LATEST),
+                        default=KEEP_LATEST,
+                        help="What to drop when the display falls behind.")
     args = parser.parse_args()
 
     to_exit = threading.Event()
@@ -297,6 +359,7 @@ def _main():
     def quit(sig=None, frame=None):
         print("Exiting...")
         to_exit.set()
+        pipeline.stop()
         if threading.current_thread() != camera_manager:
             print('wait for camera manager thread')
             camera_manager.cancel()
@@ -309,23 +372,28 @@ def _main():
     camera_manager = PanasonicCameraManager()
     camera_manager.start()
     live_view = LiveView(args.ip, args.port)
+    pipeline = LiveViewPipeline(live_view, decoder_workers=args.decoders)
+    # cv2 windows have to be driven from the main thread
+    display_queue = pipeline.add_consumer('display', policy=args.drop_policy)
+    pipeline.start()
+    last_stats = time.monotonic()
     while not to_exit.is_set():
         try:
-            if not camera_manager.is_stream_started:
-                logger.debug('camera stream has not been started yet')
-                time.sleep(0.2)
+            frame = display_queue.get(timeout=0.5)
+            if time.monotonic() - last_stats > 5:
+                logger.info(f'pipeline stats: {pipeline.stats()}')
+                last_stats = time.monotonic()
+            if frame is None:
+                if not camera_manager.is_stream_started:
+                    logger.debug('camera stream has not been started yet')
                 continue
-            image = PIL.Image.open(io.BytesIO(live_view.image()))
             if 'DISPLAY' in os.environ:
-                cv2_image = cv2.cvtColor(numpy.asarray(image),
-                                         cv2.COLOR_RGB2BGR)
+                cv2_image = cv2.cvtColor(frame.image, cv2.COLOR_RGB2BGR)
                 cv2.imshow('Live View', cv2_image)
                 key = cv2.waitKey(5) & 0xFF
                 if key == ord('q'):
                     logger.debug('key pressed to quit')
                     to_exit.set()
-        except (socket.timeout, OSError) as e:
-            logger.error(f'error reading live view image: {e}')
         except KeyboardInterrupt:
             break
     quit()
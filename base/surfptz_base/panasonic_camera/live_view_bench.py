@@ -0,0 +1,121 @@
+"""
+Microbenchmark of the live view packet parser against the previous
+implementation, which allocated a receive buffer per packet, built a
+struct.Struct per unpack and always decoded the ex header.
+
+    python -m panasonic_camera.live_view_bench --packets 20000
+"""
+import socket
+import struct
+import time
+from typing import Optional, Callable
+
+from panasonic_camera.live_view import LiveView, BytesReader, BasicHeader, \
+    ExHeader, ExHeader3, ExHeader8, ExHeader11, BASIC_HEADER_SIZE
+
+
+def make_packet(image_size: int = 30000, focus_boxes: int = 2) -> bytes:
+    """
+    Build a synthetic live view packet with an ExHeader8 and a fake JPEG.
+    """
+    ex_header = struct.pack('>H', 8)
+    ex_header += struct.pack('>H12B', 20, *range(11), focus_boxes)
+    for i in range(focus_boxes):
+        ex_header += struct.pack('>4H4B', 10 * i, 20, 30, 40, 255, 0, 0, 1)
+    ex_header += struct.pack('>18HB3HB', *range(18), 0, 0, 0, 0, 2)
+    ex_header += struct.pack('>2B', 1, 2)
+    ex_header += struct.pack('>B', 0)
+    ex_header += struct.pack('>H2B', 0, 0, 0)
+    image = b'\xff\xd8' + bytes(image_size - 4) + b'\xff\xd9'
+    total_size = BASIC_HEADER_SIZE + len(ex_header) + len(image)
+    basic_header = struct.pack('>HHib6sbbbi8sH', total_size, 1, 0, 0,
+                               bytes(6), 0, 0, 0, 0, bytes(8), len(ex_header))
+    return basic_header + ex_header + image
+
+
+class LegacyBytesReader(BytesReader):
+    def unpack(self, format):
+        s = struct.Struct(format)
+        return s.unpack(self.read(s.size))
+
+
+def legacy_image(data: bytes, listener: Optional[Callable]) -> bytes:
+    """
+    The previous LiveView.image parsing path.
+    """
+    reader = LegacyBytesReader(data)
+    bhs = 32
+    basic_header = BasicHeader.unpack(reader)
+    ehs = basic_header.exHeaderSize
+    if ehs > 0:
+        ex_header_type, = reader.unpack('>H')
+        ex_header: Optional[ExHeader] = None
+        if ex_header_type == 3:
+            ex_header = ExHeader3.unpack(reader)
+        elif ex_header_type == 8:
+            ex_header = ExHeader8.unpack(reader)
+        elif ex_header_type == 11:
+            ex_header = ExHeader11.unpack(reader)
+            reader.read(8)
+        # The f-string passed to logger.debug was built for every packet
+        f'ex header: {ex_header}'
+        if listener:
+            listener(ex_header)
+    offset = bhs + ehs
+    return data[offset:]
+
+
+def _time(label: str, packets: int, run: Callable[[], None]) -> None:
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    print(f'{label:40s} {elapsed / packets * 1e6:8.2f} us/packet')
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--packets', type=int, default=20000)
+    parser.add_argument('--image-size', type=int, default=30000)
+    args = parser.parse_args()
+    packet = make_packet(args.image_size)
+    n = args.packets
+
+    def listener(_ex_header):
+        pass
+
+    # Parsing only
+    live_view = LiveView('127.0.0.1', 0)
+    view = memoryview(bytearray(packet))
+    _time('parse: legacy, no listener', n,
+          lambda: [legacy_image(packet, None) for _ in range(n)])
+    _time('parse: new, no listener (skip ex header)', n,
+          lambda: [live_view.parse(view) for _ in range(n)])
+    live_view.add_ex_header_listener(listener)
+    _time('parse: legacy, listener', n,
+          lambda: [legacy_image(packet, listener) for _ in range(n)])
+    _time('parse: new, listener', n,
+          lambda: [live_view.parse(view) for _ in range(n)])
+
+    # Receive and parse over loopback
+    live_view = LiveView('127.0.0.1', 0)
+    address = live_view.sock.getsockname()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def legacy_recv():
+        for _ in range(n):
+            sender.sendto(packet, address)
+            data, _ = live_view.sock.recvfrom(65536)
+            legacy_image(data, None)
+
+    def new_recv():
+        for _ in range(n):
+            sender.sendto(packet, address)
+            live_view.image_view()
+
+    _time('recv+parse: legacy', n, legacy_recv)
+    _time('recv+parse: new (image_view)', n, new_recv)
+
+
+if __name__ == '__main__':
+    main()
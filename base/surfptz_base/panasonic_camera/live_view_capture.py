@@ -0,0 +1,229 @@
+"""
+Record live view UDP packets to a file and replay them, so the parser,
+decoder and trackers can be exercised without a camera.
+
+    python -m panasonic_camera.live_view_capture record beach.lvcap
+    python -m panasonic_camera.live_view_capture replay beach.lvcap --speed 0
+    python -m panasonic_camera.live_view_capture bench beach.lvcap
+
+The file is a magic header followed by append-only records of a
+little-endian u64 receive time in ns, a u32 length and the raw packet.
+"""
+import argparse
+import logging
+import mmap
+import socket
+import struct
+import time
+from logging import Logger
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from panasonic_camera.live_view import LiveView, MAX_PACKET_SIZE
+
+logger: Logger = logging.getLogger(__name__)
+
+MAGIC = b'LVCAP\x00\x01\x00'
+_RECORD_HEADER = struct.Struct('<QI')
+
+
+class CaptureWriter:
+    """
+    Appends timestamped packets to a capture file. Appending to an
+    existing capture keeps its records.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._file: BinaryIO = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self.count = 0
+
+    def write(self, packet, t_ns: Optional[int] = None) -> None:
+        if t_ns is None:
+            t_ns = time.monotonic_ns()
+        self._file.write(_RECORD_HEADER.pack(t_ns, len(packet)))
+        self._file.write(packet)
+        self.count += 1
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> 'CaptureWriter':
+        return self
+
+    def __exit__(self, *_exc) -> None:
+        self.close()
+
+
+class CaptureReader:
+    """
+    Memory-mapped capture file. Iterating yields (t_ns, packet) with the
+    packet as a memoryview into the map, so reading doesn't copy. Packets
+    must be released (or dropped) before the reader is closed.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a live view capture')
+        self._view = memoryview(self._map)
+
+    def __iter__(self) -> Iterator[Tuple[int, memoryview]]:
+        offset = len(MAGIC)
+        end = len(self._map)
+        while offset + _RECORD_HEADER.size <= end:
+            t_ns, length = _RECORD_HEADER.unpack_from(self._map, offset)
+            offset += _RECORD_HEADER.size
+            if offset + length > end:
+                # Truncated by a capture that was killed mid-write
+                break
+            yield t_ns, self._view[offset:offset + length]
+            offset += length
+
+    def close(self) -> None:
+        if hasattr(self, '_view'):
+            self._view.release()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self) -> 'CaptureReader':
+        return self
+
+    def __exit__(self, *_exc) -> None:
+        self.close()
+
+
+def record(path: str,
+           ip: str = '0.0.0.0',
+           port: int = 49199,
+           duration: Optional[float] = None) -> int:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((ip, port))
+    sock.settimeout(0.5)
+    buffer = bytearray(MAX_PACKET_SIZE)
+    view = memoryview(buffer)
+    deadline = time.monotonic() + duration if duration else None
+    with CaptureWriter(path) as writer:
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                try:
+                    size = sock.recv_into(buffer)
+                except socket.timeout:
+                    continue
+                writer.write(view[:size])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sock.close()
+        return writer.count
+
+
+def replay(path: str,
+           host: str = '127.0.0.1',
+           port: int = 49199,
+           speed: float = 1.,
+           loop: bool = False) -> int:
+    """
+    Send the captured packets to host:port. speed 1 keeps the recorded
+    timing, 2 plays twice as fast and 0 sends as fast as possible.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sent = 0
+    with CaptureReader(path) as reader:
+        while True:
+            start = time.monotonic()
+            first_ns = None
+            for t_ns, packet in reader:
+                if speed > 0:
+                    if first_ns is None:
+                        first_ns = t_ns
+                    delay = start + (t_ns - first_ns) / 1e9 / speed \
+                        - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                sock.sendto(packet, (host, port))
+                packet.release()
+                sent += 1
+            if not loop:
+                break
+    sock.close()
+    return sent
+
+
+def iter_jpegs(path: str) -> Iterator[bytes]:
+    """
+    JPEG images of a capture, as the LiveView receiver would return them.
+    """
+    live_view = LiveView('127.0.0.1', 0)
+    try:
+        with CaptureReader(path) as reader:
+            for _t_ns, packet in reader:
+                jpeg = bytes(live_view.parse(packet))
+                packet.release()
+                yield jpeg
+    finally:
+        live_view.sock.close()
+
+
+def bench(path: str, decode_scale: int = 4) -> None:
+    from panasonic_camera.live_view_pipeline import decode_jpeg
+    live_view = LiveView('127.0.0.1', 0)
+    with CaptureReader(path) as reader:
+        start = time.perf_counter()
+        images = []
+        for _t_ns, packet in reader:
+            images.append(bytes(live_view.parse(packet)))
+            packet.release()
+        parsed = time.perf_counter()
+    live_view.sock.close()
+    if not images:
+        print('empty capture')
+        return
+    for jpeg in images:
+        decode_jpeg(jpeg, decode_scale)
+    decoded = time.perf_counter()
+    n = len(images)
+    print(f'{n} packets')
+    print(f'parse  {(parsed - start) / n * 1e6:8.1f} us/packet')
+    print(f'decode {(decoded - parsed) / n * 1e3:8.2f} ms/frame '
+          f'(scale {decode_scale})')
+
+
+def _main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Record and replay live view UDP streams.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    record_parser = commands.add_parser('record')
+    record_parser.add_argument('path')
+    record_parser.add_argument('--ip', default='0.0.0.0')
+    record_parser.add_argument('--port', type=int, default=49199)
+    record_parser.add_argument('--duration', type=float,
+                               help="Seconds to record, default until ^C.")
+    replay_parser = commands.add_parser('replay')
+    replay_parser.add_argument('path')
+    replay_parser.add_argument('--host', default='127.0.0.1')
+    replay_parser.add_argument('--port', type=int, default=49199)
+    replay_parser.add_argument('--speed', type=float, default=1.,
+                               help="Playback speed, 0 for as fast as "
+                                    "possible.")
+    replay_parser.add_argument('--loop', action='store_true')
+    bench_parser = commands.add_parser('bench')
+    bench_parser.add_argument('path')
+    bench_parser.add_argument('--scale', type=int, default=4,
+                              choices=(1, 2, 4, 8))
+    args = parser.parse_args()
+    if args.command == 'record':
+        count = record(args.path, args.ip, args.port, args.duration)
+        logger.info(f'recorded {count} packets to {args.path}')
+    elif args.command == 'replay':
+        count = replay(args.path, args.host, args.port, args.speed, args.loop)
+        logger.info(f'sent {count} packets')
+    else:
+        bench(args.path, args.scale)
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,259 @@
+import io
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from logging import Logger
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from panasonic_camera.live_view import LiveView
+
+logger: Logger = logging.getLogger(__name__)
+
+DROP_OLDEST = 'drop_oldest'
+KEEP_LATEST = 'keep_latest'
+
+
+@dataclass
+class Frame:
+    seq: int
+    pts: Optional[int]
+    received_at: float
+    jpeg: bytes
+    # RGB numpy array, set by the decoder stage
+    image: Any = None
+
+
+class FrameQueue:
+    """
+    Bounded queue between pipeline stages that never blocks the producer.
+    With DROP_OLDEST the oldest frame is evicted when the queue is full,
+    with KEEP_LATEST only the newest frame is kept. Frames older than the
+    last one put are dropped, since decoder workers may finish out of order.
+    """
+
+    def __init__(self, maxsize: int = 4, policy: str = DROP_OLDEST) -> None:
+        if policy not in (DROP_OLDEST, KEEP_LATEST):
+            raise ValueError(f'unknown drop policy {policy}')
+        self.maxsize = 1 if policy == KEEP_LATEST else maxsize
+        self.policy = policy
+        self.put_count = 0
+        self.drop_count = 0
+        self._frames: Deque[Frame] = deque()
+        self._last_seq = -1
+        self._condition = threading.Condition()
+
+    def put(self, frame: Frame) -> None:
+        with self._condition:
+            if frame.seq <= self._last_seq:
+                self.drop_count += 1
+                return
+            self._last_seq = frame.seq
+            if len(self._frames) >= self.maxsize:
+                self._frames.popleft()
+                self.drop_count += 1
+            self._frames.append(frame)
+            self.put_count += 1
+            self._condition.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Frame]:
+        with self._condition:
+            if not self._frames:
+                self._condition.wait(timeout)
+            return self._frames.popleft() if self._frames else None
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+
+class StageStats:
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.started = time.monotonic()
+
+    def to_dict(self, queue: Optional[FrameQueue] = None) -> dict:
+        elapsed = time.monotonic() - self.started
+        stats = {
+            'frames': self.count,
+            'fps': self.count / elapsed if elapsed else 0.,
+            'errors': self.errors,
+        }
+        if queue is not None:
+            stats['delivered'] = queue.put_count
+            stats['queued'] = len(queue)
+            stats['dropped'] = queue.drop_count
+        return stats
+
+
+def decode_jpeg(jpeg: bytes, scale: int = 1):
+    """
+    Decode JPEG data to an RGB numpy array. With scale 2, 4 or 8 the JPEG
+    decoder itself downscales, which is much cheaper than resizing later.
+    """
+    import numpy
+    import PIL.Image
+    image = PIL.Image.open(io.BytesIO(jpeg))
+    if scale > 1:
+        image.draft('RGB', (image.width // scale, image.height // scale))
+    return numpy.asarray(image.convert('RGB'))
+
+
+class LiveViewPipeline:
+    """
+    Staged live view processing:
+
+    receiver thread -> decoder workers -> one thread per consumer
+
+    Stages are joined by FrameQueues, so a slow decoder or consumer drops
+    frames instead of backing up the socket. Consumers either get the raw
+    JPEG frames straight from the receiver or decoded frames.
+    """
+
+    def __init__(self,
+                 live_view: LiveView,
+                 decoder_workers: int = 2,
+                 decode_queue_size: int = 4,
+                 decode_policy: str = DROP_OLDEST,
+                 decode_scale: int = 1) -> None:
+        self.live_view = live_view
+        self.decoder_workers = decoder_workers
+        self.decode_scale = decode_scale
+        self.decode_queue = FrameQueue(decode_queue_size, decode_policy)
+        self._raw_queues: List[FrameQueue] = []
+        self._decoded_queues: List[FrameQueue] = []
+        self._consumer_stats: Dict[str, StageStats] = {}
+        self._consumer_queues: Dict[str, FrameQueue] = {}
+        self._threads: List[threading.Thread] = []
+        self._stop_event = threading.Event()
+        self.receiver_stats = StageStats('receiver')
+        self.decoder_stats = StageStats('decoder')
+        self._stats_lock = threading.Lock()
+        self.timeouts = 0
+        self.listener_errors = 0
+        self._seq = 0
+        # Called with every received packet, e.g. as a liveness heartbeat
+        self.packet_listeners: List[Callable[[], None]] = []
+
+    def add_consumer(self,
+                     name: str,
+                     callback: Optional[Callable[[Frame], None]] = None,
+                     decoded: bool = True,
+                     maxsize: int = 2,
+                     policy: str = KEEP_LATEST) -> FrameQueue:
+        """
+        Register a consumer. If callback is given, it is called with each
+        frame on its own thread, otherwise frames are left in the returned
+        queue for the caller to get(). Must be called before start().
+        """
+        queue = FrameQueue(maxsize, policy)
+        (self._decoded_queues if decoded else self._raw_queues).append(queue)
+        stats = StageStats(name)
+        self._consumer_stats[name] = stats
+        self._consumer_queues[name] = queue
+        if callback is not None:
+            self._threads.append(threading.Thread(
+                target=self._consume, args=(queue, callback, stats),
+                name=f'live-view-{name}', daemon=True))
+        return queue
+
+    def start(self) -> None:
+        self._threads.append(threading.Thread(
+            target=self._receive, name='live-view-receiver', daemon=True))
+        if self._decoded_queues:
+            for i in range(self.decoder_workers):
+                self._threads.append(threading.Thread(
+                    target=self._decode, name=f'live-view-decoder-{i}',
+                    daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _receive(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                jpeg = bytes(self.live_view.image_view())
+            except socket.timeout:
+                # Expected while the camera isn't streaming
+                self.timeouts += 1
+                continue
+            except OSError as e:
+                self.receiver_stats.errors += 1
+                logger.error(f'error reading live view image: {e}')
+                continue
+            except Exception:
+                # A malformed packet, or an ex header listener failed. Either
+                # way only this packet is lost, the receiver keeps running.
+                self.receiver_stats.errors += 1
+                logger.exception('could not read live view packet')
+                continue
+            self._seq += 1
+            frame = Frame(seq=self._seq,
+                          pts=self.live_view.last_pts,
+                          received_at=time.monotonic(),
+                          jpeg=jpeg)
+            self.receiver_stats.count += 1
+            for listener in self.packet_listeners:
+                try:
+                    listener()
+                except Exception:
+                    self.listener_errors += 1
+                    logger.exception('live view packet listener failed')
+            for queue in self._raw_queues:
+                queue.put(frame)
+            if self._decoded_queues:
+                self.decode_queue.put(frame)
+
+    def _decode(self) -> None:
+        while not self._stop_event.is_set():
+            frame = self.decode_queue.get(timeout=0.5)
+            if frame is None:
+                continue
+            try:
+                image = decode_jpeg(frame.jpeg, self.decode_scale)
+            except Exception as e:
+                with self._stats_lock:
+                    self.decoder_stats.errors += 1
+                logger.warning(f'could not decode live view frame: {e}')
+                continue
+            decoded = Frame(seq=frame.seq, pts=frame.pts,
+                            received_at=frame.received_at,
+                            jpeg=frame.jpeg, image=image)
+            with self._stats_lock:
+                self.decoder_stats.count += 1
+            for queue in self._decoded_queues:
+                queue.put(decoded)
+
+    def _consume(self,
+                 queue: FrameQueue,
+                 callback: Callable[[Frame], None],
+                 stats: StageStats) -> None:
+        while not self._stop_event.is_set():
+            frame = queue.get(timeout=0.5)
+            if frame is None:
+                continue
+            try:
+                callback(frame)
+                stats.count += 1
+            except Exception:
+                stats.errors += 1
+                logger.exception(f'live view consumer {stats.name} failed')
+
+    def stats(self) -> Dict[str, dict]:
+        stats = {
+            'receiver': dict(self.receiver_stats.to_dict(),
+                             timeouts=self.timeouts,
+                             listener_errors=self.listener_errors),
+            'decoder': self.decoder_stats.to_dict(self.decode_queue),
+        }
+        for name, consumer_stats in self._consumer_stats.items():
+            stats[name] = consumer_stats.to_dict(self._consumer_queues[name])
+        return stats
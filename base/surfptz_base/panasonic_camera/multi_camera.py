@@ -0,0 +1,222 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from logging import Logger
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+from panasonic_camera.camera import PanasonicCamera
+from panasonic_camera.camera_cache import CachedCamera
+from panasonic_camera.camera_manager import PanasonicCameraManager
+from panasonic_camera.discover import discover_panasonic_camera_devices
+from panasonic_camera.interval import Backoff
+from panasonic_camera.stats import CommandStats
+
+logger: Logger = logging.getLogger(__name__)
+
+DEFAULT_CAMERAS_PATH = os.path.expanduser('~/.surfptz/cameras.json')
+
+
+@dataclass
+class CameraSlot:
+    camera_id: str
+    udn: str
+    # UDP port the camera streams its live view to
+    port: int
+    manager: PanasonicCameraManager
+
+
+class MultiCameraManager(threading.Thread):
+    """
+    Manages every Panasonic camera on the network, each through its own
+    PanasonicCameraManager pinned to the camera's hostname.
+
+    Cameras get stable ids (cam0, cam1, ...) and live view ports
+    (base_port, base_port + 1, ...) by UPnP UDN, remembered in
+    DEFAULT_CAMERAS_PATH so a camera keeps its id and port across restarts.
+    The first camera ever seen (cam0, streaming to base_port) is the primary
+    one, which single-camera code reaches through the camera property.
+
+    On start, known cameras connect straight to their cached hostnames.
+    SSDP scans then pick up new cameras and ones that moved.
+    """
+
+    def __init__(self,
+                 identify_as: Optional[str] = None,
+                 base_port: int = 49199,
+                 scan_interval: float = 30.,
+                 registry_path: str = DEFAULT_CAMERAS_PATH) -> None:
+        super().__init__(daemon=True)
+        self._identify_as = identify_as
+        self.base_port = base_port
+        self.scan_interval = scan_interval
+        self._registry_path = registry_path
+        self._registry: Dict[str, dict] = self._load_registry()
+        self.cameras: Dict[str, CameraSlot] = {}
+        self._lock = threading.Lock()
+        self._camera_listeners: List[Callable[[CameraSlot], None]] = []
+        self._executor = ThreadPoolExecutor(thread_name_prefix='broadcast')
+        self._backoff = Backoff(initial=1., maximum=scan_interval)
+        self._stop_event = threading.Event()
+
+    def _load_registry(self) -> Dict[str, dict]:
+        try:
+            with open(self._registry_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            logger.warning(f'Ignoring unreadable {self._registry_path}: {e}')
+            return {}
+
+    def _cache_path(self, camera_id: str) -> str:
+        return os.path.join(os.path.dirname(self._registry_path),
+                            f'camera-{camera_id}.json')
+
+    def _save_registry(self) -> None:
+        os.makedirs(os.path.dirname(self._registry_path), exist_ok=True)
+        tmp_path = self._registry_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._registry, f, indent=2)
+        os.replace(tmp_path, self._registry_path)
+
+    def add_camera_listener(self, callback: Callable[[CameraSlot], None]):
+        """
+        callback(slot) is called for each new camera before its manager
+        starts, e.g. to start a live view receiver on slot.port.
+        """
+        self._camera_listeners.append(callback)
+
+    @property
+    def primary(self) -> Optional[CameraSlot]:
+        with self._lock:
+            for slot in self.cameras.values():
+                if slot.port == self.base_port:
+                    return slot
+        return None
+
+    @property
+    def camera(self) -> Optional[PanasonicCamera]:
+        primary = self.primary
+        return primary.manager.camera if primary else None
+
+    @property
+    def stats(self) -> CommandStats:
+        primary = self.primary
+        return primary.manager.stats if primary else CommandStats()
+
+    def _slot_for(self, udn: str, hostname: str) -> None:
+        with self._lock:
+            slot = self.cameras.get(udn)
+            if slot is not None:
+                if slot.manager.hostname != hostname:
+                    logger.info(f'{slot.camera_id} moved to {hostname}')
+                    slot.manager.hostname = hostname
+                return
+            entry = self._registry.get(udn)
+            if entry is None:
+                index = len(self._registry)
+                entry = {'camera_id': f'cam{index}',
+                         'port': self.base_port + index}
+                self._registry[udn] = entry
+                try:
+                    self._save_registry()
+                except OSError as e:
+                    logger.warning(f'Could not save camera registry: {e}')
+            camera_id = entry['camera_id']
+            manager = PanasonicCameraManager(
+                identify_as=self._identify_as,
+                hostname=hostname,
+                stream_port=entry['port'],
+                cache_path=self._cache_path(camera_id))
+            slot = CameraSlot(camera_id=camera_id, udn=udn,
+                              port=entry['port'], manager=manager)
+            self.cameras[udn] = slot
+        logger.info(f'New camera {camera_id} at {hostname}, '
+                    f'live view on port {slot.port}')
+        for listener in self._camera_listeners:
+            listener(slot)
+        manager.start()
+
+    def connect_cached(self) -> int:
+        """
+        Add every registered camera with a cached hostname, without waiting
+        for a scan. Returns the number of cameras added.
+        """
+        added = 0
+        for udn, entry in list(self._registry.items()):
+            cached = CachedCamera.load(self._cache_path(entry['camera_id']))
+            if cached is not None:
+                self._slot_for(udn, cached.hostname)
+                added += 1
+        return added
+
+    def scan(self) -> int:
+        """
+        Run one SSDP scan and add any new cameras. Returns the number of
+        cameras found.
+        """
+        devices = discover_panasonic_camera_devices()
+        for device in devices:
+            self._slot_for(device.udn, urlparse(device.location).hostname)
+        return len(devices)
+
+    def run(self) -> None:
+        self.connect_cached()
+        while not self._stop_event.is_set():
+            found = self.scan()
+            # Scan often until a camera shows up, rarely afterwards
+            if found:
+                self._backoff.reset()
+                delay = self.scan_interval
+            else:
+                delay = self._backoff.next()
+            self._stop_event.wait(delay)
+
+    def broadcast(self,
+                  command: str,
+                  timeout: float = 5.) -> Dict[str, Optional[str]]:
+        """
+        Call command (a PanasonicCamera method name, e.g. 'video_recstart')
+        on all connected cameras at once. Takes as long as the slowest
+        camera. Returns the error, or None, per camera id.
+        """
+        futures: Dict[str, Future] = {}
+        with self._lock:
+            slots = list(self.cameras.values())
+        for slot in slots:
+            camera = slot.manager.camera
+            if camera is not None:
+                futures[slot.camera_id] = self._executor.submit(
+                    getattr(camera, command))
+        wait(futures.values(), timeout=timeout)
+        results: Dict[str, Optional[str]] = {}
+        for camera_id, future in futures.items():
+            if not future.done():
+                results[camera_id] = 'timeout'
+            elif future.exception() is not None:
+                results[camera_id] = repr(future.exception())
+                logger.error(f'{command} failed on {camera_id}: '
+                             f'{future.exception()}')
+            else:
+                results[camera_id] = None
+        return results
+
+    def states(self) -> Dict[str, dict]:
+        with self._lock:
+            slots = list(self.cameras.values())
+        return {slot.camera_id: {'state': slot.manager.state,
+                                 'hostname': slot.manager.hostname,
+                                 'port': slot.port}
+                for slot in slots}
+
+    def cancel(self) -> None:
+        self._stop_event.set()
+        with self._lock:
+            slots = list(self.cameras.values())
+        for slot in slots:
+            slot.manager.cancel()
+        self._executor.shutdown(wait=False)
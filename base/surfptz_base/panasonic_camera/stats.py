@@ -0,0 +1,67 @@
+import threading
+from bisect import bisect_left
+from typing import Dict, List
+
+# Upper bounds of the latency buckets in milliseconds
+BUCKETS_MS: List[float] = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000,
+                           float('inf')]
+
+
+class LatencyHistogram:
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(BUCKETS_MS)
+        self.count = 0
+        self.total_ms = 0.
+        self.max_ms = 0.
+
+    def add(self, latency_ms: float) -> None:
+        self.counts[bisect_left(BUCKETS_MS, latency_ms)] += 1
+        self.count += 1
+        self.total_ms += latency_ms
+        self.max_ms = max(self.max_ms, latency_ms)
+
+    def percentile(self, p: float) -> float:
+        """
+        Upper bound of the bucket holding the p-th percentile.
+        """
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max_ms)
+        return 0.
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'mean_ms': self.total_ms / self.count if self.count else 0.,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'max_ms': self.max_ms,
+            'buckets': {str(bound): count
+                        for bound, count in zip(BUCKETS_MS, self.counts)},
+        }
+
+
+class CommandStats:
+    """
+    Latency histograms of camera requests, keyed by command.
+    """
+
+    def __init__(self) -> None:
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def add(self, command: str, latency_ms: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(command)
+            if histogram is None:
+                histogram = self._histograms[command] = LatencyHistogram()
+            histogram.add(latency_ms)
+
+    def to_dict(self) -> Dict[str, dict]:
+        with self._lock:
+            return {command: histogram.to_dict()
+                    for command, histogram in self._histograms.items()}
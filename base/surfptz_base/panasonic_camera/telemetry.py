@@ -0,0 +1,70 @@
+import threading
+import time
+from typing import Optional, Tuple
+
+from panasonic_camera.live_view import ExHeader1, ExHeader2
+from zoom import zoom_ratio_from_ex_header
+
+
+class CameraTelemetry:
+    """
+    Latest camera state pushed in the live view ex headers. Frames arrive
+    at 30 fps but the state rarely changes, so each header is only compared
+    with the last one and the state dict is rebuilt on changes only. Every
+    change bumps version, which clients can wait on instead of polling.
+    """
+
+    def __init__(self) -> None:
+        self.version = 0
+        self.updated_at: Optional[float] = None
+        self._key: Optional[Tuple] = None
+        self._state: dict = {}
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def _key_of(ex_header) -> Optional[Tuple]:
+        if isinstance(ex_header, ExHeader1):
+            boxes = tuple((box.rectangle, box.color, box.c)
+                          for box in ex_header.n)
+            return ex_header.zoomRatio, ex_header.zoomRatioPos, boxes
+        if isinstance(ex_header, ExHeader2):
+            return ex_header.zoomRatio, ex_header.zoomRatioPos, None
+        # Audio format headers etc. carry no camera state
+        return None
+
+    def on_ex_header(self, ex_header) -> None:
+        """
+        LiveView ex header listener.
+        """
+        key = self._key_of(ex_header)
+        if key is None or key == self._key:
+            return
+        _, zoom_ratio_pos, boxes = key
+        state = {
+            'zoom_ratio': zoom_ratio_from_ex_header(ex_header),
+            'zoom_ratio_pos': zoom_ratio_pos,
+        }
+        if boxes is not None:
+            state['focus_boxes'] = [
+                {'rectangle': rectangle, 'color': color, 'c': c}
+                for rectangle, color, c in boxes]
+        with self._condition:
+            self._key = key
+            self._state = state
+            self.version += 1
+            self.updated_at = time.time()
+            self._condition.notify_all()
+
+    def state(self) -> dict:
+        with self._condition:
+            return dict(self._state, version=self.version,
+                        updated_at=self.updated_at)
+
+    def wait_for_change(self, version: int, timeout: float) -> dict:
+        """
+        State once its version is above version, or the current state
+        after timeout seconds.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.version > version, timeout)
+        return self.state()
@@ -0,0 +1,65 @@
+"""
+Query parameter schemas shared by the Flask and ASGI servers, so each route
+declares its parameters once instead of parsing them by hand.
+"""
+from dataclasses import dataclass
+from typing import Any, Callable, Mapping, Optional, Tuple
+
+
+class ParamError(ValueError):
+    """
+    Invalid request parameters, answered with 400 and the message.
+    """
+
+
+@dataclass(frozen=True)
+class Param:
+    name: str
+    type: Callable[[str], Any] = float
+    required: bool = True
+    default: Any = None
+    # Larger values are clamped, e.g. long poll timeouts
+    maximum: Optional[float] = None
+
+
+def flag(value: str) -> bool:
+    return value in ('1', 'true')
+
+
+def parse_params(args: Mapping[str, str], schema: Tuple[Param, ...]) -> dict:
+    """
+    Values of the schema's parameters in args, by name. Raises ParamError
+    for missing or malformed ones.
+    """
+    values = {}
+    for param in schema:
+        raw = args.get(param.name)
+        if raw is None:
+            if param.required:
+                raise ParamError(f"Missing query parameter '{param.name}'")
+            values[param.name] = param.default
+            continue
+        try:
+            value = param.type(raw)
+        except ValueError:
+            raise ParamError(
+                f"Query parameter '{param.name}' should be a number")
+        if param.maximum is not None:
+            value = min(value, param.maximum)
+        values[param.name] = value
+    return values
+
+
+ANGLE = (Param('pan', int), Param('tilt', int))
+RELCOORDS = (Param('n'), Param('e'), Param('el'))
+ORIGIN = (Param('lat'), Param('lon'))
+ABSCOORDS = ORIGIN + (Param('tag', str, required=False, default='default'),)
+ENABLED = (Param('enabled', flag, required=False),)
+RIDES = (Param('since', required=False, default=0.),)
+CLIP = (Param('start', required=False),
+        Param('end', required=False),
+        Param('seconds', required=False, default=10.))
+CAMERA_STATE = (Param('since', int, required=False),
+                Param('timeout', required=False, default=10., maximum=30.))
+LIVE = (Param('camera', str, required=False),)
+FOLLOW = (Param('tag', str, required=False),)
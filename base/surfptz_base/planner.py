@@ -0,0 +1,63 @@
+from dataclasses import dataclass
+from typing import Optional
+
+
+def wrap_180(angle: float) -> float:
+    """
+    Map an angle difference to the range -180 to 180.
+    """
+    return (angle + 180) % 360 - 180
+
+
+@dataclass(frozen=True)
+class YawPlan:
+    # IMU yaw that will actually be driven to, clamped to the reachable range
+    target: float
+    # Signed error in degrees along the feasible path. Positive means yaw has
+    # to decrease (yaw_relays[0]), negative that it has to increase.
+    error: float
+    # False if the requested yaw was in the deadzone and target was clamped
+    reachable: bool
+    # Estimated seconds to get there at full speed
+    eta: float
+
+
+def plan_yaw(current: float,
+             target: float,
+             max_cw: Optional[float],
+             max_ccw: Optional[float],
+             slew_rate: float) -> YawPlan:
+    """
+    Plan a yaw move between 0-360 IMU angles. The head can only travel
+    clockwise from max_ccw to max_cw, so a move never crosses the deadzone
+    between them even if the other way around would be shorter. Targets in
+    the deadzone are clamped to the nearest stop. Without a calibration
+    (max_cw or max_ccw is None) the shortest way around is used.
+    """
+    if max_cw is None or max_ccw is None:
+        error = wrap_180(current - target)
+        return YawPlan(target=target, error=error, reachable=True,
+                       eta=abs(error) / slew_rate)
+
+    # Work in distance travelled clockwise from the CCW stop
+    travel = (max_cw - max_ccw) % 360
+    current_s = _clamp_to_travel((current - max_ccw) % 360, travel)
+    target_s = (target - max_ccw) % 360
+    reachable = target_s <= travel
+    if not reachable:
+        target_s = _clamp_to_travel(target_s, travel)
+        target = (max_ccw + target_s) % 360
+    error = current_s - target_s
+    return YawPlan(target=target, error=error, reachable=reachable,
+                   eta=abs(error) / slew_rate)
+
+
+def _clamp_to_travel(s: float, travel: float) -> float:
+    """
+    Move a position inside the deadzone to whichever stop is closer.
+    """
+    if s <= travel:
+        return s
+    past_cw = s - travel
+    before_ccw = 360 - s
+    return travel if past_cw <= before_ccw else 0.
@@ -0,0 +1,74 @@
+import logging
+import socket
+import threading
+from typing import Callable, Dict
+
+from wire import Fix, decode_position
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 5005
+
+
+class PositionReceiver(threading.Thread):
+    """
+    Receives position datagrams from tags (see wire.py) and hands each fix
+    to callback(tag_id, fix). Per tag, a datagram with a sequence number
+    not above the last one seen is dropped as duplicate or out of order,
+    unless it is far behind, which means the tag app restarted.
+    """
+
+    def __init__(self,
+                 callback: Callable[[str, Fix], None],
+                 ip: str = '0.0.0.0',
+                 port: int = DEFAULT_PORT,
+                 restart_gap: int = 1000) -> None:
+        super().__init__(daemon=True)
+        self.callback = callback
+        self.restart_gap = restart_gap
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((ip, port))
+        self.sock.settimeout(0.5)
+        self.received = 0
+        self.dropped = 0
+        self.invalid = 0
+        self._last_seq: Dict[str, int] = {}
+        self._stop_event = threading.Event()
+
+    def accept(self, tag_id: str, seq: int) -> bool:
+        last = self._last_seq.get(tag_id)
+        if last is not None and last - self.restart_gap < seq <= last:
+            return False
+        self._last_seq[tag_id] = seq
+        return True
+
+    def run(self) -> None:
+        buffer = bytearray(512)
+        view = memoryview(buffer)
+        while not self._stop_event.is_set():
+            try:
+                size = self.sock.recv_into(buffer)
+            except socket.timeout:
+                continue
+            try:
+                tag_id, seq, fix = decode_position(view[:size])
+            except (ValueError, UnicodeDecodeError) as e:
+                self.invalid += 1
+                logger.debug(f'invalid position datagram: {e}')
+                continue
+            self.received += 1
+            if not self.accept(tag_id, seq):
+                self.dropped += 1
+                continue
+            try:
+                self.callback(tag_id, fix)
+            except Exception:
+                logger.exception(f'position of {tag_id} not handled')
+        self.sock.close()
+
+    def cancel(self) -> None:
+        self._stop_event.set()
+
+    def stats(self) -> dict:
+        return {'received': self.received, 'dropped': self.dropped,
+                'invalid': self.invalid}
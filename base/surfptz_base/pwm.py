@@ -0,0 +1,80 @@
+import logging
+import threading
+import time
+from typing import Dict, Sequence, Tuple, Callable, Any
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def pulse_duration(error: float,
+                   slew_rate: float,
+                   coast: float,
+                   min_duration: float,
+                   max_duration: float) -> float:
+    """
+    How long to hold a relay on to cover error degrees, given the axis slews
+    at slew_rate degrees per second and keeps moving for coast seconds after
+    the relay switches off (motor run-down plus IMU latency).
+    """
+    duration = abs(error) / slew_rate - coast
+    return min(max(duration, min_duration), max_duration)
+
+
+class RelayPulser(threading.Thread):
+    """
+    Software PWM for the gimbal's direction relays. pulse() switches a relay
+    on and a timer thread ticking at rate Hz switches it off again once its
+    pulse has elapsed.
+    """
+
+    def __init__(self,
+                 rate: float = 50.,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], Any] = time.sleep) -> None:
+        super().__init__(daemon=True)
+        self.tick = 1. / rate
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        # id of relay pair -> (relay that is on, time to switch it off)
+        self._deadlines: Dict[int, Tuple[Any, float]] = {}
+        self._stop_event = threading.Event()
+
+    def pulse(self, relays: Sequence, index: int, duration: float) -> None:
+        """
+        Switch relays[index] on for duration seconds, making sure the other
+        relay of the pair is off.
+        """
+        with self._lock:
+            for i, relay in enumerate(relays):
+                if i != index:
+                    relay.off()
+            relays[index].on()
+            self._deadlines[id(relays)] = (relays[index],
+                                           self._clock() + duration)
+
+    def cancel(self, relays: Sequence) -> None:
+        with self._lock:
+            self._deadlines.pop(id(relays), None)
+            for relay in relays:
+                relay.off()
+
+    def is_pulsing(self, relays: Sequence) -> bool:
+        with self._lock:
+            return id(relays) in self._deadlines
+
+    def _expire(self) -> None:
+        now = self._clock()
+        with self._lock:
+            for key, (relay, deadline) in list(self._deadlines.items()):
+                if now >= deadline:
+                    relay.off()
+                    del self._deadlines[key]
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            self._expire()
+            self._sleep(self.tick)
+
+    def close(self) -> None:
+        self._stop_event.set()
@@ -0,0 +1,285 @@
+"""
+Automatic recording: a ride detector fed by tag speeds, and optionally by
+motion in the live view, starts the camera recording at the first sign of a
+ride and stops it once the rides are over. Every ride is appended to a JSON
+lines index so only the relevant clips need to be pulled off the camera.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, Optional
+
+from tags import TagState
+from vision import MotionBlobTracker
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Error, or None on success, per camera id as returned by
+# MultiCameraManager.broadcast
+RecordingResults = Dict[str, Optional[str]]
+
+DEFAULT_RIDE_INDEX_PATH = os.path.expanduser('~/.surfptz/rides.jsonl')
+
+# Source name of rides detected from live view motion instead of a tag
+MOTION_SOURCE = 'motion'
+
+
+@dataclass
+class Ride:
+    source: str
+    # Wall clock times. The clip is the ride padded by the pre- and
+    # post-roll, but never starts before the recording did.
+    recording_start: float
+    ride_start: float
+    ride_end: Optional[float] = None
+    clip_start: Optional[float] = None
+    clip_end: Optional[float] = None
+    # Peak tag speed in m/s, or peak motion coverage
+    peak: float = 0.
+
+
+class RideIndex:
+    """
+    Append-only JSON lines file, one ride per line.
+    """
+
+    def __init__(self, path: str = DEFAULT_RIDE_INDEX_PATH) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, ride: Ride) -> None:
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(asdict(ride)) + '\n')
+            except OSError as e:
+                logger.error(f'Could not write ride index {self.path}: {e}')
+
+    def read(self, since: float = 0.):
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+        rides = []
+        for line in lines:
+            try:
+                ride = json.loads(line)
+            except ValueError:
+                # Torn last line after a power cut
+                continue
+            if ride.get('ride_start', 0.) >= since:
+                rides.append(ride)
+        return rides
+
+
+class RideDetector(threading.Thread):
+    """
+    Decides when the camera records. A tag going faster than ride_speed is
+    the first sign of a ride, well before the TagRegistry confirms it as
+    riding, so recording starts right away. If no ride is confirmed within
+    arm_timeout_s it was a false start and recording stops again. Once the
+    last ride has ended, recording goes on for post_roll_s in case another
+    ride starts. The camera can't record the past, so pre_roll_s only widens
+    the clip logged in the index, back to when recording started at most.
+    A ride whose source stops reporting (a tag's battery died, it left the
+    wifi) ends stale_after_s after it was last heard from.
+
+    start_recording and stop_recording return the per camera errors of
+    MultiCameraManager.broadcast. The camera counts as recording or stopped
+    only once every camera reported success, otherwise the command is
+    retried after retry_s.
+
+    With energy_threshold set, decoded live view frames passed to on_frame
+    count as a ride while more than that fraction of the frame moves for
+    energy_confirm_s, for sessions without tags.
+    """
+
+    def __init__(self,
+                 start_recording: Callable[[], RecordingResults],
+                 stop_recording: Callable[[], RecordingResults],
+                 index: Optional[RideIndex] = None,
+                 ride_speed: float = 3.5,
+                 pre_roll_s: float = 3.,
+                 post_roll_s: float = 5.,
+                 arm_timeout_s: float = 5.,
+                 stale_after_s: float = 10.,
+                 retry_s: float = 2.,
+                 energy_threshold: Optional[float] = None,
+                 energy_confirm_s: float = 1.,
+                 clock: Callable[[], float] = time.time) -> None:
+        super().__init__(name='ride-detector', daemon=True)
+        self.start_recording = start_recording
+        self.stop_recording = stop_recording
+        self.index = index or RideIndex()
+        self.ride_speed = ride_speed
+        self.pre_roll_s = pre_roll_s
+        self.post_roll_s = post_roll_s
+        self.arm_timeout_s = arm_timeout_s
+        self.stale_after_s = stale_after_s
+        self.retry_s = retry_s
+        self.energy_threshold = energy_threshold
+        self.energy_confirm_s = energy_confirm_s
+        self.clock = clock
+        self.enabled = False
+        self.motion = MotionBlobTracker()
+        # Whether the camera should record, and whether it was told to
+        self.recording = False
+        self._camera_recording = False
+        self._recording_start = 0.
+        self._last_sign = 0.
+        self._last_ride_end: Optional[float] = None
+        self._rides: Dict[str, Ride] = {}
+        # When each source with an open ride last reported
+        self._last_seen: Dict[str, float] = {}
+        self._retry_at = 0.
+        self._energy_since: Optional[float] = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+
+    def set_enabled(self, enabled: bool) -> None:
+        """
+        Disabling hands recording back to the user as is, without stopping
+        a recording in progress.
+        """
+        with self._lock:
+            self.enabled = enabled
+            if not enabled:
+                self._end_rides(self.clock())
+                self.recording = False
+                self._camera_recording = False
+
+    def on_tag(self, state: TagState) -> None:
+        """
+        Call with the TagRegistry state after every tag update.
+        """
+        self._observe(state.tag_id, sign=state.speed > self.ride_speed,
+                      riding=state.riding, level=state.speed)
+
+    def on_frame(self, frame) -> None:
+        """
+        LiveViewPipeline consumer callback for decoded frames.
+        """
+        if self.energy_threshold is None:
+            return
+        detection = self.motion.update(frame.image)
+        energy = detection.coverage if detection is not None else 0.
+        now = self.clock()
+        sign = energy > self.energy_threshold
+        if not sign:
+            self._energy_since = None
+        elif self._energy_since is None:
+            self._energy_since = now
+        riding = sign and now - self._energy_since >= self.energy_confirm_s
+        self._observe(MOTION_SOURCE, sign=sign, riding=riding, level=energy)
+
+    def _observe(self, source: str, sign: bool, riding: bool,
+                 level: float) -> None:
+        with self._lock:
+            if not self.enabled:
+                return
+            now = self.clock()
+            ride = self._rides.get(source)
+            self._last_seen[source] = now
+            if riding:
+                if ride is None:
+                    ride = Ride(source=source,
+                                recording_start=self._recording_start,
+                                ride_start=now)
+                    self._rides[source] = ride
+                    logger.info(f'ride by {source} started')
+                ride.peak = max(ride.peak, level)
+            elif ride is not None:
+                self._end_ride(ride, now)
+            if not (sign or riding):
+                return
+            self._last_sign = now
+            if not self.recording:
+                self.recording = True
+                self._recording_start = now
+                self._last_ride_end = None
+                if ride is not None:
+                    ride.recording_start = now
+                logger.info(f'recording on first sign of a ride by {source}')
+        self._wake.set()
+
+    def _end_ride(self, ride: Ride, now: float) -> None:
+        # Caller must hold _lock
+        ride.ride_end = now
+        ride.clip_start = max(ride.ride_start - self.pre_roll_s,
+                              ride.recording_start)
+        ride.clip_end = now + self.post_roll_s
+        del self._rides[ride.source]
+        self._last_seen.pop(ride.source, None)
+        self._last_ride_end = now
+        logger.info(f'ride by {ride.source} ended after '
+                    f'{now - ride.ride_start:.1f} s')
+        self.index.append(ride)
+
+    def _end_rides(self, now: float) -> None:
+        # Caller must hold _lock
+        for ride in list(self._rides.values()):
+            self._end_ride(ride, now)
+
+    def _update(self) -> None:
+        with self._lock:
+            now = self.clock()
+            for ride in list(self._rides.values()):
+                last_seen = self._last_seen.get(ride.source, ride.ride_start)
+                if now - last_seen > self.stale_after_s:
+                    logger.warning(f'{ride.source} stopped reporting, '
+                                   f'ending its ride')
+                    self._end_ride(ride, last_seen)
+            if self.recording and not self._rides:
+                if self._last_ride_end is not None:
+                    done = now - max(self._last_ride_end,
+                                     self._last_sign) > self.post_roll_s
+                else:
+                    done = now - self._last_sign > self.arm_timeout_s
+                    if done:
+                        logger.info('false start, no ride confirmed')
+                if done:
+                    self.recording = False
+            recording = self.recording
+            if recording == self._camera_recording or now < self._retry_at:
+                return
+        action = 'start' if recording else 'stop'
+        try:
+            if recording:
+                results = self.start_recording()
+            else:
+                results = self.stop_recording()
+        except Exception as e:
+            results = {'': repr(e)}
+        failed = {camera_id: error for camera_id, error in results.items()
+                  if error is not None}
+        with self._lock:
+            if failed or not results:
+                logger.error(f'Could not {action} recording on '
+                             f'{failed or "any camera"}, retrying')
+                self._retry_at = now + self.retry_s
+                return
+            self._retry_at = 0.
+            if self.enabled:
+                self._camera_recording = recording
+
+    def status(self) -> dict:
+        with self._lock:
+            return {'enabled': self.enabled,
+                    'recording': self.recording,
+                    'riding': sorted(self._rides)}
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            self._update()
+            self._wake.wait(0.25)
+            self._wake.clear()
+
+    def cancel(self) -> None:
+        self._stop_event.set()
+        self._wake.set()
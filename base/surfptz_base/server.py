@@ -1,64 +1,205 @@
 import logging
 
-from flask import Flask, Response, request, redirect, jsonify
-from gimbal import BescorGimbal
-from panasonic_camera import camera_manager
+import time
+
+from flask import Flask, Response, request, redirect, jsonify, send_file
+import params
+from gimbal import MotionAborted, OriginNotSet
+from params import ParamError, parse_params
+from station import BaseStation
+from wire import Fix, decode_fixes
 app = Flask(__name__)
+try:
+    from flask_sock import Sock
+    sock = Sock(app)
+except ImportError:
+    sock = None
 
 logging.basicConfig(level=logging.INFO)
 
-camera_mgr = camera_manager.PanasonicCameraManager(identify_as='surfptz')
-camera_mgr.start()
-gimbal = BescorGimbal()
+# The development server: hardware is set up at import. See asgi_server.py
+# for the production server.
+station = BaseStation()
+station.start()
+gimbal = station.gimbal
+motion = station.motion
+
+
+@app.errorhandler(ParamError)
+def param_error(e):
+    return str(e), 400
+
+@app.errorhandler(MotionAborted)
+def motion_aborted(e):
+    return f"Stopped: {e}", 409
+
+@app.errorhandler(OriginNotSet)
+def origin_not_set(e):
+    return str(e), 409
 
 @app.route('/api/initialize', methods=['POST', 'GET'])
 def initialize():
-    gimbal.initialize()
+    motion.run_exclusive(gimbal.initialize)
     return '', 204
 
 @app.route('/api/angle', methods=['POST', 'GET'])
 def angle():
-    if 'pan' not in request.args:
-        return "Missing query parameter 'pan'", 400
-    if 'tilt' not in request.args:
-        return "Missing query parameter 'tilt'", 400
-    try:
-        pan_angle = int(request.args.get('pan'))
-    except ValueError:
-        return "Query parameter 'pan' should be a number", 400
-    try:
-        tilt_angle = int(request.args.get('tilt'))
-    except ValueError:
-        return "Query parameter 'tilt' should be a number", 400
-    logging.debug(f'angle pan={pan_angle} tilt={tilt_angle}')
-    gimbal.goto(pitch_angle=tilt_angle, yaw_angle=pan_angle)
+    args = parse_params(request.args, params.ANGLE)
+    logging.debug(f'angle pan={args["pan"]} tilt={args["tilt"]}')
+    return jsonify(station.start_motion(yaw_angle=args['pan'],
+                                        pitch_angle=args['tilt'])), 202
+
+@app.route('/api/motion/<int:motion_id>', methods=['GET'])
+def motion_status(motion_id):
+    status = motion.status(motion_id)
+    if status is None:
+        return f"Unknown motion id {motion_id}", 404
+    return jsonify({'motion_id': motion_id, 'status': status}), 200
+
+@app.route('/api/stop', methods=['POST', 'GET'])
+def stop():
+    motion.halt()
     return '', 204
 
 @app.route('/api/zoom_in', methods=['POST', 'GET'])
 def zoom_in_slow():
-    camera_mgr.camera.zoom_in_slow()
-    return '', 204
-    
+    # Manual zoom takes over from auto zoom
+    station.auto_zoom.set_enabled(False)
+    station.camera_commands.submit('zoom_in_slow')
+    return '', 202
+
 @app.route('/api/zoom_out', methods=['POST', 'GET'])
 def zoom_out():
-    camera_mgr.camera.zoom_out_slow()
-    return '', 204
+    station.auto_zoom.set_enabled(False)
+    station.camera_commands.submit('zoom_out_slow')
+    return '', 202
 
 @app.route('/api/zoom_stop', methods=['POST', 'GET'])
 def zoom_stop():
-    camera_mgr.camera.zoom_stop()
+    station.auto_zoom.set_enabled(False)
+    station.camera_commands.submit('zoom_stop')
+    return '', 202
+
+@app.route('/api/auto_zoom', methods=['POST', 'GET'])
+def set_auto_zoom():
+    auto_zoom = station.auto_zoom
+    enabled = parse_params(request.args, params.ENABLED)['enabled']
+    if enabled is None:
+        return jsonify({'enabled': auto_zoom.enabled,
+                        'zoom_ratio': auto_zoom.zoom_ratio,
+                        'distance': auto_zoom.distance}), 200
+    auto_zoom.set_enabled(enabled)
     return '', 204
 
 @app.route('/api/start_recording', methods=['POST', 'GET'])
 def video_recstart():
-    camera_mgr.camera.video_recstart()
-    return '', 204
+    # Manual recording takes over from auto recording
+    station.ride_detector.set_enabled(False)
+    return jsonify(station.camera_mgr.broadcast('video_recstart')), 200
 
 @app.route('/api/stop_recording', methods=['POST', 'GET'])
 def video_recstop():
-    camera_mgr.camera.video_recstop()
+    station.ride_detector.set_enabled(False)
+    return jsonify(station.camera_mgr.broadcast('video_recstop')), 200
+
+@app.route('/api/auto_record', methods=['POST', 'GET'])
+def set_auto_record():
+    enabled = parse_params(request.args, params.ENABLED)['enabled']
+    if enabled is None:
+        return jsonify(station.ride_detector.status()), 200
+    station.ride_detector.set_enabled(enabled)
     return '', 204
 
+@app.route('/api/rides', methods=['GET'])
+def rides():
+    since = parse_params(request.args, params.RIDES)['since']
+    return jsonify(station.ride_detector.index.read(since)), 200
+
+@app.route('/api/camera_connection', methods=['GET'])
+def camera_connection():
+    return jsonify(station.camera_mgr.states()), 200
+
+@app.route('/api/camera_stats', methods=['GET'])
+def camera_stats():
+    return jsonify(station.camera_mgr.stats.to_dict()), 200
+
+@app.route('/api/live_view_stats', methods=['GET'])
+def live_view_stats():
+    return jsonify(station.live_view_pipeline.stats()), 200
+
+@app.route('/api/clip', methods=['POST', 'GET'])
+def clip():
+    """
+    AVI of the buffered live view from start to end (wall clock times, as in
+    the ride index), or of the last seconds. Saved under CLIPS_PATH too.
+    """
+    args = parse_params(request.args, params.CLIP)
+    end = args['end'] if args['end'] is not None else time.time()
+    start = args['start'] if args['start'] is not None \
+        else end - args['seconds']
+    path = station.export_clip(start, end)
+    if path is None:
+        return 'No buffered frames in that window', 404
+    return send_file(path, mimetype='video/x-msvideo', as_attachment=True)
+
+@app.route('/api/clip_buffer', methods=['GET'])
+def clip_buffer():
+    return jsonify(station.frame_ring.stats()), 200
+
+@app.route('/api/live', methods=['GET'])
+def live():
+    """
+    MJPEG stream of the live view of camera (default the primary one),
+    passed through without re-encoding.
+    """
+    camera = parse_params(request.args, params.LIVE)['camera']
+    hub = station.frame_hub_for(camera)
+    if hub is None:
+        return f"Unknown camera {camera}", 404
+
+    def stream():
+        for frame in hub.frames():
+            if frame is None:
+                continue
+            yield (b'--frame\r\nContent-Type: image/jpeg\r\n'
+                   b'Content-Length: ' + str(len(frame.jpeg)).encode() +
+                   b'\r\n\r\n' + frame.jpeg + b'\r\n')
+
+    return Response(stream(),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+if sock is not None:
+    @sock.route('/api/live/ws')
+    def live_ws(ws):
+        """
+        Live view of camera (default the primary one) as one binary
+        WebSocket message per JPEG frame. Needs flask-sock.
+        """
+        camera = parse_params(request.args, params.LIVE)['camera']
+        hub = station.frame_hub_for(camera)
+        if hub is None:
+            ws.close(reason=1008, message=f"Unknown camera {camera}")
+            return
+        for frame in hub.frames():
+            if frame is not None:
+                ws.send(frame.jpeg)
+
+@app.route('/api/position_stats', methods=['GET'])
+def position_stats():
+    return jsonify(station.position_receiver.stats()), 200
+
+@app.route('/api/camera_state', methods=['GET'])
+def camera_state():
+    """
+    Camera state from the live view. With since=<version> the request waits
+    up to 'timeout' seconds (default 10) for a newer version.
+    """
+    args = parse_params(request.args, params.CAMERA_STATE)
+    if args['since'] is None:
+        return jsonify(station.camera_telemetry.state()), 200
+    return jsonify(station.camera_telemetry.wait_for_change(
+        args['since'], args['timeout'])), 200
+
 @app.route('/api/set_declination', methods=['POST', 'GET'])
 def set_declination():
     raise NotImplementedError
@@ -73,66 +214,60 @@ def relative_coordinates():
     """
     API route causing the gimbal to point at coordinates specified in meters.
     """
-    if 'n' not in request.args:
-        return "Missing query parameter 'n'", 400
-    if 'e' not in request.args:
-        return "Missing query parameter 'e'", 400
-    if 'el' not in request.args:
-        return "Missing query parameter 'el'", 400
-    try:
-        northing = float(request.args.get('n'))
-    except ValueError:
-        return "Query parameter 'n' should be a number", 400
-    try:
-        easting = float(request.args.get('e'))
-    except ValueError:
-        return "Query parameter 'e' should be a number", 400
-    try:
-        elevation = float(request.args.get('el'))
-    except ValueError:
-        return "Query parameter 'el' should be a number", 400
-    logging.debug(f'northing={northing} easting={easting} elevation={elevation}')
-    gimbal.point_at_rel_coords(
-        northing=northing, easting=easting, elevation=elevation
+    args = parse_params(request.args, params.RELCOORDS)
+    logging.debug(f'northing={args["n"]} easting={args["e"]} '
+                  f'elevation={args["el"]}')
+    yaw_angle, pitch_angle = gimbal.rel_coords_to_angles(
+        northing=args['n'], easting=args['e'], elevation=args['el']
     )
-    return '', 204
+    return jsonify(station.start_motion(yaw_angle=yaw_angle,
+                                        pitch_angle=pitch_angle)), 202
 
 @app.route('/api/set_origin', methods=['POST', 'GET'])
 def set_origin():
-    if 'lat' not in request.args:
-        return "Missing query parameter 'lat'", 400
-    if 'lon' not in request.args:
-        return "Missing query parameter 'lon'", 400
-
-    try:
-        lat = float(request.args.get('lat'))
-    except ValueError:
-        return "Query parameter 'lat' should be a number", 400
-    try:
-        lon = float(request.args.get('lon'))
-    except ValueError:
-        return "Query parameter 'lon' should be a number", 400
-    logging.debug(f'lat={lat} lon={lon}')
-    
-    gimbal.set_origin(lat=lat, lon=lon)
+    args = parse_params(request.args, params.ORIGIN)
+    logging.debug(f'lat={args["lat"]} lon={args["lon"]}')
+    gimbal.set_origin(lat=args['lat'], lon=args['lon'])
     return '', 204
 
 @app.route('/api/abscoords', methods=['POST', 'GET'])
 def absolute_coordinates():
-    if 'lat' not in request.args:
-        return "Missing query parameter 'lat'", 400
-    if 'lon' not in request.args:
-        return "Missing query parameter 'lon'", 400
+    args = parse_params(request.args, params.ABSCOORDS)
+    tag_id = args['tag']
+    logging.debug(f'tag={tag_id} lat={args["lat"]} lon={args["lon"]}')
 
+    now = gimbal.clock.monotonic()
+    station.ingest_fixes(tag_id, [Fix(time.time(), args['lat'], args['lon'])],
+                         now)
+    return jsonify(station.aim_at_target(now)), 202
+
+@app.route('/api/track', methods=['POST'])
+def track():
+    """
+    Batch of timestamped fixes from the tag app in the wire.py format. All
+    fixes update the tracker, the gimbal is pointed once for the batch.
+    """
     try:
-        lat = float(request.args.get('lat'))
-    except ValueError:
-        return "Query parameter 'lat' should be a number", 400
-    try:
-        lon = float(request.args.get('lon'))
-    except ValueError:
-        return "Query parameter 'lon' should be a number", 400
-    logging.debug(f'lat={lat} lon={lon}')
+        tag_id, fixes = decode_fixes(request.get_data())
+    except ValueError as e:
+        return f"Invalid fix batch: {e}", 400
+    if not fixes:
+        return jsonify({'accepted': 0}), 200
+    now = gimbal.clock.monotonic()
+    accepted = station.ingest_fixes(tag_id, fixes, now)
+    logging.debug(f'tag={tag_id} {accepted}/{len(fixes)} fixes')
+    return jsonify(station.aim_at_target(now, accepted=accepted)), 202
+
+@app.route('/api/tags', methods=['GET'])
+def tags():
+    return jsonify(station.tags()), 200
 
-    gimbal.point_at_abs_coords(lat=lat, lon=lon)
-    return '', 204
\ No newline at end of file
+@app.route('/api/follow', methods=['POST', 'GET'])
+def follow():
+    """
+    Always follow the tag given by the 'tag' query parameter, or go back to
+    automatic scheduling without it.
+    """
+    station.scheduler.pin(parse_params(request.args, params.FOLLOW)['tag']
+                          or None)
+    return '', 204
@@ -0,0 +1,360 @@
+"""
+Offline models of the Bescor head, for benchmarking control modes without
+the hardware.
+
+    python simulation.py --target 30 --deadband 0.5
+    python simulation.py --plant --speedup 50 --mode pulse
+"""
+import logging
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Tuple, Dict, Optional
+
+from clock import Clock, ScaledClock
+from imu import ImuIngest, FakeSerialSource
+from pwm import pulse_duration
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class SimulatedRelay:
+    """
+    Drop-in for gpiozero.LED as used by BescorGimbal.
+    """
+
+    def __init__(self) -> None:
+        self.is_lit = False
+
+    def on(self) -> None:
+        self.is_lit = True
+
+    def off(self) -> None:
+        self.is_lit = False
+
+    def close(self) -> None:
+        self.is_lit = False
+
+
+class SimulatedAxis:
+    """
+    One axis of the head, driven by a pair of relays. relays[0] moves towards
+    lower angles, relays[1] towards higher ones, as in BescorGimbal.control.
+    The motor keeps running for coast seconds after both relays drop, and
+    the sensor reports positions sensor_latency seconds old.
+    """
+
+    def __init__(self,
+                 slew_rate: float,
+                 position: float = 0.,
+                 coast: float = 0.05,
+                 sensor_latency: float = 0.05,
+                 lower_limit: float = -math.inf,
+                 upper_limit: float = math.inf) -> None:
+        self.slew_rate = slew_rate
+        self.position = position
+        self.coast = coast
+        self.sensor_latency = sensor_latency
+        self.lower_limit = lower_limit
+        self.upper_limit = upper_limit
+        self.relays = [SimulatedRelay(), SimulatedRelay()]
+        self.t = 0.
+        self._direction = 0
+        self._coast_left = 0.
+        self._history: Deque[Tuple[float, float]] = deque([(0., position)])
+
+    def _drive(self) -> int:
+        down, up = (r.is_lit for r in self.relays)
+        return int(up) - int(down)
+
+    def advance(self, dt: float) -> None:
+        drive = self._drive()
+        if drive:
+            self._direction = drive
+            self._coast_left = self.coast
+        elif self._coast_left > 0:
+            self._coast_left -= dt
+        else:
+            self._direction = 0
+        self.position += self._direction * self.slew_rate * dt
+        self.position = min(max(self.position, self.lower_limit),
+                            self.upper_limit)
+        self.t += dt
+        self._history.append((self.t, self.position))
+        # Only keep enough history to serve delayed readings
+        while (len(self._history) > 1
+               and self._history[1][0] <= self.t - self.sensor_latency):
+            self._history.popleft()
+
+    def reading(self) -> float:
+        return self._history[0][1]
+
+
+@dataclass
+class SettleResult:
+    settle_time: float
+    overshoot: float
+    cycles: int
+    settled: bool
+
+
+def simulate_move(mode: str,
+                  target: float,
+                  slew_rate: float = 360 / 46,
+                  deadband: float = 0.5,
+                  update_interval: float = 0.5,
+                  pwm_rate: float = 50.,
+                  coast_time: float = 0.1,
+                  timeout: float = 60.,
+                  dt: float = 0.001,
+                  **axis_kwargs) -> SettleResult:
+    """
+    Move a SimulatedAxis from 0 to target using the same control law as
+    BescorGimbal in 'bangbang' or 'pulse' mode, and measure how it settles.
+    """
+    axis = SimulatedAxis(slew_rate=slew_rate, **axis_kwargs)
+    tick = 1. / pwm_rate
+    next_update = 0.
+    pulse_end = None
+    cycles = 0
+    overshoot = 0.
+    start_sign = math.copysign(1, target - axis.position)
+    while axis.t < timeout:
+        if pulse_end is not None and axis.t >= pulse_end:
+            for relay in axis.relays:
+                relay.off()
+            pulse_end = None
+        if axis.t >= next_update:
+            next_update += update_interval
+            err = axis.reading() - target
+            if abs(err) <= deadband:
+                for relay in axis.relays:
+                    relay.off()
+                pulse_end = None
+                if abs(axis.position - target) <= deadband:
+                    return SettleResult(settle_time=axis.t,
+                                        overshoot=overshoot,
+                                        cycles=cycles,
+                                        settled=True)
+            else:
+                cycles += 1
+                index = 0 if err > 0 else 1
+                axis.relays[1 - index].off()
+                axis.relays[index].on()
+                if mode == 'pulse':
+                    duration = pulse_duration(
+                        err, slew_rate, coast=coast_time,
+                        min_duration=tick,
+                        max_duration=update_interval + tick)
+                    # The pulser only switches relays off on its ticks
+                    pulse_end = axis.t + math.ceil(duration / tick) * tick
+        axis.advance(dt)
+        overshoot = max(overshoot, start_sign * (axis.position - target))
+    return SettleResult(settle_time=timeout, overshoot=overshoot,
+                        cycles=cycles, settled=False)
+
+
+def benchmark(targets=(1., 5., 30., 120.), **kwargs) -> Dict[str, list]:
+    return {
+        mode: [simulate_move(mode, target, **kwargs) for target in targets]
+        for mode in ('bangbang', 'pulse')
+    }
+
+
+class SimulatedGimbalPlant:
+    """
+    Bescor head plus Witmotion IMU. Yaw travels between hard stops at
+    yaw_cw_stop and yaw_ccw_stop (the deadzone is the short arc between
+    them), pitch between pitch_min and pitch_max. The IMU reports noisy,
+    delayed angles every imu_interval seconds, in the witmotion -180 to 180
+    yaw range. Time comes from clock, so a ScaledClock runs everything
+    faster than real time.
+    """
+
+    def __init__(self,
+                 clock: Optional[Clock] = None,
+                 yaw_cw_stop: float = 345.,
+                 yaw_ccw_stop: float = 355.,
+                 pitch_min: float = -12.5,
+                 pitch_max: float = 13.3,
+                 yaw_slew_rate: float = 360 / 46,
+                 pitch_slew_rate: float = 25.8 / 14,
+                 coast: float = 0.05,
+                 sensor_latency: float = 0.05,
+                 noise_std: float = 0.05,
+                 imu_interval: float = 0.1) -> None:
+        self.clock = clock or Clock()
+        self.yaw_ccw_stop = yaw_ccw_stop
+        self.noise_std = noise_std
+        self.imu_interval = imu_interval
+        travel = (yaw_cw_stop - yaw_ccw_stop) % 360
+        # Yaw position is the distance travelled clockwise from the CCW stop
+        self.yaw = SimulatedAxis(slew_rate=yaw_slew_rate,
+                                 position=travel / 2,
+                                 coast=coast,
+                                 sensor_latency=sensor_latency,
+                                 lower_limit=0.,
+                                 upper_limit=travel)
+        self.pitch = SimulatedAxis(slew_rate=pitch_slew_rate,
+                                   position=0.,
+                                   coast=coast,
+                                   sensor_latency=sensor_latency,
+                                   lower_limit=pitch_min,
+                                   upper_limit=pitch_max)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.imu_source: Optional[FakeSerialSource] = None
+
+    def start(self) -> None:
+        def run():
+            last = self.clock.monotonic()
+            while not self._stop_event.is_set():
+                time.sleep(0.001)
+                now = self.clock.monotonic()
+                with self._lock:
+                    self.yaw.advance(now - last)
+                    self.pitch.advance(now - last)
+                last = now
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def angles(self) -> Tuple[float, float, float]:
+        with self._lock:
+            yaw = (self.yaw_ccw_stop + self.yaw.reading()) % 360
+            pitch = self.pitch.reading()
+        if yaw > 180:
+            yaw -= 360
+        return (random.gauss(0., self.noise_std),
+                pitch + random.gauss(0., self.noise_std),
+                yaw + random.gauss(0., self.noise_std))
+
+    def make_gimbal(self, **kwargs):
+        """
+        Start the plant and return a BescorGimbal wired to it.
+        """
+        from gimbal import BescorGimbal
+        self.imu_source = FakeSerialSource(self.angles,
+                                           interval=self.imu_interval,
+                                           clock=self.clock)
+        self.start()
+        return BescorGimbal(
+            imu=ImuIngest(self.imu_source),
+            yaw_relays=self.yaw.relays,
+            pitch_relays=self.pitch.relays,
+            clock=self.clock,
+            **kwargs)
+
+    def close(self) -> None:
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+
+def _goto(gimbal, yaw: float, pitch: float, timeout: float) -> bool:
+    """
+    BescorGimbal.goto that gives up after timeout simulated seconds.
+    """
+    deadline = gimbal.clock.monotonic() + timeout
+    while not gimbal.step(yaw_angle=yaw, pitch_angle=pitch):
+        if gimbal.clock.monotonic() > deadline:
+            gimbal.stop()
+            return False
+        gimbal.clock.sleep(gimbal.update_interval)
+    return True
+
+
+def benchmark_plant(targets=((90., 5.), (270., -5.), (100., 0.)),
+                    speedup: float = 20.,
+                    mode: str = 'bangbang',
+                    initialize: bool = True,
+                    timeout: float = 120.) -> None:
+    """
+    Drive a BescorGimbal on a SimulatedGimbalPlant through initialize and a
+    series of moves, and report simulated settle time against wall clock and
+    CPU time spent.
+    """
+    clock = ScaledClock(speedup)
+    plant = SimulatedGimbalPlant(clock=clock)
+    gimbal = plant.make_gimbal()
+    gimbal.control_mode = mode
+    # Give the IMU a moment to report
+    clock.sleep(0.5)
+    steps = []
+    if initialize:
+        calibration_path = os.path.join(tempfile.mkdtemp(),
+                                        'calibration.json')
+        steps.append(('initialize',
+                      lambda: bool(gimbal.initialize(calibration_path))))
+    else:
+        gimbal._imu_yaw_at_max_cw = 345.
+        gimbal._imu_yaw_at_max_ccw = 355.
+    for yaw, pitch in targets:
+        steps.append((f'goto {yaw:.0f},{pitch:.0f}',
+                      lambda yaw=yaw, pitch=pitch:
+                      _goto(gimbal, yaw, pitch, timeout)))
+    for name, action in steps:
+        sim_start = clock.monotonic()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        settled = action()
+        print(f'{name:16s} {"done" if settled else "TIMEOUT":7s} '
+              f'{clock.monotonic() - sim_start:7.2f}s simulated, '
+              f'{time.perf_counter() - wall_start:6.2f}s wall, '
+              f'{time.process_time() - cpu_start:6.2f}s cpu')
+    gimbal.stop()
+    plant.close()
+
+
+def _main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Compare settle time and overshoot of the gimbal control "
+                    "modes on a simulated axis.")
+    parser.add_argument('--target', type=float, nargs='+',
+                        default=[1., 5., 30., 120.],
+                        help="Move sizes in degrees.")
+    parser.add_argument('--deadband', type=float, default=0.5)
+    parser.add_argument('--slew-rate', type=float, default=360 / 46,
+                        help="Degrees per second.")
+    parser.add_argument('--sensor-latency', type=float, default=0.05)
+    parser.add_argument('--coast', type=float, default=0.05)
+    parser.add_argument('--plant', action='store_true',
+                        help="Run a full BescorGimbal on the simulated "
+                             "plant instead.")
+    parser.add_argument('--speedup', type=float, default=20.,
+                        help="With --plant, how much faster than real time "
+                             "to run.")
+    parser.add_argument('--mode', choices=('bangbang', 'pulse'),
+                        default='bangbang',
+                        help="With --plant, the gimbal control mode.")
+    parser.add_argument('--skip-initialize', action='store_true',
+                        help="With --plant, assume the default yaw stops "
+                             "instead of running initialize.")
+    args = parser.parse_args()
+    if args.plant:
+        benchmark_plant(speedup=args.speedup, mode=args.mode,
+                        initialize=not args.skip_initialize)
+        return
+    results = benchmark(targets=args.target,
+                        deadband=args.deadband,
+                        slew_rate=args.slew_rate,
+                        sensor_latency=args.sensor_latency,
+                        coast=args.coast)
+    for mode, mode_results in results.items():
+        for target, result in zip(args.target, mode_results):
+            print(f'{mode:8s} target {target:6.1f}: '
+                  f'{"settled" if result.settled else "TIMEOUT"} '
+                  f'in {result.settle_time:5.2f}s, '
+                  f'{result.cycles:3d} cycles, '
+                  f'overshoot {result.overshoot:.2f} deg')
+
+
+if __name__ == '__main__':
+    _main()
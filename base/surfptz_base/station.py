@@ -0,0 +1,250 @@
+"""
+The base station: gimbal, cameras, live view and tag tracking wired
+together. Both the Flask and the ASGI server drive one BaseStation, the
+servers only translate requests.
+"""
+import logging
+import math
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from gimbal import CONTROL_MODES, BescorGimbal
+from motion import MotionController
+from tracking import TargetTracker
+from tags import TagRegistry, TargetScheduler
+from panasonic_camera.command_queue import CameraCommandQueue
+from panasonic_camera.frame_hub import FrameHub
+from panasonic_camera.frame_ring import FrameRing, write_clip
+from panasonic_camera.telemetry import CameraTelemetry
+from panasonic_camera.live_view import LiveView
+from panasonic_camera.live_view_pipeline import DROP_OLDEST, LiveViewPipeline
+from panasonic_camera.multi_camera import CameraSlot, MultiCameraManager
+from vision import VisionAimer
+from rides import RideDetector
+from position_channel import PositionReceiver, DEFAULT_PORT
+from zoom import AutoZoom, zoom_ratio_from_ex_header
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+CLIPS_PATH = os.path.expanduser('~/.surfptz/clips')
+
+
+class BaseStation:
+    """
+    Creating a BaseStation opens the hardware, start() starts the background
+    threads and stop() shuts them down again. Configured through the
+    SURFPTZ_* environment variables.
+    """
+
+    def __init__(self) -> None:
+        self.camera_mgr = MultiCameraManager(identify_as='surfptz')
+        self.camera_commands = CameraCommandQueue(
+            lambda: self.camera_mgr.camera, min_interval=0.2)
+        self.auto_zoom = AutoZoom(self.camera_commands.submit)
+        if os.environ.get('SURFPTZ_SIMULATE'):
+            # Run against a simulated head and IMU, optionally faster than
+            # real time
+            from clock import ScaledClock
+            from simulation import SimulatedGimbalPlant
+            plant = SimulatedGimbalPlant(clock=ScaledClock(
+                float(os.environ.get('SURFPTZ_SIM_SPEEDUP', 1))))
+            self.gimbal = plant.make_gimbal()
+        else:
+            self.gimbal = BescorGimbal()
+        # 'bangbang' or 'pulse', see BescorGimbal.control_mode
+        control_mode = os.environ.get('SURFPTZ_CONTROL_MODE', 'bangbang')
+        if control_mode not in CONTROL_MODES:
+            raise ValueError(f'SURFPTZ_CONTROL_MODE must be one of '
+                             f'{CONTROL_MODES}, not {control_mode!r}')
+        self.gimbal.control_mode = control_mode
+        if not self.gimbal.load_calibration():
+            logger.warning('Gimbal is not calibrated, call /api/initialize')
+        self.motion = MotionController(self.gimbal)
+        self.tracker = TargetTracker()
+        self.tag_registry = TagRegistry(self.tracker)
+        self.scheduler = TargetScheduler(self.tag_registry)
+        self.motion.add_settle_listener(self.tracker.record_slew_latency)
+
+        self.live_view = LiveView('0.0.0.0', self.camera_mgr.base_port)
+        self.live_view_pipeline = LiveViewPipeline(self.live_view,
+                                                   decode_scale=4)
+        # All preview clients share one raw JPEG consumer
+        self.frame_hub = FrameHub()
+        self.live_view_pipeline.add_consumer(
+            'preview', self.frame_hub.publish, decoded=False)
+        # The last minute or so of live view, for clips that start before
+        # anyone asked for them
+        self.frame_ring = FrameRing(
+            capacity=int(os.environ.get('SURFPTZ_RING_MB', 64)) * 1024 * 1024)
+        self.live_view_pipeline.add_consumer(
+            'ring', self.frame_ring.push, decoded=False,
+            maxsize=8, policy=DROP_OLDEST)
+        # Preview of every camera, by camera id
+        self.frame_hubs: Dict[str, FrameHub] = {}
+        self.other_pipelines: List[LiveViewPipeline] = []
+        self.camera_mgr.add_camera_listener(self.on_camera)
+
+        self.vision: Optional[VisionAimer] = None
+        if os.environ.get('SURFPTZ_VISION'):
+            # Fine aiming from the live view, GPS only for coarse pointing
+            self.vision = VisionAimer(self.motion, self.gimbal)
+            self.live_view_pipeline.add_consumer('vision',
+                                                 self.vision.on_frame)
+        ride_energy = os.environ.get('SURFPTZ_RIDE_MOTION')
+        self.ride_detector = RideDetector(
+            lambda: self.camera_mgr.broadcast('video_recstart'),
+            lambda: self.camera_mgr.broadcast('video_recstop'),
+            energy_threshold=float(ride_energy) if ride_energy else None)
+        if self.ride_detector.energy_threshold is not None:
+            self.live_view_pipeline.add_consumer('rides',
+                                                 self.ride_detector.on_frame)
+
+        self.camera_telemetry = CameraTelemetry()
+        self.live_view.add_ex_header_listener(self.on_ex_header)
+        self.position_receiver = PositionReceiver(
+            self.on_position,
+            port=int(os.environ.get('SURFPTZ_POSITION_PORT', DEFAULT_PORT)))
+
+    def start(self) -> None:
+        self.camera_commands.start()
+        self.auto_zoom.start()
+        self.motion.start()
+        self.camera_mgr.start()
+        self.ride_detector.start()
+        self.live_view_pipeline.start()
+        self.position_receiver.start()
+
+    def stop(self) -> None:
+        self.position_receiver.cancel()
+        self.ride_detector.cancel()
+        self.camera_mgr.cancel()
+        self.auto_zoom.cancel()
+        self.camera_commands.cancel()
+        self.motion.halt()
+        self.motion.cancel()
+        for pipeline in [self.live_view_pipeline] + self.other_pipelines:
+            pipeline.stop()
+
+    def on_camera(self, slot: CameraSlot) -> None:
+        if slot.port == self.camera_mgr.base_port:
+            pipeline = self.live_view_pipeline
+            hub = self.frame_hub
+        else:
+            # Only the primary camera feeds vision, zoom and telemetry
+            pipeline = LiveViewPipeline(LiveView('0.0.0.0', slot.port))
+            hub = FrameHub()
+            pipeline.add_consumer('preview', hub.publish, decoded=False)
+            self.other_pipelines.append(pipeline)
+        # Received packets tell the camera's manager its stream is alive
+        pipeline.packet_listeners.append(slot.manager.heartbeat)
+        self.frame_hubs[slot.camera_id] = hub
+        if pipeline is not self.live_view_pipeline:
+            pipeline.start()
+
+    def frame_hub_for(self, camera: Optional[str]) -> Optional[FrameHub]:
+        """
+        Frame hub of camera id camera, the primary camera's without one.
+        None for an unknown camera id.
+        """
+        if camera is None:
+            return self.frame_hub
+        return self.frame_hubs.get(camera)
+
+    def on_ex_header(self, ex_header) -> None:
+        self.camera_telemetry.on_ex_header(ex_header)
+        self.auto_zoom.on_ex_header(ex_header)
+        zoom_ratio = zoom_ratio_from_ex_header(ex_header)
+        if self.vision is not None and zoom_ratio is not None:
+            self.vision.zoom_ratio = zoom_ratio
+
+    def start_motion(self, yaw_angle: float, pitch_angle: float,
+                     **extra) -> dict:
+        """
+        Hand a target to the motion controller, returns the body of the 202
+        response. eta_s is None while the gimbal position is unknown.
+        """
+        eta = self.gimbal.time_to_target(yaw_angle=yaw_angle,
+                                         pitch_angle=pitch_angle)
+        motion_id = self.motion.set_target(yaw_angle=yaw_angle,
+                                           pitch_angle=pitch_angle)
+        return {'motion_id': motion_id, 'eta_s': eta, **extra}
+
+    def target_angles(self, now: float) -> Optional[Tuple[float, float]]:
+        """
+        Yaw and pitch of the scheduled tag's aim point, or None if there is
+        no tag to follow or vision has a lock close to it.
+        """
+        tag_id = self.scheduler.select(now)
+        if tag_id is None:
+            return None
+        northing, easting = self.tracker.aim_point(tag_id, now=now)
+        self.auto_zoom.set_distance(math.hypot(northing, easting))
+        yaw_angle, pitch_angle = self.gimbal.rel_coords_to_angles(
+            northing=northing, easting=easting, elevation=0
+        )
+        if self.vision is not None and \
+                not self.vision.allows_coarse_target(yaw_angle):
+            return None
+        return yaw_angle, pitch_angle
+
+    def aim_at_target(self, now: float, **extra) -> dict:
+        angles = self.target_angles(now)
+        extra['target'] = self.scheduler.target
+        if angles is None:
+            return {'motion_id': None, 'eta_s': 0., **extra}
+        yaw_angle, pitch_angle = angles
+        return self.start_motion(yaw_angle=yaw_angle,
+                                 pitch_angle=pitch_angle, **extra)
+
+    def ingest_fixes(self, tag_id: str, fixes, now: float) -> int:
+        """
+        Feed fixes to the tracker and tag registry and return how many were
+        accepted.
+        """
+        wall_now = time.time()
+        fixes = sorted(fixes, key=lambda fix: fix.t)
+        northings, eastings = self.gimbal.calculate_relcoords_batch(
+            lats=[fix.lat for fix in fixes], lons=[fix.lon for fix in fixes])
+        accepted = 0
+        for fix, northing, easting in zip(fixes, northings, eastings):
+            # Fix times are the phone's wall clock, map them by their age
+            t = now - max(wall_now - fix.t, 0.)
+            if self.tracker.update(tag_id, t, float(northing), float(easting)):
+                self.ride_detector.on_tag(self.tag_registry.update(tag_id, t))
+                accepted += 1
+        return accepted
+
+    def on_position(self, tag_id: str, fix) -> None:
+        """
+        Fix streamed over the UDP position channel.
+        """
+        now = self.gimbal.clock.monotonic()
+        if not self.ingest_fixes(tag_id, [fix], now):
+            return
+        angles = self.target_angles(now)
+        if angles is not None:
+            yaw_angle, pitch_angle = angles
+            self.motion.set_target(yaw_angle=yaw_angle,
+                                   pitch_angle=pitch_angle)
+
+    def export_clip(self, start: float, end: float) -> Optional[str]:
+        """
+        Save the buffered live view from start to end as an AVI under
+        CLIPS_PATH and return its path, None without frames in the window.
+        """
+        frames = self.frame_ring.window(start, end)
+        if not frames:
+            return None
+        os.makedirs(CLIPS_PATH, exist_ok=True)
+        path = os.path.join(CLIPS_PATH, f'clip-{frames[0].t:.3f}.avi')
+        with open(path, 'wb') as f:
+            write_clip(f, frames)
+        return path
+
+    def tags(self) -> dict:
+        return {
+            'target': self.scheduler.target,
+            'pinned': self.scheduler.pinned,
+            'tags': [state.to_dict() for state in self.tag_registry.states()],
+        }
@@ -0,0 +1,170 @@
+"""
+Several tags in the water at once: per-tag state with on-wave detection,
+and a scheduler deciding which tag the camera follows.
+"""
+import logging
+import math
+import threading
+from dataclasses import dataclass, asdict
+from typing import Dict, Optional
+
+from tracking import TargetTracker
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TagState:
+    tag_id: str
+    last_seen: float
+    northing: float
+    easting: float
+    # Filtered speed over ground in m/s
+    speed: float = 0.
+    riding: bool = False
+    # When riding last changed
+    riding_since: float = 0.
+    # When the speed first crossed the threshold for the next riding change
+    _crossed_at: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        state = asdict(self)
+        del state['_crossed_at']
+        return state
+
+
+class TagRegistry:
+    """
+    Latest state of every tag. A tag is riding once its speed has stayed
+    above ride_speed for confirm_s, and stops riding once it has stayed
+    below the lower paddle_speed for confirm_s, so speed noise around one
+    threshold doesn't flip it back and forth. Updates are O(1).
+    """
+
+    def __init__(self,
+                 tracker: TargetTracker,
+                 ride_speed: float = 3.5,
+                 paddle_speed: float = 2.0,
+                 confirm_s: float = 1.5,
+                 stale_after_s: float = 30.) -> None:
+        self.tracker = tracker
+        self.ride_speed = ride_speed
+        self.paddle_speed = paddle_speed
+        self.confirm_s = confirm_s
+        self.stale_after_s = stale_after_s
+        self._tags: Dict[str, TagState] = {}
+        self._lock = threading.Lock()
+        self._riding_listeners = []
+
+    def add_riding_listener(self, callback) -> None:
+        """
+        callback(tag_state) is called when a tag starts or stops riding.
+        """
+        self._riding_listeners.append(callback)
+
+    def update(self, tag_id: str, t: float) -> TagState:
+        """
+        Refresh tag_id from the tracker after it was fed a fix at time t.
+        """
+        northing, easting = self.tracker.position(tag_id, t)
+        v_north, v_east = self.tracker.velocity(tag_id)
+        speed = math.hypot(v_north, v_east)
+        with self._lock:
+            state = self._tags.get(tag_id)
+            if state is None:
+                state = TagState(tag_id=tag_id, last_seen=t,
+                                 northing=northing, easting=easting,
+                                 riding_since=t)
+                self._tags[tag_id] = state
+            state.last_seen = t
+            state.northing = northing
+            state.easting = easting
+            state.speed = speed
+            changed = self._update_riding(state, t)
+        if changed:
+            logger.info(f'tag {tag_id} '
+                        f'{"riding" if state.riding else "stopped riding"} '
+                        f'at {speed:.1f} m/s')
+            for listener in self._riding_listeners:
+                listener(state)
+        return state
+
+    def _update_riding(self, state: TagState, t: float) -> bool:
+        if state.riding:
+            crossing = state.speed < self.paddle_speed
+        else:
+            crossing = state.speed > self.ride_speed
+        if not crossing:
+            state._crossed_at = None
+            return False
+        if state._crossed_at is None:
+            state._crossed_at = t
+        if t - state._crossed_at < self.confirm_s:
+            return False
+        state.riding = not state.riding
+        state.riding_since = t
+        state._crossed_at = None
+        return True
+
+    def get(self, tag_id: str) -> Optional[TagState]:
+        return self._tags.get(tag_id)
+
+    def is_fresh(self, state: TagState, now: float) -> bool:
+        return now - state.last_seen < self.stale_after_s
+
+    def states(self):
+        with self._lock:
+            return list(self._tags.values())
+
+
+class TargetScheduler:
+    """
+    Picks the tag the camera follows. A riding tag beats one that isn't,
+    and among riders the one that has been riding longest wins. Without
+    riders the camera stays on its current tag, or takes the most recently
+    seen one. The current target is held for at least min_hold_s unless it
+    goes stale, so the camera doesn't thrash between surfers. A pinned tag
+    is always followed while it's fresh.
+    """
+
+    def __init__(self, registry: TagRegistry, min_hold_s: float = 5.) -> None:
+        self.registry = registry
+        self.min_hold_s = min_hold_s
+        self.target: Optional[str] = None
+        self.pinned: Optional[str] = None
+        self._target_since = 0.
+
+    def pin(self, tag_id: Optional[str]) -> None:
+        self.pinned = tag_id
+
+    def select(self, now: float) -> Optional[str]:
+        registry = self.registry
+        if self.pinned is not None:
+            pinned = registry.get(self.pinned)
+            if pinned is not None and registry.is_fresh(pinned, now):
+                return self._switch(self.pinned, now)
+        current = registry.get(self.target) if self.target else None
+        if current is not None and not registry.is_fresh(current, now):
+            current = None
+        if current is not None and (current.riding or
+                                    now - self._target_since < self.min_hold_s):
+            return self.target
+        rider: Optional[TagState] = None
+        latest: Optional[TagState] = None
+        for state in registry.states():
+            if not registry.is_fresh(state, now):
+                continue
+            if state.riding and (rider is None or
+                                 state.riding_since < rider.riding_since):
+                rider = state
+            if latest is None or state.last_seen > latest.last_seen:
+                latest = state
+        best = rider or current or latest
+        return self._switch(best.tag_id if best else None, now)
+
+    def _switch(self, tag_id: Optional[str], now: float) -> Optional[str]:
+        if tag_id != self.target:
+            logger.info(f'following tag {tag_id} instead of {self.target}')
+            self.target = tag_id
+            self._target_since = now
+        return tag_id
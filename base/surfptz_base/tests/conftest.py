@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+# The modules import each other as top level modules, as when run from
+# surfptz_base with PYTHONPATH set (see start_surfptz.sh)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clock import Clock
+from gimbal import BescorGimbal
+from imu import FakeSerialSource, ImuIngest
+from simulation import SimulatedRelay
+
+
+def _gimbal(source: FakeSerialSource):
+    gimbal = BescorGimbal(imu=ImuIngest(source),
+                          yaw_relays=[SimulatedRelay(), SimulatedRelay()],
+                          pitch_relays=[SimulatedRelay(), SimulatedRelay()],
+                          clock=Clock())
+    yield gimbal
+    gimbal.pulser.close()
+    gimbal.imu.close()
+
+
+@pytest.fixture
+def cold_gimbal():
+    """
+    Gimbal whose IMU has not reported a single sample yet.
+    """
+    source = FakeSerialSource(lambda: (0., 0., 0.))
+    source.connected.clear()
+    yield from _gimbal(source)
+
+
+@pytest.fixture
+def still_gimbal():
+    """
+    Gimbal whose IMU reports, but whose head doesn't move.
+    """
+    yield from _gimbal(FakeSerialSource(lambda: (0., 0., 0.), interval=0.01))
@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+from panasonic_camera.camera import BusyError
+from panasonic_camera.command_queue import CameraCommandQueue
+
+
+class FakeCamera:
+    def __init__(self):
+        self.sent = []
+        self.fail = set()
+
+    def __getattr__(self, command):
+        def send():
+            if command in self.fail:
+                raise BusyError(command)
+            self.sent.append(command)
+        return send
+
+
+@pytest.fixture
+def camera():
+    return FakeCamera()
+
+
+@pytest.fixture
+def queue(camera):
+    queue = CameraCommandQueue(lambda: camera, coalesce_window=0.01)
+    queue.start()
+    yield queue
+    queue.cancel()
+
+
+def settle(queue):
+    deadline = time.monotonic() + 1.
+    while queue._pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+
+
+def test_stop_is_sent_without_a_known_zoom(queue, camera):
+    queue.submit('zoom_stop')
+    settle(queue)
+    assert camera.sent == ['zoom_stop']
+
+
+def test_duplicate_starts_are_coalesced(queue, camera):
+    queue.submit('zoom_in_slow')
+    queue.submit('zoom_in_slow')
+    settle(queue)
+    queue.submit('zoom_in_slow')
+    settle(queue)
+    queue.submit('zoom_stop')
+    settle(queue)
+    assert camera.sent == ['zoom_in_slow', 'zoom_stop']
+
+
+def test_failed_start_is_sent_again(queue, camera):
+    camera.fail.add('zoom_in_slow')
+    queue.submit('zoom_in_slow')
+    settle(queue)
+    camera.fail.clear()
+    queue.submit('zoom_in_slow')
+    settle(queue)
+    assert camera.sent == ['zoom_in_slow']
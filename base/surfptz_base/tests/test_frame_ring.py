@@ -0,0 +1,34 @@
+import io
+import struct
+
+from panasonic_camera.frame_ring import (BufferedFrame, MAX_CLIP_FPS,
+                                         MIN_CLIP_FPS, NOMINAL_FPS,
+                                         write_clip)
+
+# Start of image and a baseline start of frame segment for 64x48, enough
+# for the AVI header
+JPEG = (b'\xff\xd8' + b'\xff\xc0' + struct.pack('>HBHHB', 8, 8, 48, 64, 0) +
+        b'\xff\xd9')
+
+
+def frames_at(*times):
+    return [BufferedFrame(t=t, pts=None, jpeg=JPEG) for t in times]
+
+
+def test_average_frame_rate():
+    assert write_clip(io.BytesIO(), frames_at(0., 0.1, 0.2)) == 10.
+
+
+def test_burst_is_clamped():
+    # Frames that arrived all at once after a receive stall
+    assert write_clip(io.BytesIO(),
+                      frames_at(0., 0.0001, 0.0002)) == MAX_CLIP_FPS
+    assert write_clip(io.BytesIO(), frames_at(5., 5., 5.)) == NOMINAL_FPS
+
+
+def test_sparse_frames_are_clamped():
+    assert write_clip(io.BytesIO(), frames_at(0., 30.)) == MIN_CLIP_FPS
+
+
+def test_single_frame_uses_nominal_rate():
+    assert write_clip(io.BytesIO(), frames_at(0.)) == NOMINAL_FPS
@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+from gimbal import OriginNotSet
+from imu import ImuRingBuffer
+from simulation import SimulatedRelay
+
+
+def test_no_imu_sample_has_no_eta(cold_gimbal):
+    assert cold_gimbal.imu.last_yaw is None
+    assert cold_gimbal.time_to_target(yaw_angle=90, pitch_angle=5) is None
+    assert cold_gimbal.plan_yaw(90) is None
+
+
+def test_no_imu_sample_does_not_move(cold_gimbal):
+    assert not cold_gimbal.step(yaw_angle=90, pitch_angle=5)
+    relays = cold_gimbal.yaw_relays + cold_gimbal.pitch_relays
+    assert not any(relay.is_lit for relay in relays)
+
+
+def test_eta_once_imu_reports(cold_gimbal):
+    cold_gimbal.imu._on_sample(0., 0., 100.)
+    eta = cold_gimbal.time_to_target(yaw_angle=120, pitch_angle=0)
+    assert eta is not None and eta > 0
+
+
+def test_sweep_without_imu_data_fails(cold_gimbal):
+    with pytest.raises(RuntimeError):
+        cold_gimbal._sweep(cold_gimbal.pitch_relays[0], ImuRingBuffer.PITCH,
+                           max_time=0.2)
+    assert not cold_gimbal.pitch_relays[0].is_lit
+
+
+def test_sweep_imu_dropping_out_fails(cold_gimbal):
+    cold_gimbal.imu._on_sample(0., 0., 0.)
+    with pytest.raises(RuntimeError):
+        cold_gimbal._sweep(cold_gimbal.pitch_relays[0], ImuRingBuffer.PITCH,
+                           max_time=0.2)
+
+
+class BurstRelay(SimulatedRelay):
+    """
+    Relay whose whole move shows up in samples with one timestamp.
+    """
+
+    def __init__(self, imu):
+        super().__init__()
+        self.imu = imu
+
+    def on(self):
+        super().on()
+        t = time.monotonic()
+        self.imu.buffer.append(t, 0., 0., 0.)
+        self.imu.buffer.append(t, 0., 5., 0.)
+
+
+def test_sweep_without_travel_time_has_no_slew_rate(cold_gimbal):
+    cold_gimbal.imu._on_sample(0., 0., 0.)
+    final, slew_rate = cold_gimbal._sweep(
+        BurstRelay(cold_gimbal.imu), ImuRingBuffer.PITCH, max_time=0.2)
+    assert final == 5.
+    assert slew_rate is None
+
+
+def test_positions_before_origin_fail_clearly(cold_gimbal):
+    with pytest.raises(OriginNotSet):
+        cold_gimbal.calculate_relcoords_batch(lats=[33.4], lons=[-117.6])
+    cold_gimbal.set_origin(lat=33.4, lon=-117.6)
+    northings, eastings = cold_gimbal.calculate_relcoords_batch(
+        lats=[33.4], lons=[-117.6])
+    assert abs(northings[0]) < 1e-6 and abs(eastings[0]) < 1e-6
@@ -0,0 +1,19 @@
+import time
+
+from clock import ScaledClock
+from imu import FakeSerialSource, ImuIngest
+
+
+def test_replay_is_timestamped_with_the_source_clock():
+    clock = ScaledClock(speedup=50.)
+    imu = ImuIngest(FakeSerialSource.from_samples([(0., 1., 2.)],
+                                                  interval=0.1, clock=clock))
+    deadline = time.monotonic() + 1.
+    while imu.last_yaw is None:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    imu.close()
+    assert abs(imu.age()) < 0.5
+    # 0.05 s of wall time is 2.5 s on the replay clock
+    time.sleep(0.05)
+    assert imu.is_stale(1.)
@@ -0,0 +1,43 @@
+import struct
+import time
+
+from panasonic_camera.live_view_pipeline import LiveViewPipeline
+
+
+class FakeLiveView:
+    """
+    Yields a malformed packet, then good frames.
+    """
+
+    def __init__(self):
+        self.last_pts = 0
+        self.packets = 0
+
+    def image_view(self):
+        self.packets += 1
+        if self.packets == 1:
+            raise struct.error('unpack requires a buffer of 32 bytes')
+        time.sleep(0.01)
+        return memoryview(b'\xff\xd8jpeg')
+
+
+def test_receiver_survives_bad_packets_and_listeners():
+    frames = []
+    pipeline = LiveViewPipeline(FakeLiveView())
+    pipeline.add_consumer('frames', frames.append, decoded=False)
+
+    def failing_listener():
+        raise RuntimeError('listener bug')
+
+    pipeline.packet_listeners.append(failing_listener)
+    pipeline.start()
+    try:
+        deadline = time.monotonic() + 2
+        while len(frames) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        pipeline.stop()
+    assert len(frames) >= 3
+    stats = pipeline.stats()['receiver']
+    assert stats['errors'] == 1
+    assert stats['listener_errors'] >= 3
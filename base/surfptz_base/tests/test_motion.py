@@ -0,0 +1,61 @@
+import threading
+import time
+
+from gimbal import MotionAborted
+from motion import MotionController
+from vision import VisionAimer
+
+
+def test_halt_does_not_wait_for_initialize(still_gimbal, tmp_path):
+    gimbal = still_gimbal
+    motion = MotionController(gimbal)
+    errors = []
+
+    def initialize():
+        try:
+            motion.run_exclusive(
+                lambda: gimbal.initialize(str(tmp_path / 'cal.json')))
+        except MotionAborted as e:
+            errors.append(e)
+
+    deadline = time.monotonic() + 2.
+    while gimbal.imu.last_yaw is None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    thread = threading.Thread(target=initialize)
+    thread.start()
+    # The first sweep holds a pitch relay on until the IMU plateaus
+    while not gimbal.pitch_relays[0].is_lit:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    started = time.monotonic()
+    motion.halt()
+    assert time.monotonic() - started < 0.1
+    relays = gimbal.yaw_relays + gimbal.pitch_relays
+    assert not any(relay.is_lit for relay in relays)
+
+    thread.join(timeout=1.)
+    assert not thread.is_alive()
+    assert len(errors) == 1
+    assert not (tmp_path / 'cal.json').exists()
+
+
+def test_run_exclusive_after_halt(cold_gimbal):
+    motion = MotionController(cold_gimbal)
+    motion.halt()
+    assert motion.run_exclusive(lambda: 'done') == 'done'
+    assert not cold_gimbal.abort.is_set()
+
+
+def test_nudge_is_skipped_while_imu_is_cold(cold_gimbal):
+    motion = MotionController(cold_gimbal)
+    assert motion.nudge(yaw_delta=2., pitch_delta=1.) is None
+    assert motion._mailbox is None
+
+
+def test_coarse_target_applies_while_imu_is_cold(cold_gimbal):
+    aimer = VisionAimer(MotionController(cold_gimbal), cold_gimbal)
+    # Pretend vision has a lock
+    aimer._last_detection_at = time.monotonic()
+    assert aimer.allows_coarse_target(90.)
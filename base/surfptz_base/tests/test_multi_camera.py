@@ -0,0 +1,35 @@
+import json
+
+import pytest
+
+from panasonic_camera import multi_camera
+from panasonic_camera.camera_cache import CachedCamera
+from panasonic_camera.camera_manager import PanasonicCameraManager
+from panasonic_camera.multi_camera import MultiCameraManager
+
+
+@pytest.fixture
+def registry_path(tmp_path, monkeypatch):
+    path = tmp_path / 'cameras.json'
+    path.write_text(json.dumps({
+        'uuid:a': {'camera_id': 'cam0', 'port': 49199},
+        'uuid:b': {'camera_id': 'cam1', 'port': 49200},
+    }))
+    CachedCamera(hostname='192.168.0.10').save(
+        str(tmp_path / 'camera-cam0.json'))
+
+    def discover():
+        raise AssertionError('scanned instead of using the cache')
+
+    monkeypatch.setattr(multi_camera, 'discover_panasonic_camera_devices',
+                        discover)
+    monkeypatch.setattr(PanasonicCameraManager, 'start', lambda self: None)
+    return str(path)
+
+
+def test_known_cameras_connect_without_a_scan(registry_path):
+    manager = MultiCameraManager(registry_path=registry_path)
+    assert manager.connect_cached() == 1
+    assert manager.states() == {
+        'cam0': {'state': 'discovering', 'hostname': '192.168.0.10',
+                 'port': 49199}}
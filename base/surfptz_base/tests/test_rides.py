@@ -0,0 +1,65 @@
+from rides import RideDetector, RideIndex
+from tags import TagState
+
+
+class FakeCameras:
+    def __init__(self):
+        self.calls = []
+        self.error = None
+
+    def start(self):
+        self.calls.append('start')
+        return {'cam0': self.error}
+
+    def stop(self):
+        self.calls.append('stop')
+        return {'cam0': self.error}
+
+
+def make_detector(tmp_path, cameras, now):
+    detector = RideDetector(cameras.start, cameras.stop,
+                            index=RideIndex(str(tmp_path / 'rides.jsonl')),
+                            clock=lambda: now[0])
+    detector.set_enabled(True)
+    return detector
+
+
+def report(detector, speed, riding, now):
+    detector.on_tag(TagState('tag', now[0], 0., 0., speed=speed,
+                             riding=riding))
+    detector._update()
+
+
+def test_silent_tag_ends_ride_and_recording(tmp_path):
+    cameras = FakeCameras()
+    now = [1000.]
+    detector = make_detector(tmp_path, cameras, now)
+    report(detector, 5., False, now)
+    now[0] += 2
+    report(detector, 5., True, now)
+    assert cameras.calls == ['start']
+    # The tag goes silent while riding
+    for _ in range(20):
+        now[0] += 1
+        detector._update()
+    assert cameras.calls == ['start', 'stop']
+    rides = detector.index.read()
+    assert len(rides) == 1 and rides[0]['ride_end'] == 1002.
+
+
+def test_failed_start_is_retried(tmp_path):
+    cameras = FakeCameras()
+    cameras.error = 'timeout'
+    now = [1000.]
+    detector = make_detector(tmp_path, cameras, now)
+    report(detector, 5., False, now)
+    assert cameras.calls == ['start']
+    assert not detector._camera_recording
+    now[0] += 0.5
+    detector._update()
+    assert cameras.calls == ['start']
+    cameras.error = None
+    now[0] += detector.retry_s
+    report(detector, 5., False, now)
+    assert cameras.calls == ['start', 'start']
+    assert detector._camera_recording
@@ -0,0 +1,50 @@
+import time
+from types import SimpleNamespace
+
+from zoom import AutoZoom, ZOOM_IN_FAST, ZOOM_STOP
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+def test_pulse_without_feedback_is_stopped():
+    clock = FakeClock()
+    sent = []
+    auto_zoom = AutoZoom(sent.append, clock=clock)
+    auto_zoom.set_enabled(True)
+    auto_zoom.on_ex_header(SimpleNamespace(zoomRatio=10))
+    # Far away, so the wanted zoom is well above 1x
+    auto_zoom.set_distance(200.)
+    assert sent == [ZOOM_IN_FAST]
+
+    # No more ex headers or fixes, only the background tick
+    clock.now = 0.3
+    auto_zoom.tick()
+    assert sent[-1] == ZOOM_IN_FAST
+    clock.now = 0.6
+    auto_zoom.tick()
+    assert sent[-1] == ZOOM_STOP
+    clock.now = 2.
+    auto_zoom.tick()
+    assert sent[-1] == ZOOM_STOP
+
+
+def test_tick_runs_in_background():
+    sent = []
+    auto_zoom = AutoZoom(sent.append, max_pulse_s=0.05, tick_s=0.01)
+    auto_zoom.set_enabled(True)
+    auto_zoom.on_ex_header(SimpleNamespace(zoomRatio=10))
+    auto_zoom.set_distance(200.)
+    auto_zoom.start()
+    try:
+        deadline = time.monotonic() + 1.
+        while sent[-1] != ZOOM_STOP and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        auto_zoom.cancel()
+    assert sent[-1] == ZOOM_STOP
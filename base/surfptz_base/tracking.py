@@ -0,0 +1,234 @@
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple, List
+
+import numpy as np
+
+from gimbal import local_transformer
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Measurement matrix: we only observe position
+_H = np.array([[1., 0., 0., 0.],
+               [0., 1., 0., 0.]])
+
+
+class ConstantVelocityKalman:
+    """
+    Kalman filter on a [northing, easting, v_north, v_east] state in meters
+    and meters per second, fed with position fixes in meters.
+    """
+
+    def __init__(self,
+                 t: float,
+                 northing: float,
+                 easting: float,
+                 accel_std: float = 1.0,
+                 measurement_std: float = 4.0,
+                 initial_speed_std: float = 5.0) -> None:
+        self.t = t
+        self.x = np.array([northing, easting, 0., 0.])
+        self.P = np.diag([measurement_std ** 2, measurement_std ** 2,
+                          initial_speed_std ** 2, initial_speed_std ** 2])
+        self._q = accel_std ** 2
+        self._R = np.eye(2) * measurement_std ** 2
+
+    def _transition(self, dt: float) -> Tuple[np.ndarray, np.ndarray]:
+        F = np.eye(4)
+        F[0, 2] = F[1, 3] = dt
+        dt2 = dt * dt
+        Q = np.zeros((4, 4))
+        Q[0, 0] = Q[1, 1] = dt2 * dt / 3
+        Q[0, 2] = Q[2, 0] = Q[1, 3] = Q[3, 1] = dt2 / 2
+        Q[2, 2] = Q[3, 3] = dt
+        return F, Q * self._q
+
+    def update(self, t: float, northing: float, easting: float) -> None:
+        dt = max(t - self.t, 0.)
+        F, Q = self._transition(dt)
+        x = F @ self.x
+        P = F @ self.P @ F.T + Q
+        y = np.array([northing, easting]) - x[:2]
+        S = P[:2, :2] + self._R
+        K = P[:, :2] @ np.linalg.inv(S)
+        self.x = x + K @ y
+        self.P = (np.eye(4) - K @ _H) @ P
+        self.t = t
+
+    def position_at(self, t: float) -> Tuple[float, float]:
+        """
+        Extrapolate the filtered position to time t without changing the
+        filter state.
+        """
+        dt = t - self.t
+        return (float(self.x[0] + self.x[2] * dt),
+                float(self.x[1] + self.x[3] * dt))
+
+    @property
+    def velocity(self) -> Tuple[float, float]:
+        return float(self.x[2]), float(self.x[3])
+
+
+class TargetTracker:
+    """
+    Filters the stream of fixes from each tag and predicts where the tag will
+    be once the gimbal has finished slewing to it.
+    """
+
+    def __init__(self,
+                 lead_s: float = 2.0,
+                 max_lead_s: float = 10.0,
+                 reset_after_s: float = 30.0,
+                 latency_smoothing: float = 0.2,
+                 **filter_kwargs) -> None:
+        self.lead_s = lead_s
+        self.max_lead_s = max_lead_s
+        self.reset_after_s = reset_after_s
+        self.latency_smoothing = latency_smoothing
+        self._filter_kwargs = filter_kwargs
+        self._filters: Dict[str, ConstantVelocityKalman] = {}
+        self._lock = threading.Lock()
+
+    def update(self,
+               tag_id: str,
+               t: float,
+               northing: float,
+               easting: float) -> bool:
+        """
+        Add a fix for tag_id. Fixes that aren't newer than the last one are
+        ignored and False is returned.
+        """
+        with self._lock:
+            kf = self._filters.get(tag_id)
+            if kf is None or t - kf.t > self.reset_after_s:
+                self._filters[tag_id] = ConstantVelocityKalman(
+                    t, northing, easting, **self._filter_kwargs)
+            elif t <= kf.t:
+                return False
+            else:
+                kf.update(t, northing, easting)
+            return True
+
+    def aim_point(self,
+                  tag_id: str,
+                  now: Optional[float] = None) -> Tuple[float, float]:
+        """
+        Predicted N, E position of tag_id after the current slew latency.
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            return self._filters[tag_id].position_at(now + self.lead_s)
+
+    def position(self, tag_id: str, t: float) -> Tuple[float, float]:
+        """
+        Filtered N, E position of tag_id at time t.
+        """
+        with self._lock:
+            return self._filters[tag_id].position_at(t)
+
+    def velocity(self, tag_id: str) -> Tuple[float, float]:
+        with self._lock:
+            return self._filters[tag_id].velocity
+
+    def record_slew_latency(self, seconds: float) -> None:
+        """
+        Blend a measured time-to-target of the gimbal into the prediction
+        lead time.
+        """
+        seconds = min(max(seconds, 0.), self.max_lead_s)
+        self.lead_s += self.latency_smoothing * (seconds - self.lead_s)
+        logger.debug(f'Slew latency {seconds:.2f}s, lead now {self.lead_s:.2f}s')
+
+
+def _bearing_error(aim_n, aim_e, true_n, true_e) -> np.ndarray:
+    """
+    Absolute angle in degrees between the bearings to aim and to truth, as
+    seen from the origin.
+    """
+    err = np.degrees(np.arctan2(aim_e, aim_n) - np.arctan2(true_e, true_n))
+    return np.abs((err + 180) % 360 - 180)
+
+
+def replay_track(t: np.ndarray,
+                 northing: np.ndarray,
+                 easting: np.ndarray,
+                 lead_s: float,
+                 **tracker_kwargs) -> Dict[str, float]:
+    """
+    Score aim error against a recorded track. After every fix the tracker's
+    aim point is compared with where the tag actually was lead_s later,
+    alongside the naive aim at the last reported position.
+    """
+    tracker = TargetTracker(lead_s=lead_s, **tracker_kwargs)
+    end = t[-1] - lead_s
+    predicted: List[Tuple[float, float]] = []
+    naive: List[Tuple[float, float]] = []
+    when: List[float] = []
+    for ti, ni, ei in zip(t, northing, easting):
+        tracker.update('replay', ti, ni, ei)
+        if ti > end:
+            break
+        predicted.append(tracker.aim_point('replay', now=ti))
+        naive.append((ni, ei))
+        when.append(ti + lead_s)
+    true_n = np.interp(when, t, northing)
+    true_e = np.interp(when, t, easting)
+    predicted_arr = np.array(predicted)
+    naive_arr = np.array(naive)
+    kalman_err = _bearing_error(predicted_arr[:, 0], predicted_arr[:, 1],
+                                true_n, true_e)
+    naive_err = _bearing_error(naive_arr[:, 0], naive_arr[:, 1],
+                               true_n, true_e)
+    return {
+        'fixes': len(when),
+        'kalman_mean_deg': float(np.mean(kalman_err)),
+        'kalman_p95_deg': float(np.percentile(kalman_err, 95)),
+        'naive_mean_deg': float(np.mean(naive_err)),
+        'naive_p95_deg': float(np.percentile(naive_err, 95)),
+    }
+
+
+def load_track(path: str,
+               origin: Optional[Tuple[float, float]] = None
+               ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Load a CSV track with t,lat,lon columns (t in seconds) and convert it to
+    N, E offsets in meters from origin (default: first fix).
+    """
+    data = np.genfromtxt(path, delimiter=',', names=True)
+    t, lat, lon = data['t'], data['lat'], data['lon']
+    if origin is None:
+        origin = (float(lat[0]), float(lon[0]))
+    xfrmr = local_transformer(lat=origin[0], lon=origin[1])
+    origin_e, origin_n = xfrmr.transform(origin[1], origin[0])
+    eastings, northings = xfrmr.transform(lon, lat)
+    return t, northings - origin_n, eastings - origin_e
+
+
+def _main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Replay recorded tag tracks through the target tracker "
+                    "and score aim error.")
+    parser.add_argument('tracks', nargs='+',
+                        help="CSV files with t,lat,lon columns")
+    parser.add_argument('--lead', type=float, default=2.0,
+                        help="Slew latency to predict over, in seconds.")
+    parser.add_argument('--origin', type=float, nargs=2,
+                        metavar=('LAT', 'LON'),
+                        help="Camera position. Defaults to the first fix.")
+    args = parser.parse_args()
+    for path in args.tracks:
+        t, n, e = load_track(path, origin=args.origin)
+        score = replay_track(t, n, e, lead_s=args.lead)
+        print(f"{path}: {score['fixes']} fixes, "
+              f"kalman {score['kalman_mean_deg']:.2f} deg mean "
+              f"({score['kalman_p95_deg']:.2f} p95), "
+              f"naive {score['naive_mean_deg']:.2f} deg mean "
+              f"({score['naive_p95_deg']:.2f} p95)")
+
+
+if __name__ == '__main__':
+    _main()
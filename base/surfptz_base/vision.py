@@ -0,0 +1,215 @@
+"""
+Closed-loop framing from live view frames: a cheap motion/blob tracker finds
+the surfer in downscaled frames, and its offset from the frame center is
+turned into small gimbal corrections. GPS is only needed for coarse pointing.
+
+Benchmark on recorded JPEG frames or a live view capture:
+
+    python vision.py frames/*.jpg --scale 4
+    python vision.py --capture beach.lvcap
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+from planner import wrap_180
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Detection:
+    # Offset of the target from the frame center, -1 to 1 of half the frame
+    # width/height. Positive x is right, positive y is down.
+    x: float
+    y: float
+    # Fraction of the analysed pixels that moved
+    coverage: float
+
+
+class MotionBlobTracker:
+    """
+    Detects the moving blob in a frame by differencing against a running
+    average background, working on a grayscale image reduced to about
+    width pixels wide.
+    """
+
+    def __init__(self,
+                 width: int = 96,
+                 background_rate: float = 0.05,
+                 threshold: float = 25.,
+                 min_coverage: float = 0.002,
+                 max_coverage: float = 0.25,
+                 smoothing: float = 0.5) -> None:
+        self.width = width
+        self.background_rate = background_rate
+        self.threshold = threshold
+        self.min_coverage = min_coverage
+        self.max_coverage = max_coverage
+        self.smoothing = smoothing
+        self._background: Optional[np.ndarray] = None
+        self._last: Optional[Detection] = None
+
+    def reset(self) -> None:
+        self._background = None
+        self._last = None
+
+    def _reduce(self, rgb: np.ndarray) -> np.ndarray:
+        factor = max(rgb.shape[1] // self.width, 1)
+        h = rgb.shape[0] // factor * factor
+        w = rgb.shape[1] // factor * factor
+        gray = rgb[:h, :w, 1].astype(np.float32)
+        if factor > 1:
+            gray = gray.reshape(h // factor, factor, w // factor, factor)
+            gray = gray.mean(axis=(1, 3))
+        return gray
+
+    def update(self, rgb: np.ndarray) -> Optional[Detection]:
+        gray = self._reduce(rgb)
+        if self._background is None or self._background.shape != gray.shape:
+            self._background = gray
+            return None
+        mask = np.abs(gray - self._background) > self.threshold
+        self._background += self.background_rate * (gray - self._background)
+        coverage = float(mask.mean())
+        if coverage > self.max_coverage:
+            # Everything changed, e.g. the camera panned or zoomed
+            self._background = gray
+            self._last = None
+            return None
+        if coverage < self.min_coverage:
+            return None
+        ys, xs = np.nonzero(mask)
+        h, w = mask.shape
+        x = float(xs.mean()) / (w - 1) * 2 - 1
+        y = float(ys.mean()) / (h - 1) * 2 - 1
+        if self._last is not None:
+            x = self._last.x + self.smoothing * (x - self._last.x)
+            y = self._last.y + self.smoothing * (y - self._last.y)
+        self._last = Detection(x=x, y=y, coverage=coverage)
+        return self._last
+
+
+class VisionAimer:
+    """
+    Turns detections into corrections for the MotionController. The
+    correction is the detection offset times half the field of view, which
+    shrinks as the camera zooms in.
+    """
+
+    def __init__(self,
+                 motion,
+                 gimbal,
+                 tracker: Optional[MotionBlobTracker] = None,
+                 horizontal_fov: float = 60.,
+                 vertical_fov: float = 34.,
+                 gain: float = 0.6,
+                 deadband: float = 0.5,
+                 lock_timeout: float = 1.0,
+                 coarse_tolerance: float = 10.) -> None:
+        self.motion = motion
+        self.gimbal = gimbal
+        self.tracker = tracker or MotionBlobTracker()
+        self.horizontal_fov = horizontal_fov
+        self.vertical_fov = vertical_fov
+        self.gain = gain
+        self.deadband = deadband
+        self.lock_timeout = lock_timeout
+        self.coarse_tolerance = coarse_tolerance
+        # Updated from the live view zoom ratio when available
+        self.zoom_ratio: float = 1.
+        self._last_detection_at = -float('inf')
+        self._lock = threading.Lock()
+
+    def on_frame(self, frame) -> None:
+        """
+        LiveViewPipeline consumer callback for decoded frames.
+        """
+        with self._lock:
+            detection = self.tracker.update(frame.image)
+            if detection is None:
+                return
+            self._last_detection_at = time.monotonic()
+        yaw_error = detection.x * self.horizontal_fov / 2 / self.zoom_ratio
+        pitch_error = -detection.y * self.vertical_fov / 2 / self.zoom_ratio
+        if max(abs(yaw_error), abs(pitch_error)) < self.deadband:
+            return
+        logger.debug(f'vision correction yaw {yaw_error:.2f} '
+                     f'pitch {pitch_error:.2f}')
+        self.motion.nudge(yaw_delta=self.gain * yaw_error,
+                          pitch_delta=self.gain * pitch_error)
+
+    def has_lock(self) -> bool:
+        return time.monotonic() - self._last_detection_at < self.lock_timeout
+
+    def allows_coarse_target(self, yaw_angle: float) -> bool:
+        """
+        Whether a GPS target should be applied. While vision has a lock, GPS
+        targets close to the current bearing are ignored so the two don't
+        fight; far away ones still win, as do all of them while the bearing
+        is unknown.
+        """
+        if not self.has_lock() or \
+                self.gimbal.imu.is_stale(self.gimbal.imu_max_age):
+            return True
+        return abs(wrap_180(yaw_angle - self.gimbal.get_bearing())) \
+            > self.coarse_tolerance
+
+
+def _read_files(paths) -> List[bytes]:
+    jpegs = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            jpegs.append(f.read())
+    return jpegs
+
+
+def benchmark(jpegs: List[bytes], scale: int = 4, **tracker_kwargs) -> None:
+    from panasonic_camera.live_view_pipeline import decode_jpeg
+    tracker = MotionBlobTracker(**tracker_kwargs)
+    detections = 0
+    decode_time = 0.
+    track_time = 0.
+    for jpeg in jpegs:
+        start = time.perf_counter()
+        image = decode_jpeg(jpeg, scale)
+        decoded = time.perf_counter()
+        if tracker.update(image) is not None:
+            detections += 1
+        track_time += time.perf_counter() - decoded
+        decode_time += decoded - start
+    n = len(jpegs)
+    print(f'{n} frames, {detections} detections')
+    print(f'decode {decode_time / n * 1000:.2f} ms/frame, '
+          f'track {track_time / n * 1000:.2f} ms/frame, '
+          f'{n / (decode_time + track_time):.1f} fps overall')
+
+
+def _main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Benchmark the vision tracker on recorded JPEG frames.")
+    parser.add_argument('frames', nargs='*', help="JPEG files, in order")
+    parser.add_argument('--capture',
+                        help="Live view capture file to read frames from.")
+    parser.add_argument('--scale', type=int, default=4, choices=(1, 2, 4, 8),
+                        help="JPEG decoder downscaling factor.")
+    parser.add_argument('--width', type=int, default=96,
+                        help="Width in pixels the tracker works at.")
+    args = parser.parse_args()
+    if args.capture:
+        from panasonic_camera.live_view_capture import iter_jpegs
+        jpegs = list(iter_jpegs(args.capture))
+    else:
+        jpegs = _read_files(args.frames)
+    if not jpegs:
+        parser.error('no frames given')
+    benchmark(jpegs, scale=args.scale, width=args.width)
+
+
+if __name__ == '__main__':
+    _main()
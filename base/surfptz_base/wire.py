@@ -0,0 +1,83 @@
+"""
+Compact binary format for batches of GPS fixes sent by the tag app.
+
+    header:  u8 version, u8 tag id length, u16 fix count
+    tag id:  utf-8
+    fixes:   i64 unix time in ms, f64 lat, f64 lon, f32 accuracy in m
+
+Single fixes can also be streamed as UDP datagrams, one per fix:
+
+    header:  u8 version, u8 tag id length, u32 sequence number
+    tag id:  utf-8
+    fix:     as above
+
+All little-endian. tag/tag_app/wire.py has the tag side of this format.
+"""
+import struct
+from dataclasses import dataclass
+from typing import List, Sequence, Tuple
+
+VERSION = 1
+CONTENT_TYPE = 'application/vnd.surfptz.fixes'
+_HEADER = struct.Struct('<BBH')
+_FIX = struct.Struct('<qddf')
+_DATAGRAM_HEADER = struct.Struct('<BBI')
+
+
+@dataclass(frozen=True)
+class Fix:
+    # Unix time in seconds
+    t: float
+    lat: float
+    lon: float
+    accuracy: float = 0.
+
+
+def encode_fixes(tag_id: str, fixes: Sequence[Fix]) -> bytes:
+    tag = tag_id.encode()
+    parts = [_HEADER.pack(VERSION, len(tag), len(fixes)), tag]
+    for fix in fixes:
+        parts.append(_FIX.pack(round(fix.t * 1000), fix.lat, fix.lon,
+                               fix.accuracy))
+    return b''.join(parts)
+
+
+def decode_fixes(data: bytes) -> Tuple[str, List[Fix]]:
+    """
+    Raises ValueError if data isn't a complete batch.
+    """
+    if len(data) < _HEADER.size:
+        raise ValueError('batch too short')
+    version, tag_length, count = _HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f'unsupported batch version {version}')
+    offset = _HEADER.size + tag_length
+    if len(data) != offset + count * _FIX.size:
+        raise ValueError(f'batch of {count} fixes has {len(data)} bytes')
+    tag_id = bytes(data[_HEADER.size:offset]).decode()
+    fixes = [Fix(t_ms / 1000, lat, lon, accuracy)
+             for t_ms, lat, lon, accuracy in _FIX.iter_unpack(data[offset:])]
+    return tag_id, fixes
+
+
+def encode_position(tag_id: str, seq: int, fix: Fix) -> bytes:
+    tag = tag_id.encode()
+    return (_DATAGRAM_HEADER.pack(VERSION, len(tag), seq) + tag +
+            _FIX.pack(round(fix.t * 1000), fix.lat, fix.lon, fix.accuracy))
+
+
+def decode_position(data: bytes) -> Tuple[str, int, Fix]:
+    """
+    Raises ValueError if data isn't a complete position datagram.
+    """
+    if len(data) < _DATAGRAM_HEADER.size:
+        raise ValueError('datagram too short')
+    version, tag_length, seq = _DATAGRAM_HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f'unsupported datagram version {version}')
+    offset = _DATAGRAM_HEADER.size + tag_length
+    if len(data) != offset + _FIX.size:
+        raise ValueError(f'position datagram has {len(data)} bytes')
+    tag_id = bytes(data[_DATAGRAM_HEADER.size:offset]).decode()
+    t_ms, lat, lon, accuracy = _FIX.unpack_from(data, offset)
+    return tag_id, seq, Fix(t_ms / 1000, lat, lon, accuracy)
@@ -0,0 +1,156 @@
+"""
+Automatic zoom: keeps the subject at a constant size in the frame by
+comparing the zoom ratio reported in the live view ex headers with the
+ratio the target distance calls for, and pulsing zoom commands to close
+the gap.
+"""
+import logging
+import math
+import threading
+import time
+from typing import Callable, Optional
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+ZOOM_IN_SLOW = 'zoom_in_slow'
+ZOOM_IN_FAST = 'zoom_in_fast'
+ZOOM_OUT_SLOW = 'zoom_out_slow'
+ZOOM_OUT_FAST = 'zoom_out_fast'
+ZOOM_STOP = 'zoom_stop'
+
+
+def zoom_ratio_from_ex_header(ex_header) -> Optional[float]:
+    """
+    Optical zoom ratio from an ExHeader1/ExHeader2 based live view header,
+    which report it in tenths (10 is 1x).
+    """
+    zoom_ratio = getattr(ex_header, 'zoomRatio', None)
+    if not zoom_ratio:
+        return None
+    return zoom_ratio / 10
+
+
+class AutoZoom(threading.Thread):
+    """
+    Zoom controller. The wanted zoom ratio frames frame_width meters at the
+    target distance, given the camera's horizontal field of view at 1x.
+    The error is taken as a log ratio, so it means the same at 2x as at
+    40x. Within deadband the zoom is stopped, beyond fast_threshold the
+    fast zoom speed is used. Zooming happens in pulses of at most
+    max_pulse_s, with settle_s between them for the zoom ratio reported by
+    the camera to catch up, and stops if that feedback goes missing. Both
+    limits are also checked every tick_s seconds on a background thread, so
+    a pulse ends even when ex headers and fixes stop arriving.
+    """
+
+    def __init__(self,
+                 submit: Callable[[str], None],
+                 horizontal_fov: float = 60.,
+                 frame_width: float = 12.,
+                 max_zoom: float = 60.,
+                 deadband: float = 0.15,
+                 fast_threshold: float = 0.7,
+                 max_pulse_s: float = 0.5,
+                 settle_s: float = 0.3,
+                 feedback_timeout: float = 1.,
+                 tick_s: float = 0.1,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        super().__init__(name='auto-zoom', daemon=True)
+        self.submit = submit
+        self.horizontal_fov = horizontal_fov
+        self.frame_width = frame_width
+        self.max_zoom = max_zoom
+        self.deadband = deadband
+        self.fast_threshold = fast_threshold
+        self.max_pulse_s = max_pulse_s
+        self.settle_s = settle_s
+        self.feedback_timeout = feedback_timeout
+        self.tick_s = tick_s
+        self.clock = clock
+        self.enabled = False
+        self.zoom_ratio: Optional[float] = None
+        self.distance: Optional[float] = None
+        self._zoom_ratio_at = -float('inf')
+        self._command: str = ZOOM_STOP
+        self._command_at = -float('inf')
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def wanted_zoom_ratio(self, distance: float) -> float:
+        wide_width = 2 * distance * math.tan(
+            math.radians(self.horizontal_fov) / 2)
+        return min(max(wide_width / self.frame_width, 1.), self.max_zoom)
+
+    def set_enabled(self, enabled: bool) -> None:
+        with self._lock:
+            self.enabled = enabled
+            if not enabled:
+                self._send(ZOOM_STOP)
+
+    def set_distance(self, distance: float) -> None:
+        with self._lock:
+            self.distance = distance
+            self._update()
+
+    def on_ex_header(self, ex_header) -> None:
+        """
+        LiveView ex header listener.
+        """
+        zoom_ratio = zoom_ratio_from_ex_header(ex_header)
+        if zoom_ratio is None:
+            return
+        with self._lock:
+            self.zoom_ratio = zoom_ratio
+            self._zoom_ratio_at = self.clock()
+            self._update()
+
+    def tick(self) -> None:
+        """
+        Enforce max_pulse_s and feedback_timeout without new input.
+        """
+        with self._lock:
+            self._update()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.tick_s):
+            self.tick()
+
+    def cancel(self) -> None:
+        self._stop_event.set()
+
+    def _send(self, command: str) -> None:
+        # Caller must hold _lock
+        if command == self._command:
+            return
+        self._command = command
+        self._command_at = self.clock()
+        logger.debug(f'auto zoom {command} at {self.zoom_ratio}x '
+                     f'for {self.distance} m')
+        self.submit(command)
+
+    def _update(self) -> None:
+        # Caller must hold _lock
+        if not self.enabled or self.distance is None:
+            return
+        now = self.clock()
+        if self.zoom_ratio is None or \
+                now - self._zoom_ratio_at > self.feedback_timeout:
+            # Zooming blind could run to either end of the range
+            self._send(ZOOM_STOP)
+            return
+        if self._command == ZOOM_STOP:
+            if now - self._command_at < self.settle_s:
+                return
+        elif now - self._command_at > self.max_pulse_s:
+            self._send(ZOOM_STOP)
+            return
+        error = math.log(self.wanted_zoom_ratio(self.distance) /
+                         self.zoom_ratio)
+        if abs(error) < self.deadband:
+            self._send(ZOOM_STOP)
+        elif error > 0:
+            self._send(ZOOM_IN_FAST if error > self.fast_threshold
+                       else ZOOM_IN_SLOW)
+        else:
+            self._send(ZOOM_OUT_FAST if -error > self.fast_threshold
+                       else ZOOM_OUT_SLOW)
@@ -8,6 +8,8 @@ import requests
 import json
 from datetime import datetime
 
+from sender import FixSender, DatagramFixSender, load_tag_id
+
 
 class SurfptzTagApp(App):
 
@@ -17,14 +19,25 @@ class SurfptzTagApp(App):
         'Base': 'http://10.128.0.1:5000/',
         'Firebase': 'https://surfptz-default-rtdb.firebaseio.com/.json'
     }
+    # 'udp' streams fixes as datagrams, 'http' posts batches to api/track
+    position_transport = 'udp'
     
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.send_to = 'Base'
         self._latest_latlon = None
+        # Every phone reports as its own tag
+        self.tag_id = load_tag_id(self.user_data_dir)
+        if self.position_transport == 'udp':
+            self.sender = DatagramFixSender(self.tag_id)
+        else:
+            self.sender = FixSender(self.tag_id)
+        self.sender.base_url = self.dest_addrs[self.send_to]
+        self.sender.start()
     
     def set_dest_addr(self, dest):
         self.send_to = dest
+        self.sender.base_url = self.dest_addrs.get(dest)
     
     def post_to_base_api(self, endpoint: str):
         url = f'{self.dest_addrs[self.send_to]}{endpoint}'
@@ -92,16 +105,10 @@ class SurfptzTagApp(App):
         self._latest_latlon = {'lat': kwargs['lat'], 'lon': kwargs['lon']}
         # timestamp = datetime.now().isoformat()
         # gps_data = json.dumps({timestamp: kwargs})
-        if self.send_to:
-            try:
-                res = requests.post(
-                    url=f'{self.dest_addrs[self.send_to]}api/abscoords',
-                    data=self._latest_latlon,
-                    params=self._latest_latlon
-                )
-                print(res.text)
-            except:
-                print('Failed sending location')
+        if self.send_to in self.dest_addrs:
+            # Never blocks the UI on the network
+            self.sender.submit(lat=kwargs['lat'], lon=kwargs['lon'],
+                               accuracy=kwargs.get('accuracy'))
 
     @mainthread
     def on_status(self, stype, status):
@@ -0,0 +1,154 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from urllib.parse import urlparse
+
+import requests
+
+from wire import CONTENT_TYPE, encode_fixes, encode_position
+
+POSITION_PORT = 5005
+
+
+def load_tag_id(directory):
+    """
+    This device's tag id, generated on first use and kept in directory (the
+    app's storage dir) so the base can tell phones apart across restarts.
+    """
+    path = os.path.join(directory, 'tag_id')
+    try:
+        with open(path) as f:
+            tag_id = f.read().strip()
+        if tag_id:
+            return tag_id
+    except FileNotFoundError:
+        pass
+    tag_id = uuid.uuid4().hex[:8]
+    os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(tag_id)
+    return tag_id
+
+
+class FixSender(threading.Thread):
+    """
+    Sends GPS fixes to the base from a background thread so the UI never
+    waits on the network. Fixes queued while the link is down are sent
+    together as one batch once it's back, minus any that are older than
+    max_age and no longer worth pointing at.
+    """
+
+    def __init__(self, tag_id, max_age=10., max_pending=32,
+                 timeout=2., max_backoff=8.):
+        super().__init__(daemon=True)
+        self.tag_id = tag_id
+        self.base_url = None
+        self.max_age = max_age
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.sent = 0
+        self.dropped = 0
+        self._pending = deque(maxlen=max_pending)
+        self._condition = threading.Condition()
+        self._session = requests.Session()
+        self._stopped = False
+
+    def submit(self, lat, lon, accuracy=0., t=None):
+        with self._condition:
+            self._pending.append(
+                (time.time() if t is None else t, lat, lon, accuracy or 0.))
+            self._condition.notify()
+
+    def _take_batch(self):
+        with self._condition:
+            while not self._pending and not self._stopped:
+                self._condition.wait()
+            oldest = time.time() - self.max_age
+            while self._pending and self._pending[0][0] < oldest:
+                self._pending.popleft()
+                self.dropped += 1
+            return list(self._pending)
+
+    def _post(self, batch):
+        response = self._session.post(
+            url=f'{self.base_url}api/track',
+            data=encode_fixes(self.tag_id, batch),
+            headers={'Content-Type': CONTENT_TYPE},
+            timeout=self.timeout)
+        response.raise_for_status()
+
+    def run(self):
+        backoff = 0.5
+        while not self._stopped:
+            batch = self._take_batch()
+            if not batch or self.base_url is None:
+                time.sleep(1)
+                continue
+            try:
+                self._post(batch)
+            except requests.RequestException as e:
+                print(f'Failed sending {len(batch)} fixes: {e}')
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            backoff = 0.5
+            self.sent += len(batch)
+            with self._condition:
+                # Fixes that arrived while posting stay queued
+                last_sent = batch[-1][0]
+                while self._pending and self._pending[0][0] <= last_sent:
+                    self._pending.popleft()
+
+    def cancel(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._session.close()
+
+
+class DatagramFixSender:
+    """
+    Streams each fix to the base as one sequence-numbered UDP datagram.
+    There are no retries: a lost fix is superseded by the next one, and
+    the base drops anything arriving out of order.
+    """
+
+    def __init__(self, tag_id, port=POSITION_PORT):
+        self.tag_id = tag_id
+        self.port = port
+        self.host = None
+        self.sent = 0
+        # Starting from the clock keeps numbers increasing across app
+        # restarts, fixes come at most a few per second
+        self._seq = int(time.time())
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    @property
+    def base_url(self):
+        return self.host
+
+    @base_url.setter
+    def base_url(self, url):
+        self.host = urlparse(url).hostname if url else None
+
+    def submit(self, lat, lon, accuracy=0., t=None):
+        if self.host is None:
+            return
+        self._seq = (self._seq + 1) & 0xffffffff
+        packet = encode_position(self.tag_id, self._seq,
+                                 time.time() if t is None else t,
+                                 lat, lon, accuracy or 0.)
+        try:
+            self._sock.sendto(packet, (self.host, self.port))
+            self.sent += 1
+        except OSError as e:
+            print(f'Failed sending fix: {e}')
+
+    def start(self):
+        pass
+
+    def cancel(self):
+        self._sock.close()
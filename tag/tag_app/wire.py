@@ -0,0 +1,28 @@
+"""
+Tag side of the binary GPS fix batch format, see
+base/surfptz_base/wire.py for the layout. Keep the two in sync.
+"""
+import struct
+
+VERSION = 1
+CONTENT_TYPE = 'application/vnd.surfptz.fixes'
+_HEADER = struct.Struct('<BBH')
+_FIX = struct.Struct('<qddf')
+_DATAGRAM_HEADER = struct.Struct('<BBI')
+
+
+def encode_fixes(tag_id, fixes):
+    """
+    fixes are (unix time in s, lat, lon, accuracy in m) tuples.
+    """
+    tag = tag_id.encode()
+    parts = [_HEADER.pack(VERSION, len(tag), len(fixes)), tag]
+    for t, lat, lon, accuracy in fixes:
+        parts.append(_FIX.pack(round(t * 1000), lat, lon, accuracy))
+    return b''.join(parts)
+
+
+def encode_position(tag_id, seq, t, lat, lon, accuracy):
+    tag = tag_id.encode()
+    return (_DATAGRAM_HEADER.pack(VERSION, len(tag), seq) + tag +
+            _FIX.pack(round(t * 1000), lat, lon, accuracy))